@@ -0,0 +1,179 @@
+"""Admission control for citizen photo reports.
+
+Every report costs a Gemini call and several API writes, so reports are
+admitted before any of that happens:
+
+- per user, per group chat and per bin token buckets cap how often one
+  person or one group can report, and how often one bin is re-analysed;
+- a bin verified within the last few minutes gets the latest verdict
+  back instead of a new analysis;
+- a global AI budget, shared with CCTV batches, spreads analyses out: a
+  report waits for a slot for up to AI_MAX_WAIT_SECONDS and is declined if
+  it would have to wait longer; the bin's token is then given back.
+
+A limited sender is told so once per LIMITED_NOTICE_SECONDS, so a flood
+does not turn into a flood of replies.
+"""
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+
+# Reports per user: a burst, then this many per minute
+USER_BURST = 5
+USER_PER_MINUTE = 6
+# Reports per group chat, across all its members
+CHAT_BURST = 10
+CHAT_PER_MINUTE = 12
+# Analyses per bin: a burst, then this many per minute
+BIN_BURST = 2
+BIN_PER_MINUTE = 1
+# A bin analysed this recently gets its latest verdict back
+VERIFIED_TTL_SECONDS = 300
+# AI calls across all users: a burst, then this many per minute
+AI_BURST = 10
+AI_PER_MINUTE = 30
+# Longest a report waits for an AI slot before it is declined
+AI_MAX_WAIT_SECONDS = 20
+# A user, chat or bin that keeps hitting a limit is told about it at most this often
+LIMITED_NOTICE_SECONDS = 60
+# Users, chats and bins remembered; the least recently seen are forgotten first
+ADMISSION_MAX_KEYS = 20000
+
+ADMIT = 'admit'
+USER_LIMITED = 'user_limited'
+CHAT_LIMITED = 'chat_limited'
+BIN_LIMITED = 'bin_limited'
+RECENTLY_VERIFIED = 'recently_verified'
+
+
+@dataclass(slots=True)
+class TokenBucket:
+    capacity: float
+    # Tokens added per second
+    rate: float
+    tokens: float = None
+    updated: float = 0.0
+
+    def refill(self, now: float):
+        if self.tokens is None:
+            self.tokens = self.capacity
+        else:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float, cost: float = 1.0):
+        """Take cost tokens if there are enough"""
+        self.refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def reserve(self, now: float, max_wait: float, cost: float = 1.0):
+        """Take cost tokens, going into debt for up to max_wait seconds of refill.
+        Returns the seconds to wait before using them, or None if that is too long.
+        """
+        self.refill(now)
+        wait = max(0.0, (cost - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= cost
+        return wait
+
+
+class AdmissionControl:
+    """Decides whether a photo report is analysed, answered from a recent verdict or declined"""
+    def __init__(self, max_keys: int = ADMISSION_MAX_KEYS):
+        self.max_keys = max_keys
+        self.users = OrderedDict()
+        self.chats = OrderedDict()
+        self.bins = OrderedDict()
+        # bin id -> (BinDetails with ai_analysis, verified at)
+        self.verified = OrderedDict()
+        # (decision, limited key) -> when the sender was last told about the limit
+        self.notices = OrderedDict()
+        self.ai = TokenBucket(AI_BURST, AI_PER_MINUTE / 60)
+        self.counts = Counter()
+
+    def _bucket(self, buckets: OrderedDict, key, capacity: float, per_minute: float):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(capacity, per_minute / 60)
+            if len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def admit(self, user_id, bin_id: str, now: float = None, chat_id=None):
+        """(decision, recent BinDetails or None) for a report about bin_id from user_id in chat_id"""
+        now = now or time.monotonic()
+        if user_id is not None and not self._bucket(self.users, user_id, USER_BURST, USER_PER_MINUTE).take(now):
+            decision, recent = USER_LIMITED, None
+        elif chat_id is not None and chat_id != user_id and \
+                not self._bucket(self.chats, chat_id, CHAT_BURST, CHAT_PER_MINUTE).take(now):
+            # A private chat has the user's id and is covered by the user bucket
+            decision, recent = CHAT_LIMITED, None
+        else:
+            recent = self.recent(bin_id, now)
+            if recent is not None:
+                decision = RECENTLY_VERIFIED
+            elif not self._bucket(self.bins, bin_id, BIN_BURST, BIN_PER_MINUTE).take(now):
+                decision = BIN_LIMITED
+            else:
+                decision = ADMIT
+        self.counts[decision] += 1
+        return decision, recent
+
+    def refund(self, bin_id: str):
+        """Give back the bin token of an admitted report that was not analysed after all"""
+        bucket = self.bins.get(bin_id)
+        if bucket is not None and bucket.tokens is not None:
+            bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+    def should_notify(self, decision: str, user_id, bin_id: str, chat_id=None, now: float = None):
+        """Whether a declined report gets a reply; each limit is announced once per LIMITED_NOTICE_SECONDS"""
+        now = now or time.monotonic()
+        if decision == USER_LIMITED:
+            key = (decision, user_id)
+        elif decision == CHAT_LIMITED:
+            key = (decision, chat_id)
+        else:
+            key = (decision, chat_id, bin_id)
+        last = self.notices.get(key)
+        if last is not None and now - last < LIMITED_NOTICE_SECONDS:
+            self.counts['notice_suppressed'] += 1
+            return False
+        self.notices[key] = now
+        self.notices.move_to_end(key)
+        if len(self.notices) > self.max_keys:
+            self.notices.popitem(last=False)
+        return True
+
+    def recent(self, bin_id: str, now: float = None):
+        entry = self.verified.get(bin_id)
+        if entry is None:
+            return None
+        if (now or time.monotonic()) - entry[1] >= VERIFIED_TTL_SECONDS:
+            del self.verified[bin_id]
+            return None
+        return entry[0]
+
+    def record_verdict(self, bin_id: str, bin_details, now: float = None):
+        """Remember a bin's freshly analysed state for VERIFIED_TTL_SECONDS"""
+        self.verified[bin_id] = (bin_details, now or time.monotonic())
+        self.verified.move_to_end(bin_id)
+        if len(self.verified) > self.max_keys:
+            self.verified.popitem(last=False)
+
+    async def acquire_ai(self, images: int = 1):
+        """Wait for slots for `images` images in the global AI budget; False if the wait would be too long"""
+        wait = self.ai.reserve(time.monotonic(), AI_MAX_WAIT_SECONDS, cost=images)
+        if wait is None:
+            self.counts['ai_declined'] += 1
+            return False
+        if wait > 0:
+            self.counts['ai_queued'] += 1
+            await asyncio.sleep(wait)
+        return True
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analytics.sqlite3")
+
+# Base bucket size of every metric; queries may ask for any multiple of it
+METRIC_BUCKET_SECONDS = {
+    # Bin fill events per Toza Hudud per day, value is the reported fill level
+    'bin_fill': 86400,
+    # Sensor readings per facility per hour
+    'temperature': 3600,
+    'humidity': 3600,
+}
+# Buckets are aligned to local (Tashkent) midnight
+LOCAL_UTC_OFFSET_SECONDS = 5 * 3600
+# How often in-memory partial aggregates are merged into SQLite
+AGGREGATE_FLUSH_SECONDS = 30
+
+
+def _merge(target: list, count: int, total: float, low: float, high: float):
+    target[0] += count
+    target[1] += total
+    target[2] = min(target[2], low)
+    target[3] = max(target[3], high)
+
+
+class AnalyticsAggregates:
+    """Time-bucketed count/sum/min/max rollups kept up to date as data flows through the bots.
+
+    Every (metric, key, bucket) holds a mergeable partial aggregate. New and
+    late values are folded into an in-memory partial for their own bucket, so
+    a late reading corrects the bucket it belongs to instead of the current
+    one. Partials are merged into a WITHOUT ROWID SQLite table by upsert, and
+    queries are primary-key range scans, so their cost follows the requested
+    range rather than the length of the history.
+    """
+    def __init__(self, db_path: str = ANALYTICS_DB_PATH):
+        self.db_path = db_path
+        self.db = None
+        # Flushes run in a worker thread while the event loop adds values
+        self.lock = threading.Lock()
+        # (metric, key, bucket) -> [count, sum, min, max] not yet in SQLite
+        self.pending = {}
+        # (metric, key) -> series id in SQLite
+        self.series_ids = {}
+
+    def get_db(self):
+        """Open the SQLite backend on first use"""
+        if self.db is None and self.db_path:
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS series ("
+                "id INTEGER PRIMARY KEY, metric TEXT NOT NULL, key TEXT NOT NULL, UNIQUE (metric, key))"
+            )
+            # Rows carry a small integer series id instead of repeating metric and key
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS aggregates ("
+                "series INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+                "count INTEGER NOT NULL, sum REAL NOT NULL, min REAL NOT NULL, max REAL NOT NULL, "
+                "PRIMARY KEY (series, bucket)) WITHOUT ROWID"
+            )
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.series_ids = {
+                (metric, key): series_id
+                for series_id, metric, key in self.db.execute("SELECT id, metric, key FROM series")
+            }
+        return self.db
+
+    def series_id(self, metric: str, key: str, create: bool = False):
+        """Integer id of a (metric, key) series; both bots share the database, so
+        a cache miss is looked up before a new series is created"""
+        series_id = self.series_ids.get((metric, key))
+        if series_id is not None:
+            return series_id
+        if create:
+            self.db.execute("INSERT OR IGNORE INTO series (metric, key) VALUES (?, ?)", (metric, key))
+        row = self.db.execute("SELECT id FROM series WHERE metric = ? AND key = ?", (metric, key)).fetchone()
+        if row is None:
+            return None
+        self.series_ids[(metric, key)] = row[0]
+        return row[0]
+
+    def bucket_start(self, timestamp: float, bucket_seconds: int):
+        shifted = int(timestamp) + LOCAL_UTC_OFFSET_SECONDS
+        return shifted - shifted % bucket_seconds - LOCAL_UTC_OFFSET_SECONDS
+
+    def add(self, metric: str, key, value: float, timestamp: float = None):
+        """Fold one value into its bucket"""
+        if value is None or key is None:
+            return
+        bucket = self.bucket_start(timestamp or time.time(), METRIC_BUCKET_SECONDS[metric])
+        value = float(value)
+        with self.lock:
+            partial = self.pending.get((metric, str(key), bucket))
+            if partial is None:
+                self.pending[(metric, str(key), bucket)] = [1, value, value, value]
+            else:
+                _merge(partial, 1, value, value, value)
+
+    def record_reading(self, facility_id, reading: dict):
+        """Add a sensor reading to its facility's hourly temperature and humidity buckets"""
+        timestamp = reading.get('timestamp')
+        self.add('temperature', facility_id, reading.get('temperature'), timestamp)
+        self.add('humidity', facility_id, reading.get('humidity'), timestamp)
+
+    def record_bin_update(self, bin_details, timestamp: float = None):
+        """Add a bin fill event to its Toza Hudud's daily bucket"""
+        self.add('bin_fill', bin_details.toza_hudud or 'unknown', bin_details.fill_level or 0, timestamp)
+
+    def flush(self):
+        """Merge pending partials into SQLite, returning the number of buckets written"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        db = self.get_db()
+        if db is None:
+            return 0
+        try:
+            with self.lock, db:
+                db.executemany(
+                    "INSERT INTO aggregates (series, bucket, count, sum, min, max) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (series, bucket) DO UPDATE SET "
+                    "count = count + excluded.count, sum = sum + excluded.sum, "
+                    "min = MIN(min, excluded.min), max = MAX(max, excluded.max)",
+                    [
+                        (self.series_id(metric, key, create=True), bucket, *partial)
+                        for (metric, key, bucket), partial in pending.items()
+                    ]
+                )
+        except sqlite3.Error as e:
+            # A rolled back transaction may have dropped newly created series
+            self.series_ids = {}
+            self.db.close()
+            self.db = None
+            logger.error(f"Analytics aggregate flush failed: {e}")
+            # Fold them back in so nothing is lost
+            with self.lock:
+                for key, partial in pending.items():
+                    if key in self.pending:
+                        _merge(self.pending[key], *partial)
+                    else:
+                        self.pending[key] = partial
+            return 0
+        return len(pending)
+
+    def query(self, metric: str, key, start: float, end: float, bucket_seconds: int = None):
+        """Aggregates of one metric and key for buckets starting in [start, end).
+        bucket_seconds must be a multiple of the metric's base bucket (e.g. 86400
+        for daily temperature). Returns [{'bucket', 'count', 'sum', 'avg', 'min', 'max'}].
+        """
+        base = METRIC_BUCKET_SECONDS[metric]
+        bucket_seconds = bucket_seconds or base
+        if bucket_seconds % base:
+            raise ValueError(f"Bucket size for {metric} must be a multiple of {base} seconds")
+        key = str(key)
+        start = self.bucket_start(start, base)
+        merged = {}
+
+        def fold(bucket, count, total, low, high):
+            target = self.bucket_start(bucket, bucket_seconds)
+            partial = merged.get(target)
+            if partial is None:
+                merged[target] = [count, total, low, high]
+            else:
+                _merge(partial, count, total, low, high)
+
+        db = self.get_db()
+        with self.lock:
+            series_id = self.series_id(metric, key) if db is not None else None
+            if series_id is not None:
+                rows = db.execute(
+                    "SELECT bucket, count, sum, min, max FROM aggregates "
+                    "WHERE series = ? AND bucket >= ? AND bucket < ?",
+                    (series_id, start, end)
+                ).fetchall()
+                for row in rows:
+                    fold(*row)
+            # Values not flushed yet are part of the answer too
+            for (pending_metric, pending_key, bucket), partial in self.pending.items():
+                if pending_metric == metric and pending_key == key and start <= bucket < end:
+                    fold(bucket, *partial)
+        return [
+            {
+                'bucket': bucket,
+                'count': count,
+                'sum': round(total, 3),
+                'avg': round(total / count, 3),
+                'min': low,
+                'max': high,
+            }
+            for bucket, (count, total, low, high) in sorted(merged.items())
+        ]
+
+    def keys(self, metric: str):
+        """Keys that have data for a metric"""
+        db = self.get_db()
+        found = set()
+        with self.lock:
+            if db is not None:
+                found.update(row[0] for row in db.execute("SELECT key FROM series WHERE metric = ?", (metric,)))
+            found.update(key for pending_metric, key, _ in self.pending if pending_metric == metric)
+        return sorted(found)
+
+    async def run(self):
+        """Flush partial aggregates every AGGREGATE_FLUSH_SECONDS"""
+        while True:
+            await asyncio.sleep(AGGREGATE_FLUSH_SECONDS)
+            try:
+                if self.pending:
+                    await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Analytics aggregate flush loop error: {e}")
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -0,0 +1,33 @@
+"""Platform login shared by the command-line tools"""
+import requests
+
+# Credentials the tools log in with (superadmin, per the backend seed data)
+TOOL_LOGIN = "superadmin"
+TOOL_PASSWORD = "123"
+LOGIN_TIMEOUT_SECONDS = 30
+
+
+def login_headers(api_base_url: str, login: str = TOOL_LOGIN, password: str = TOOL_PASSWORD):
+    """Log in and return the Authorization header for further requests; raises on failure"""
+    response = requests.post(f"{api_base_url}/auth/login/", json={"login": login, "password": password},
+                             timeout=LOGIN_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return {'Authorization': f"Token {response.json()['token']}"}
+
+
+class ToolLogin:
+    """Login headers for long-running tools, logged in again once the token is rejected"""
+    def __init__(self, api_base_url: str, login: str = TOOL_LOGIN, password: str = TOOL_PASSWORD):
+        self.api_base_url = api_base_url
+        self.login = login
+        self.password = password
+        self.cached = None
+
+    def headers(self):
+        if self.cached is None:
+            self.cached = login_headers(self.api_base_url, self.login, self.password)
+        return self.cached
+
+    def invalidate(self):
+        """Forget the current token; the next headers() call logs in again"""
+        self.cached = None
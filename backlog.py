@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Telegram returns at most 100 updates per getUpdates call
+BACKLOG_FETCH_LIMIT = 100
+# Safety cap so a flood of new updates cannot keep the drain going forever
+BACKLOG_MAX_UPDATES = 20000
+
+
+def load_journal(bot: Bot, path: str):
+    """Updates a previous run drained but did not finish replaying"""
+    if not path or not os.path.exists(path):
+        return []
+    updates = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                updates.append(Update.de_json(json.loads(line), bot))
+            except Exception as e:
+                # A torn last line from a crash mid-write
+                logger.warning(f"Skipping unreadable backlog journal entry: {e}")
+    if updates:
+        logger.info(f"Replaying {len(updates)} backlog updates left over from the last run")
+    return updates
+
+
+def append_journal(path: str, updates: list):
+    """Persist updates before Telegram is told they were received"""
+    with open(path, 'a', encoding='utf-8') as f:
+        for update in updates:
+            f.write(json.dumps(update.to_dict()) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def clear_journal(path: str):
+    """Forget the journal once every update in it has been replayed"""
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+async def drain_pending_updates(bot: Bot, journal_path: str = None):
+    """Fetch and confirm every update queued while the bot was offline.
+
+    Must run before polling starts (e.g. in Application.post_init). Confirmed
+    updates are not delivered to the Updater again, so the caller owns them.
+    Telegram confirms a page as soon as the next one is requested, so each page
+    is first appended to journal_path; the caller calls clear_journal() after
+    replaying them, and a crash before that replays the journal on the next start.
+    """
+    # getUpdates does not work while a webhook is set
+    await bot.delete_webhook(drop_pending_updates=False)
+
+    updates = load_journal(bot, journal_path)
+    journaled = {update.update_id for update in updates}
+    offset = None
+    while len(updates) < BACKLOG_MAX_UPDATES:
+        batch = await bot.get_updates(
+            offset=offset,
+            limit=BACKLOG_FETCH_LIMIT,
+            timeout=0,
+            allowed_updates=Update.ALL_TYPES
+        )
+        if not batch:
+            break
+        # A crash between journaling a page and confirming it leaves the page queued
+        fresh = [update for update in batch if update.update_id not in journaled]
+        if fresh and journal_path:
+            append_journal(journal_path, fresh)
+        updates.extend(fresh)
+        # Passing the next offset confirms everything fetched so far
+        offset = batch[-1].update_id + 1
+
+    if offset is not None:
+        # Confirm the last batch; anything newer stays queued for the Updater
+        await bot.get_updates(offset=offset, limit=1, timeout=0)
+        logger.info(f"Drained {len(updates)} pending updates from the backlog")
+    return updates
+
+
+async def replay_updates(application: Application, updates: list):
+    """Run backlog updates through the application's handlers one by one"""
+    for update in updates:
+        try:
+            await application.process_update(update)
+        except Exception as e:
+            logger.error(f"Error replaying backlog update {update.update_id}: {e}")
+    if updates:
+        logger.info(f"Backlog catch-up finished: {len(updates)} updates replayed")
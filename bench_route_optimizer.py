@@ -0,0 +1,59 @@
+"""Benchmark for route_optimizer at several problem sizes.
+
+Generates random full bins and trucks around Farg'ona, split across Toza
+Hudud districts, and reports planning time and total route length compared
+with the plain nearest-neighbour construction.
+
+Usage:
+    python bench_route_optimizer.py [sizes...]
+"""
+import sys
+import time
+
+import numpy as np
+
+import route_optimizer
+from records import BinDetails, Truck
+
+CENTER = (40.3864, 71.7864)
+DISTRICTS = 5
+BINS_PER_TRUCK = 30
+
+
+def make_problem(bin_count: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    truck_count = max(DISTRICTS, bin_count // BINS_PER_TRUCK)
+    bins = []
+    trucks = []
+    for i in range(bin_count):
+        district = i % DISTRICTS
+        lat = CENTER[0] + rng.normal(0, 0.02) + (district - 2) * 0.03
+        lng = CENTER[1] + rng.normal(0, 0.03)
+        bins.append(BinDetails(f"bin-{i}", is_full=True, toza_hudud=f"{district + 1}-sonli Toza Hudud", location=(lat, lng)))
+    for i in range(truck_count):
+        district = i % DISTRICTS
+        lat = CENTER[0] + rng.normal(0, 0.02) + (district - 2) * 0.03
+        lng = CENTER[1] + rng.normal(0, 0.03)
+        trucks.append(Truck(f"truck-{i}", toza_hudud=f"{district + 1}-sonli Toza Hudud", location=(lat, lng), fuel_level=80))
+    return trucks, bins
+
+
+def total_distance(plan):
+    return sum(route['distance_km'] for route in plan['routes'].values())
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 500, 1000, 2500, 5000]
+    print(f"{'bins':>6} {'trucks':>6} {'construct km':>13} {'optimized km':>13} {'gain':>6} {'unassigned':>10} {'time s':>7}")
+    for size in sizes:
+        trucks, bins = make_problem(size)
+        baseline = route_optimizer.plan_routes(trucks, bins, improvement_seconds=0)
+        started = time.perf_counter()
+        plan = route_optimizer.plan_routes(trucks, bins)
+        elapsed = time.perf_counter() - started
+        before, after = total_distance(baseline), total_distance(plan)
+        print(f"{size:>6} {len(trucks):>6} {before:>13.1f} {after:>13.1f} {100 * (before - after) / before:>5.1f}% {len(plan['unassigned']):>10} {elapsed:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
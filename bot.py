@@ -3,18 +3,29 @@ import asyncio
 import requests
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
+import html
 import json
 import os
 from urllib.parse import urlparse, parse_qs
-import base64
 from io import BytesIO
 import threading
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from backlog import clear_journal, drain_pending_updates, replay_updates
+from session_store import SessionStore
+from log_setup import configure_logging
+from tracing import Tracer, trace_headers
+from perf_tools import PerfProfiler
+from dispatch import TruckDispatcher, FLEET_REFRESH_SECONDS
+from gps_ingest import GPSIngestor
+from analytics_aggregates import AnalyticsAggregates, ANALYTICS_DB_PATH
+from cctv_scheduler import CCTVScheduler
+from image_workers import ImageWorkers
+from admission import AdmissionControl, ADMIT, CHAT_LIMITED, RECENTLY_VERIFIED, USER_LIMITED
+import records
+from records import AIAnalysis, BinDetails
+
+# Enable logging (background writer thread, see log_setup.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Bot token
@@ -29,6 +40,150 @@ CHANNEL_TO_MONITOR = "@springuzz"
 # API base URL
 API_BASE_URL = "https://deklorantapi.cdcgroup.uz/api"
 
+# Per-user conversation state (the bin a citizen last scanned)
+SESSION_MAX_USERS = 10000
+SESSION_TTL_SECONDS = 6 * 3600
+SESSION_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_sessions.sqlite3")
+
+# Truck GPS fixes are received on a local UDP port (see gps_ingest.py)
+GPS_INGEST_ENABLED = True
+
+# Photos sent as one album are analysed together once no new photo of it arrived for this long
+ALBUM_WINDOW_SECONDS = 2.0
+
+# Drained backlog updates are kept here until they have been replayed (see backlog.py)
+BACKLOG_JOURNAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backlog_bot.jsonl")
+# Backlog photo reports analysed at the same time while catching up
+BACKLOG_PHOTO_CONCURRENCY = 4
+
+# Camera snapshots of bins with a camera_url are analysed by priority (see cctv_scheduler.py)
+CCTV_SCHEDULER_ENABLED = True
+
+# Prompt for waste bin fill level detection
+AI_PROMPT = '''Siz tajriboli atrof-muhitni kuzatuv tizimi ekspertisiz. Rasmni tahlil qiling va quyidagilarni aniqlang:
+            
+            1. Rasmda chiqindi konteyneri bormi? Javob: HA yoki YO'Q.
+            
+            2. Agar HA bo'lsa, konteyner to'la bo'limi? Javob: HA yoki YO'Q.
+            - TO'LA BELGILARI: axlat konteyneri ochig'ida axlat ko'rinadi, axlat konteyneridan tashqari joyda axlat yoki sumkalar ko'rinadi, axlat konteyneri ochiq qopqog'i ostida axlatlar to'planib qolgan bo'lsa, axlat konteyneri butunlay axlat bilan qoplangan bo'lsa.
+            - BO'SH BELGILARI: axlat konteyneri ichida bo'sh joy ko'rinadi, axlat konteyneri ochig'i ochiq va ichi ko'rinadi, axlat konteyneri atrofida axlat yoki sumka yo'q.
+            
+            3. Agar HA bo'lsa, to'ldirish darajasini % (0-100) ko'rsating. Batafsil tahlil:
+            - 0-25%: Konteyner deyarli bo'sh, ichida kamroq axlat bor
+            - 26-50%: Konteyner taxminan yarim to'la
+            - 51-75%: Konteyner ko'pincha to'la, lekin hali joy bor
+            - 76-100%: Konteyner to'la, axlat tashqariga chiqib turgan yoki chiqib ketayotgan
+            
+            4. Agar YO'Q bo'lsa, rasmda nima borligini tushuntiring.
+            
+            5. Rasmda qanday obyektlar aniqlanganligini tavsifli ro'yxat ko'rinishida berin:
+            - Chiqindi konteyneri (shakl, rang, hajm, holati)
+            - Sumkalar (soni, rangi, joylashuvi)
+            - Axlatlar (turi, miqdori, joylashuvi)
+            - Boshqa obyektlar (odamlar, avtomobillar, bino, daraxt, ko'cha belgilari)
+            
+            6. Agar konteyner to'la bo'lsa, unga qanday chora ko'rish kerakligi bo'yicha takliflaringizni bering.
+            
+            7. Agar konteyner aniqlanmasa, kamera to'g'rimi yoki axlat konteyneri joyida emasmi yoki axlat aniqlanmadi deb xabar bering.
+            
+            Rasmni to'g'ri tekshirish uchun quyidagi belgilarni hisobga oling:
+            - Chiqindi konteyneri odatda to'rtburchak yoki silindrsimon shaklda bo'ladi
+            - Ko'pincha yashil, sariq, ko'k yoki qora rangda bo'ladi
+            - Yozuvlar, logolar yoki chiqindi turi ko'rsatiladi
+            - Qopqog'i yoki ochiq bo'lishi mumkin
+            - Ko'pincha ko'cha yoki bino yonida joylashadi
+            
+            Tahlil qilishda e'tibor bering:
+            - Konteyner ichidagi axlat miqdoriga
+            - Konteyner atrofidagi axlatlarga
+            - Qopqog'ining ochiq yoki yopiq ekanligiga
+            - Axlatning konteyner ichida yoki tashqarisida joylashganligiga
+            
+            Agar rasmda chiqindi konteyneri aniq ko'rinmasa, lekin atrofda bo'lsa, ham "HA" deb belgilang.
+            Agar rasmda chiqindi konteyneri to'la bo'lsa, "HA" deb belgilang, aks holda "YO'Q".
+            
+            Javobni JSON formatda quyidagi kalitlar bilan berin: 
+            - isWasteBin (BOOLEAN): Rasmda chiqindi konteyneri bor yoki yo'q
+            - isFull (BOOLEAN): Konteyner to'la yoki yo'q (batafsil tahlil asosida)
+            - fillLevel (NUMBER): To'ldirish darajasi (0-100%, tahlil asosida aniqroq aniqlash)
+            - confidence (NUMBER): AI ishonchlilik darajasi (0-100%, tahlil qanchalik aniq bo'lsa shuncha yuqori)
+            - notes (STRING): Batafsil tahlil natijasi va asoslangan fikr
+            - detectedObjects (ARRAY of STRING): Aniqlangan obyektlar ro'yxati
+            - suggestions (STRING): Tavsiyalaringiz
+            
+            Eslatma: Faqat JSON javobini bering, boshqa matn qo'shmang.'''
+
+AI_GENERATION_CONFIG = {
+    'responseMimeType': 'application/json',
+    'responseSchema': {
+        'type': 'OBJECT',
+        'properties': {
+            'isWasteBin': {'type': 'BOOLEAN'},
+            'isFull': {'type': 'BOOLEAN'},
+            'fillLevel': {'type': 'NUMBER'},
+            'confidence': {'type': 'NUMBER'},
+            'notes': {'type': 'STRING'},
+            'detectedObjects': {
+                'type': 'ARRAY',
+                'items': {'type': 'STRING'}
+            },
+            'suggestions': {'type': 'STRING'}
+        },
+        'required': ['isWasteBin', 'isFull', 'fillLevel', 'confidence', 'notes', 'detectedObjects', 'suggestions']
+    }
+}
+
+def build_ai_request_template():
+    """Encode the Gemini request once, split around the image data placeholder"""
+    placeholder = '__IMAGE_BASE64__'
+    body = records.dumps({
+        'contents': [{
+            'parts': [
+                {'text': AI_PROMPT},
+                {
+                    'inline_data': {
+                        'mime_type': 'image/jpeg',
+                        'data': placeholder
+                    }
+                }
+            ]
+        }],
+        'generationConfig': AI_GENERATION_CONFIG
+    })
+    prefix, suffix = body.split(placeholder.encode('utf-8'))
+    return prefix, suffix
+
+AI_REQUEST_PREFIX, AI_REQUEST_SUFFIX = build_ai_request_template()
+
+AI_BATCH_PROMPT = AI_PROMPT + '''
+
+            Sizga bir nechta rasm beriladi, har biri oldidan "Rasm N" yozuvi bor. Har bir rasmni alohida tahlil qiling
+            va javobni rasmlar tartibida, har bir rasm uchun bitta obyektdan iborat JSON massiv ko'rinishida bering.'''
+
+def build_ai_batch_request_template():
+    """Encode the multi-image Gemini request once, split where the image parts go"""
+    placeholder = '__IMAGE_PARTS__'
+    body = records.dumps({
+        'contents': [{
+            'parts': [
+                {'text': AI_BATCH_PROMPT},
+                placeholder
+            ]
+        }],
+        'generationConfig': {
+            'responseMimeType': 'application/json',
+            'responseSchema': {'type': 'ARRAY', 'items': AI_GENERATION_CONFIG['responseSchema']}
+        }
+    })
+    prefix, suffix = body.split(f'"{placeholder}"'.encode('utf-8'))
+    return prefix, suffix
+
+AI_BATCH_REQUEST_PREFIX, AI_BATCH_REQUEST_SUFFIX = build_ai_batch_request_template()
+
+def ai_configured():
+    """Whether a Gemini API key is set; without one a fixed placeholder analysis is used"""
+    return os.getenv('GEMINI_API_KEY', 'YOUR_API_KEY_HERE') != 'YOUR_API_KEY_HERE'
+
 class WasteBinBot:
     def __init__(self):
         self.bot_token = BOT_TOKEN
@@ -38,6 +193,28 @@ class WasteBinBot:
         self.admin_password = "123"
         self.api_token = None
         # We'll initialize the token when needed in async methods
+        self.sessions = SessionStore(SESSION_MAX_USERS, SESSION_TTL_SECONDS, SESSION_DB_PATH)
+        self.dispatcher = TruckDispatcher(self.api_base_url, self.get_auth_headers)
+        self.gps = GPSIngestor(self.api_base_url, self.get_auth_headers, self.dispatcher)
+        # Daily fill events per Toza Hudud, shared with the IoT monitor's analytics store
+        self.analytics = AnalyticsAggregates(ANALYTICS_DB_PATH)
+        # Stage timings of every handled photo, exported per TRACE_EXPORT (see tracing.py)
+        self.tracer = Tracer('waste-bin-bot')
+        # /perf command and local HTTP hook for profiling the running bot
+        self.profiler = PerfProfiler('waste-bin-bot')
+        # Base64 encoding and other CPU-bound image work, kept off the event loop
+        self.images = ImageWorkers()
+        # (chat id, media group id) -> photo updates of an album still arriving, and its flush timer
+        self.albums = {}
+        self.album_timers = {}
+        # Ids of backlog updates being replayed; their photos share BACKLOG_PHOTO_CONCURRENCY slots
+        self.replaying = set()
+        self.backlog_slots = asyncio.Semaphore(BACKLOG_PHOTO_CONCURRENCY)
+        self.backlog_tasks = set()
+        # Per-user and per-bin rate limits, recent verdicts and the global AI budget for photo reports
+        self.admission = AdmissionControl()
+        self.cctv = CCTVScheduler(self.api_base_url, self.get_auth_headers, self.analyze_cctv_images,
+                                  self.handle_cctv_full, self.images)
     
     async def ensure_authenticated(self):
         """Ensure we have a valid authentication token"""
@@ -82,6 +259,7 @@ class WasteBinBot:
         }
         if self.api_token:
             headers['Authorization'] = f'Token {self.api_token}'
+        headers.update(trace_headers())
         return headers
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -100,14 +278,14 @@ class WasteBinBot:
                     
                     # Ask user to send a photo
                     await update.message.reply_text(
-                        f"Konteyner: {bin_details.get('address', 'Noma\'lum')}\n\n"
+                        f"Konteyner: {bin_details.address or 'Noma\'lum'}\n\n"
                         f"Rasm yuboring iltimos!\n"
                         f"Eslatma: Agar konteyner to'la bo'lsa, tizim avtomatik ravishda xabarnoma yuboradi."
                     )
                     
-                    # Store bin ID in user context for later use
-                    if context.user_data is not None:
-                        context.user_data['current_bin_id'] = bin_id
+                    # Store bin ID in the user's session for later use
+                    if user:
+                        self.sessions.set(user.id, 'current_bin_id', bin_id)
                 else:
                     await update.message.reply_text(
                         f"Kechirasiz, bunday ID li konteyner topilmadi: {bin_id}"
@@ -138,14 +316,14 @@ class WasteBinBot:
                         
                         # Ask user to send a photo
                         await update.message.reply_text(
-                            f"Konteyner: {bin_details.get('address', 'Noma\'lum')}\n\n"
+                            f"Konteyner: {bin_details.address or 'Noma\'lum'}\n\n"
                             f"Rasm yuboring iltimos!\n"
                             f"Eslatma: Agar konteyner to'la bo'lsa, tizim avtomatik ravishda xabarnoma yuboradi."
                         )
                         
-                        # Store bin ID in user context for later use
-                        if context.user_data is not None:
-                            context.user_data['current_bin_id'] = bin_id
+                        # Store bin ID in the user's session for later use
+                        if update.effective_user:
+                            self.sessions.set(update.effective_user.id, 'current_bin_id', bin_id)
                     else:
                         await update.message.reply_text(
                             f"Kechirasiz, bunday ID li konteyner topilmadi: {bin_id}"
@@ -203,7 +381,7 @@ class WasteBinBot:
                 response = requests.get(f"{self.api_base_url}/waste-bins/{bin_id}/", headers=headers)
             
             if response.status_code == 200:
-                return response.json()
+                return BinDetails.from_dict(records.loads(response.content))
             elif response.status_code == 404:
                 # Bin not found
                 return None
@@ -215,16 +393,16 @@ class WasteBinBot:
             logger.error(f"Exception getting bin details: {e}")
             return None
 
-    async def send_bin_info(self, update: Update, bin_details: dict):
+    async def send_bin_info(self, update: Update, bin_details: BinDetails):
         """Send bin information to user"""
         if update.message:
             message = (
                 f"📦 <b>Konteyner Ma'lumotlari:</b>\n\n"
-                f"📍 <b>Manzil:</b> {bin_details.get('address', 'Noma\'lum')}\n"
-                f"🏷️ <b>ID:</b> {bin_details.get('id', 'Noma\'lum')}\n"
-                f"📊 <b>To'ldirish darajasi:</b> {bin_details.get('fill_level', 0)}%\n"
-                f"🚦 <b>Status:</b> {'To\'la' if bin_details.get('is_full', False) else 'Bo\'sh'}\n"
-                f"🏢 <b>Toza hudud:</b> {bin_details.get('toza_hudud', 'Noma\'lum')}\n\n"
+                f"📍 <b>Manzil:</b> {bin_details.address or 'Noma\'lum'}\n"
+                f"🏷️ <b>ID:</b> {bin_details.id}\n"
+                f"📊 <b>To'ldirish darajasi:</b> {bin_details.fill_level}%\n"
+                f"🚦 <b>Status:</b> {'To\'la' if bin_details.is_full else 'Bo\'sh'}\n"
+                f"🏢 <b>Toza hudud:</b> {bin_details.toza_hudud or 'Noma\'lum'}\n\n"
                 f"📷 <b>Tasvir yuborish:</b>\n"
                 f"Rasm yuboring iltimos! AI tizimi konteynerni tahlil qiladi.\n\n"
                 f"🤖 <b>AI Tahlili:</b>\n"
@@ -234,21 +412,72 @@ class WasteBinBot:
 
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle photo upload and update bin status with the image"""
+        if update.message and update.message.media_group_id:
+            self.collect_album(update, context)
+            return
+        # Reports can wait for an AI slot (see admission.py); run them as tasks so
+        # that wait never holds up other users' updates
+        if update.update_id in self.replaying:
+            self.replaying.discard(update.update_id)
+            task = context.application.create_task(self.replayed_photo(update, context), update=update)
+            self.backlog_tasks.add(task)
+            task.add_done_callback(self.backlog_tasks.discard)
+        else:
+            context.application.create_task(self.traced_photo(update, context), update=update)
+
+    async def traced_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        with self.tracer.trace('handle_photo', update_id=update.update_id):
+            await self.process_photo(update, context)
+
+    async def replayed_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """A backlog photo report, started once one of BACKLOG_PHOTO_CONCURRENCY slots is free"""
+        async with self.backlog_slots:
+            await self.traced_photo(update, context)
+
+    async def catch_up(self, application: Application, updates: list):
+        """Replay backlog updates and clear the journal once their photo reports have finished"""
+        self.replaying.update(update.update_id for update in updates)
+        await replay_updates(application, updates)
+        # Backlog albums are still waiting for their flush timers
+        pending = self.backlog_tasks | set(self.album_timers.values())
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        clear_journal(BACKLOG_JOURNAL)
+
+    def collect_album(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Hold back a photo of an album until the whole album has arrived"""
+        key = (update.message.chat_id, update.message.media_group_id)
+        self.albums.setdefault(key, []).append(update)
+        timer = self.album_timers.get(key)
+        if timer is not None:
+            timer.cancel()
+        self.album_timers[key] = asyncio.create_task(self.flush_album(key, context))
+
+    async def flush_album(self, key: tuple, context: ContextTypes.DEFAULT_TYPE):
+        await asyncio.sleep(ALBUM_WINDOW_SECONDS)
+        self.album_timers.pop(key, None)
+        updates = self.albums.pop(key, [])
+        if not updates:
+            return
+        updates.sort(key=lambda album_update: album_update.message.message_id)
+        try:
+            with self.tracer.trace('handle_album', update_id=updates[0].update_id, photos=len(updates)):
+                await self.process_photo(updates[0], context, [album_update.message.photo[-1] for album_update in updates])
+        except Exception as e:
+            logger.error(f"Error handling album {key[1]}: {e}")
+
+    async def process_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE, photos: list = None):
+        """Analyse a photo, or all photos of an album as one report, and update the bin"""
         if update.message:
             user = update.effective_user
             if update.message.photo:
-                photo = update.message.photo[-1]  # Get the highest resolution photo
-                
-                # Get the file from Telegram
-                file = await context.bot.get_file(photo.file_id)
-                
-                # Download the photo
-                photo_bytes = await file.download_as_bytearray()
+                # The highest resolution version of each photo
+                photos = photos or [update.message.photo[-1]]
                 
                 # Find the bin ID from context
                 bin_id = None
-                if context.user_data:
-                    bin_id = context.user_data.get('current_bin_id')
+                if user:
+                    bin_id = self.sessions.get(user.id, 'current_bin_id')
                 
                 if not bin_id:
                     # Try to find bin ID from recent command or message
@@ -258,34 +487,91 @@ class WasteBinBot:
                     )
                     return
                 
+                # Floods are turned away before anything is downloaded or analysed
+                decision, recent_bin = self.admission.admit(user.id if user else None, bin_id,
+                                                            chat_id=update.message.chat_id)
+                if decision == RECENTLY_VERIFIED:
+                    await self.send_recent_verdict(update, recent_bin)
+                    return
+                if decision != ADMIT:
+                    if not self.admission.should_notify(decision, user.id if user else None, bin_id,
+                                                        chat_id=update.message.chat_id):
+                        return
+                    await update.message.reply_text(
+                        "Juda ko'p rasm yuborildi. Iltimos, bir necha daqiqadan so'ng qayta urinib ko'ring."
+                        if decision in (USER_LIMITED, CHAT_LIMITED) else
+                        "Bu konteyner bo'yicha xabar hozirgina qabul qilindi. Rahmat!"
+                    )
+                    return
+                
+                # Get the files from Telegram
+                with self.tracer.span('get_file', file_size=sum(photo.file_size or 0 for photo in photos)):
+                    files = await asyncio.gather(*(context.bot.get_file(photo.file_id) for photo in photos))
+                
+                # Download the photos
+                with self.tracer.span('download') as span:
+                    downloads = await asyncio.gather(*(file.download_as_bytearray() for file in files))
+                    span.set(bytes=sum(map(len, downloads)))
+                
                 # Get current bin details
-                current_bin = await self.get_bin_details(bin_id)
+                with self.tracer.span('get_bin_details', bin_id=bin_id):
+                    current_bin = await self.get_bin_details(bin_id)
                 if not current_bin:
+                    self.admission.refund(bin_id)
                     await update.message.reply_text("Kechirasiz, konteyner ma'lumotlarini olib kelolmadik.")
                     return
                 
+                # Wait for a slot in the global AI budget
+                with self.tracer.span('ai_admission'):
+                    admitted = await self.admission.acquire_ai()
+                if not admitted:
+                    # The bin was not analysed, so it must not lose its turn
+                    self.admission.refund(bin_id)
+                    await update.message.reply_text(
+                        "Hozir so'rovlar juda ko'p. Iltimos, bir necha daqiqadan so'ng qayta urinib ko'ring."
+                    )
+                    return
+                
+                # An album gets one combined verdict, and only its best photo is uploaded
+                ai_analysis = None
+                best = 0
+                if len(downloads) > 1:
+                    with self.tracer.span('album_analysis', photos=len(downloads)) as span:
+                        analyses = await self.analyze_images_with_ai([bytes(photo_bytes) for photo_bytes in downloads])
+                        ai_analysis, best = AIAnalysis.combine(analyses)
+                        span.set(fill_level=ai_analysis.fill_level, confidence=ai_analysis.confidence)
+                
                 # Upload the photo and update bin status using the API
-                updated_bin = await self.update_bin_with_photo(bin_id, current_bin, file.file_path, bytes(photo_bytes))
+                with self.tracer.span('update_bin_with_photo', bin_id=bin_id):
+                    updated_bin = await self.update_bin_with_photo(
+                        bin_id, current_bin, files[best].file_path, bytes(downloads[best]), ai_analysis
+                    )
                 
                 if updated_bin:
-                    if 'error' in updated_bin:
+                    if isinstance(updated_bin, dict):
                         # AI analysis showed this is not a waste bin
                         error_msg = updated_bin.get('error', 'Rasm tahlilida xatolik yuz berdi.')
                         await update.message.reply_text(error_msg)
                         return
                     
+                    self.analytics.record_bin_update(updated_bin, update.message.date.timestamp())
+                    self.admission.record_verdict(bin_id, updated_bin)
+                    
                     # Send success message with AI analysis
-                    ai_analysis = updated_bin.get('ai_analysis', {})
-                    confidence = ai_analysis.get('confidence', 0)
-                    is_full = ai_analysis.get('isFull', updated_bin.get('is_full', False))
-                    fill_level = ai_analysis.get('fillLevel', updated_bin.get('fill_level', 0))
-                    notes = ai_analysis.get('notes', 'Tahlil amalga oshirildi')
-                    suggestions = ai_analysis.get('suggestions', '')
+                    ai_analysis = updated_bin.ai_analysis
+                    confidence = ai_analysis.confidence if ai_analysis else 0
+                    is_full = ai_analysis.is_full if ai_analysis else updated_bin.is_full
+                    fill_level = ai_analysis.fill_level if ai_analysis else updated_bin.fill_level
+                    notes = ai_analysis.notes if ai_analysis else 'Tahlil amalga oshirildi'
+                    suggestions = ai_analysis.suggestions if ai_analysis else ''
                                     
                     status_text = "To'la" if is_full else "To'lmagan"
                                     
-                    response_message = f"✅ Rasm qabul qilindi va tahlil qilindi!\n\n"
-                    response_message += f"📦 <b>Konteyner:</b> {updated_bin.get('address', 'Noma\'lum')}\n"
+                    if len(downloads) > 1:
+                        response_message = f"✅ {len(downloads)} ta rasm qabul qilindi va birgalikda tahlil qilindi!\n\n"
+                    else:
+                        response_message = f"✅ Rasm qabul qilindi va tahlil qilindi!\n\n"
+                    response_message += f"📦 <b>Konteyner:</b> {updated_bin.address or 'Noma\'lum'}\n"
                     response_message += f"🚦 <b>Yangi status:</b> {status_text}\n"
                     response_message += f"📊 <b>To'ldirish darajasi:</b> {fill_level}%\n"
                     response_message += f"🔍 <b>AI ishonchlilik:</b> {confidence}%\n\n"
@@ -297,226 +583,181 @@ class WasteBinBot:
                                     
                     response_message += f"Ko'rsatmalar bo'yicha tashakkur!"
                                     
-                    await update.message.reply_text(response_message)
+                    with self.tracer.span('reply'):
+                        await update.message.reply_text(response_message)
                     
                     # Notify admin about the new full bin if it's full
                     if is_full:
-                        await self.notify_admins(bin_id, updated_bin, user)
+                        with self.tracer.span('notify_admins'):
+                            await self.notify_admins(bin_id, updated_bin, user)
                 else:
                     await update.message.reply_text(
                         "Kechirasiz, konteyner statusini va rasmini yangilay olmadik. Iltimos, keyinroq qayta urinib ko'ring."
                     )
 
+    async def send_recent_verdict(self, update: Update, bin_details: BinDetails):
+        """Answer a report about a bin that was analysed moments ago with that verdict"""
+        status_text = "To'la" if bin_details.is_full else "To'lmagan"
+        await update.message.reply_text(
+            f"✅ Rahmat! Bu konteyner yaqinda tekshirilgan.\n\n"
+            f"📦 <b>Konteyner:</b> {html.escape(bin_details.address or 'Noma\'lum')}\n"
+            f"🚦 <b>Status:</b> {status_text}\n"
+            f"📊 <b>To'ldirish darajasi:</b> {bin_details.fill_level}%",
+            parse_mode='HTML'
+        )
+
     async def analyze_image_with_ai(self, image_bytes):
         """Analyze image using Google AI to determine if bin is full"""
         try:
-            # Convert image bytes to base64
-            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-            
-            # Prepare the request to Google AI
-            ai_headers = {
-                'Content-Type': 'application/json',
-            }
-            
             # Get API key from environment or use default
             api_key = os.getenv('GEMINI_API_KEY', 'YOUR_API_KEY_HERE')
             if api_key == 'YOUR_API_KEY_HERE':
                 # If no API key is set, return a basic response
-                return {
-                    'isWasteBin': True,
-                    'isFull': True,
-                    'fillLevel': 90,
-                    'confidence': 70,
-                    'notes': 'API kaliti ornatiilmagan, oddiy tahlil amalga oshirildi',
-                    'detectedObjects': ['waste bin', 'plastic bags'],
-                    'suggestions': 'Konteyner hozir to\'la, yuklab olish kerak'
-                }
+                return AIAnalysis(
+                    is_waste_bin=True,
+                    is_full=True,
+                    fill_level=90,
+                    confidence=70,
+                    notes='API kaliti ornatiilmagan, oddiy tahlil amalga oshirildi',
+                    detected_objects=['waste bin', 'plastic bags'],
+                    suggestions='Konteyner hozir to\'la, yuklab olish kerak'
+                )
             
             ai_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent?key={api_key}'
             
-            # Create enhanced prompt for AI with improved analysis for waste bin fill level detection
-            prompt = '''Siz tajriboli atrof-muhitni kuzatuv tizimi ekspertisiz. Rasmni tahlil qiling va quyidagilarni aniqlang:
-            
-            1. Rasmda chiqindi konteyneri bormi? Javob: HA yoki YO'Q.
-            
-            2. Agar HA bo'lsa, konteyner to'la bo'limi? Javob: HA yoki YO'Q.
-            - TO'LA BELGILARI: axlat konteyneri ochig'ida axlat ko'rinadi, axlat konteyneridan tashqari joyda axlat yoki sumkalar ko'rinadi, axlat konteyneri ochiq qopqog'i ostida axlatlar to'planib qolgan bo'lsa, axlat konteyneri butunlay axlat bilan qoplangan bo'lsa.
-            - BO'SH BELGILARI: axlat konteyneri ichida bo'sh joy ko'rinadi, axlat konteyneri ochig'i ochiq va ichi ko'rinadi, axlat konteyneri atrofida axlat yoki sumka yo'q.
-            
-            3. Agar HA bo'lsa, to'ldirish darajasini % (0-100) ko'rsating. Batafsil tahlil:
-            - 0-25%: Konteyner deyarli bo'sh, ichida kamroq axlat bor
-            - 26-50%: Konteyner taxminan yarim to'la
-            - 51-75%: Konteyner ko'pincha to'la, lekin hali joy bor
-            - 76-100%: Konteyner to'la, axlat tashqariga chiqib turgan yoki chiqib ketayotgan
-            
-            4. Agar YO'Q bo'lsa, rasmda nima borligini tushuntiring.
-            
-            5. Rasmda qanday obyektlar aniqlanganligini tavsifli ro'yxat ko'rinishida berin:
-            - Chiqindi konteyneri (shakl, rang, hajm, holati)
-            - Sumkalar (soni, rangi, joylashuvi)
-            - Axlatlar (turi, miqdori, joylashuvi)
-            - Boshqa obyektlar (odamlar, avtomobillar, bino, daraxt, ko'cha belgilari)
-            
-            6. Agar konteyner to'la bo'lsa, unga qanday chora ko'rish kerakligi bo'yicha takliflaringizni bering.
-            
-            7. Agar konteyner aniqlanmasa, kamera to'g'rimi yoki axlat konteyneri joyida emasmi yoki axlat aniqlanmadi deb xabar bering.
+            # The prompt and schema are pre-encoded once; base64 needs no JSON escaping,
+            # so the image is spliced between the two halves as raw bytes
+            ai_request_body = AI_REQUEST_PREFIX + await self.images.encode(image_bytes) + AI_REQUEST_SUFFIX
             
-            Rasmni to'g'ri tekshirish uchun quyidagi belgilarni hisobga oling:
-            - Chiqindi konteyneri odatda to'rtburchak yoki silindrsimon shaklda bo'ladi
-            - Ko'pincha yashil, sariq, ko'k yoki qora rangda bo'ladi
-            - Yozuvlar, logolar yoki chiqindi turi ko'rsatiladi
-            - Qopqog'i yoki ochiq bo'lishi mumkin
-            - Ko'pincha ko'cha yoki bino yonida joylashadi
-            
-            Tahlil qilishda e'tibor bering:
-            - Konteyner ichidagi axlat miqdoriga
-            - Konteyner atrofidagi axlatlarga
-            - Qopqog'ining ochiq yoki yopiq ekanligiga
-            - Axlatning konteyner ichida yoki tashqarisida joylashganligiga
-            
-            Agar rasmda chiqindi konteyneri aniq ko'rinmasa, lekin atrofda bo'lsa, ham "HA" deb belgilang.
-            Agar rasmda chiqindi konteyneri to'la bo'lsa, "HA" deb belgilang, aks holda "YO'Q".
-            
-            Javobni JSON formatda quyidagi kalitlar bilan berin: 
-            - isWasteBin (BOOLEAN): Rasmda chiqindi konteyneri bor yoki yo'q
-            - isFull (BOOLEAN): Konteyner to'la yoki yo'q (batafsil tahlil asosida)
-            - fillLevel (NUMBER): To'ldirish darajasi (0-100%, tahlil asosida aniqroq aniqlash)
-            - confidence (NUMBER): AI ishonchlilik darajasi (0-100%, tahlil qanchalik aniq bo'lsa shuncha yuqori)
-            - notes (STRING): Batafsil tahlil natijasi va asoslangan fikr
-            - detectedObjects (ARRAY of STRING): Aniqlangan obyektlar ro'yxati
-            - suggestions (STRING): Tavsiyalaringiz
-            
-            Eslatma: Faqat JSON javobini bering, boshqa matn qo'shmang.'''
-            
-            ai_request_body = {
-                'contents': [{
-                    'parts': [
-                        {'text': prompt},
-                        {
-                            'inline_data': {
-                                'mime_type': 'image/jpeg',
-                                'data': image_base64
-                            }
-                        }
-                    ]
-                }],
-                'generationConfig': {
-                    'responseMimeType': 'application/json',
-                    'responseSchema': {
-                        'type': 'OBJECT',
-                        'properties': {
-                            'isWasteBin': {'type': 'BOOLEAN'},
-                            'isFull': {'type': 'BOOLEAN'},
-                            'fillLevel': {'type': 'NUMBER'},
-                            'confidence': {'type': 'NUMBER'},
-                            'notes': {'type': 'STRING'},
-                            'detectedObjects': {
-                                'type': 'ARRAY',
-                                'items': {'type': 'STRING'}
-                            },
-                            'suggestions': {'type': 'STRING'}
-                        },
-                        'required': ['isWasteBin', 'isFull', 'fillLevel', 'confidence', 'notes', 'detectedObjects', 'suggestions']
-                    }
-                }
-            }
-            
-            response = requests.post(ai_url, headers=ai_headers, json=ai_request_body)
+            response = await asyncio.to_thread(
+                requests.post, ai_url, headers={'Content-Type': 'application/json'}, data=ai_request_body, timeout=120
+            )
             
             if response.status_code == 200:
-                result = response.json()
+                result = records.loads(response.content)
                 candidates = result.get('candidates', [])
                 if candidates:
                     content = candidates[0].get('content', {})
                     parts = content.get('parts', [])
                     if parts:
                         ai_result = parts[0]  # This should be the JSON response
+                        if isinstance(ai_result, dict) and 'text' in ai_result:
+                            ai_result = ai_result['text']
                         if isinstance(ai_result, str):
-                            import json as json_lib
-                            ai_result = json_lib.loads(ai_result)
-                        return ai_result
+                            ai_result = records.loads(ai_result)
+                        return AIAnalysis.from_dict(ai_result)
             else:
                 # If API call fails, return error response
                 logger.error(f"AI API error: {response.status_code} - {response.text}")
-                return {
-                    'isWasteBin': False,
-                    'isFull': False,
-                    'fillLevel': 0,
-                    'confidence': 0,
-                    'notes': f'AI xizmatiga ulanishda xatolik yuz berdi: {response.status_code}',
-                    'detectedObjects': [],
-                    'suggestions': 'AI xizmatiga ulanishda xatolik yuz berdi'
-                }
+                return AIAnalysis.failed(
+                    f'AI xizmatiga ulanishda xatolik yuz berdi: {response.status_code}',
+                    'AI xizmatiga ulanishda xatolik yuz berdi'
+                )
             
             # If AI analysis fails, return default values
-            return {
-                'isWasteBin': False,
-                'isFull': False,
-                'fillLevel': 0,
-                'confidence': 0,
-                'notes': 'AI tahlili amalga oshmadi',
-                'detectedObjects': [],
-                'suggestions': 'AI tahlil qilishda xatolik yuz berdi'
-            }
+            return AIAnalysis.failed('AI tahlili amalga oshmadi', 'AI tahlil qilishda xatolik yuz berdi')
         except Exception as e:
             logger.error(f"AI analysis error: {e}")
-            return {
-                'isWasteBin': False,
-                'isFull': False,
-                'fillLevel': 0,
-                'confidence': 0,
-                'notes': f'AI tahlil qilishda xatolik yuz berdi: {str(e)}',
-                'detectedObjects': [],
-                'suggestions': f'AI tahlil qilishda xatolik yuz berdi: {str(e)}'
-            }
+            return AIAnalysis.failed(
+                f'AI tahlil qilishda xatolik yuz berdi: {str(e)}',
+                f'AI tahlil qilishda xatolik yuz berdi: {str(e)}'
+            )
     
-    async def update_bin_with_photo(self, bin_id: str, current_bin: dict, photo_file_path: str, photo_bytes: bytes = None):
-        """Update bin status with photo and AI analysis"""
+    async def analyze_images_with_ai(self, images: list):
+        """Analyze several images in one AI request, returning one AIAnalysis per image"""
+        api_key = os.getenv('GEMINI_API_KEY', 'YOUR_API_KEY_HERE')
+        if api_key == 'YOUR_API_KEY_HERE' or len(images) == 1:
+            return [await self.analyze_image_with_ai(image_bytes) for image_bytes in images]
+        try:
+            ai_url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent?key={api_key}'
+            encoded = await asyncio.gather(*(self.images.encode(image_bytes) for image_bytes in images))
+            parts = b','.join(
+                records.dumps({'text': f'Rasm {number}'}) + b',{"inline_data":{"mime_type":"image/jpeg","data":"'
+                + data + b'"}}'
+                for number, data in enumerate(encoded, 1)
+            )
+            response = await asyncio.to_thread(
+                requests.post, ai_url, headers={'Content-Type': 'application/json'},
+                data=AI_BATCH_REQUEST_PREFIX + parts + AI_BATCH_REQUEST_SUFFIX, timeout=120
+            )
+            if response.status_code == 200:
+                result = records.loads(response.content)
+                text = result['candidates'][0]['content']['parts'][0]['text']
+                analyses = [AIAnalysis.from_dict(item) for item in records.loads(text)]
+                if len(analyses) == len(images):
+                    return analyses
+                logger.error(f"AI batch returned {len(analyses)} results for {len(images)} images")
+            else:
+                logger.error(f"AI API error: {response.status_code} - {response.text}")
+        except Exception as e:
+            logger.error(f"AI batch analysis error: {e}")
+        failed = AIAnalysis.failed('AI tahlili amalga oshmadi', 'AI tahlil qilishda xatolik yuz berdi')
+        return [failed] * len(images)
+
+    async def analyze_cctv_images(self, images: list):
+        """AI analyses for CCTV snapshots; None for all of them without a Gemini API key, so
+        the placeholder analysis never updates a bin or dispatches a truck on its own"""
+        if not ai_configured():
+            return [None] * len(images)
+        # Camera batches share the global AI budget with citizen reports, one slot per image
+        if not await self.admission.acquire_ai(len(images)):
+            logger.info(f"AI budget exhausted, {len(images)} CCTV snapshots left for a later sweep")
+            return [None] * len(images)
+        return await self.analyze_images_with_ai(images)
+
+    async def handle_cctv_full(self, bin_details: BinDetails):
+        """A camera saw a full bin: record it and dispatch a truck"""
+        logger.info(f"CCTV: bin {bin_details.id} is full")
+        self.analytics.record_bin_update(bin_details)
+        self.gps.geofences.add_bin(bin_details)
+        await self.dispatch_truck(bin_details)
+
+    async def update_bin_with_photo(self, bin_id: str, current_bin: BinDetails, photo_file_path: str, photo_bytes: bytes = None,
+                                    ai_analysis: AIAnalysis = None):
+        """Update bin status with photo and AI analysis (made here unless one is given, e.g. for an album)"""
         await self.ensure_authenticated()  # Ensure we're logged in
         try:
             # Analyze the image with AI
-            ai_analysis = await self.analyze_image_with_ai(photo_bytes) if photo_bytes else {
-                'isWasteBin': True,  # Default to true if no analysis
-                'isFull': True,
-                'fillLevel': 100,
-                'confidence': 80,
-                'notes': 'Rasm tahlili amalga oshmadi'
-            }
+            with self.tracer.span('ai_analysis') as span:
+                if ai_analysis is None:
+                    ai_analysis = await self.analyze_image_with_ai(photo_bytes) if photo_bytes else AIAnalysis(
+                        is_waste_bin=True,  # Default to true if no analysis
+                        is_full=True,
+                        fill_level=100,
+                        confidence=80,
+                        notes='Rasm tahlili amalga oshmadi'
+                    )
+                span.set(fill_level=ai_analysis.fill_level, confidence=ai_analysis.confidence)
             
             # Check if image is actually of a waste bin
-            if not ai_analysis.get('isWasteBin', False):
+            if not ai_analysis.is_waste_bin:
                 return {
                     'error': 'Bu rasmda chiqindi konteyneri aniqlanmadi. Iltimos, konteyner rasmini yuboring.',
                     'analysis': ai_analysis
                 }
             
-            # Create a temporary image URL based on the Telegram file path
-            temp_image_url = f"https://api.telegram.org/file/bot{self.bot_token}/{photo_file_path}"
-            
-            # Prepare updated data based on AI analysis (without image_url since we're uploading the file directly)
-            updated_data = {
-                'is_full': ai_analysis.get('isFull', False),
-                'fill_level': ai_analysis.get('fillLevel', 0),
-                'image_source': 'BOT',  # Mark that the image came from the bot
-                'last_analysis': f"AI tahlili: {ai_analysis.get('notes', 'Tahlil amalga oshirildi')}, Isbot: {ai_analysis.get('isWasteBin')}, IsFull: {ai_analysis.get('isFull')}, Conf: {ai_analysis.get('confidence')}%"
-            }
-            
-            # First, download the image from Telegram
-            image_url = f"https://api.telegram.org/file/bot{self.bot_token}/{photo_file_path}"
-            image_response = requests.get(image_url)
+            # The photo was already downloaded by the handler; only fetch it again if it was not
+            image_content = photo_bytes
+            if image_content is None:
+                image_url = f"https://api.telegram.org/file/bot{self.bot_token}/{photo_file_path}"
+                image_response = requests.get(image_url)
+                if image_response.status_code == 200:
+                    image_content = image_response.content
+                else:
+                    logger.error(f"Failed to download image from Telegram: {image_response.status_code}")
             
-            if image_response.status_code == 200:
+            if image_content is not None:
                 # Prepare multipart form data for file upload
                 files = {
-                    'image': (os.path.basename(photo_file_path), image_response.content, 'image/jpeg')
+                    'image': (os.path.basename(photo_file_path), image_content, 'image/jpeg')
                 }
                 
-                # Prepare other data as form data
+                # Prepare other data as form data, based on AI analysis
                 data = {
-                    'is_full': updated_data['is_full'],
-                    'fill_level': updated_data['fill_level'],
-                    'image_source': updated_data['image_source'],
-                    'last_analysis': updated_data['last_analysis']
+                    'is_full': ai_analysis.is_full,
+                    'fill_level': ai_analysis.fill_level,
+                    'image_source': 'BOT',  # Mark that the image came from the bot
+                    'last_analysis': ai_analysis.summary()
                 }
                 
                 # Update bin via API using PATCH method for file upload
@@ -525,23 +766,25 @@ class WasteBinBot:
                 if 'Content-Type' in headers:
                     del headers['Content-Type']
                 
-                response = requests.patch(
-                    f"{self.api_base_url}/waste-bins/{bin_id}/update-image-file/",
-                    files=files,
-                    data=data,
-                    headers=headers
-                )
+                with self.tracer.span('upload_patch') as span:
+                    response = requests.patch(
+                        f"{self.api_base_url}/waste-bins/{bin_id}/update-image-file/",
+                        files=files,
+                        data=data,
+                        headers=headers
+                    )
+                    span.set(status=response.status_code)
             else:
-                logger.error(f"Failed to download image from Telegram: {image_response.status_code}")
                 return None
             
             if response.status_code in [200, 201]:
                 logger.info(f"Successfully updated bin {bin_id} with photo and AI analysis")
                 # Return the updated bin information by fetching it again
-                updated_bin = await self.get_bin_details(bin_id)
+                with self.tracer.span('refetch_bin'):
+                    updated_bin = await self.get_bin_details(bin_id)
                 # Add AI analysis to the result
                 if updated_bin:
-                    updated_bin['ai_analysis'] = ai_analysis
+                    updated_bin.ai_analysis = ai_analysis
                 return updated_bin
             else:
                 logger.error(f"Error updating bin with photo: {response.status_code}, {response.text}")
@@ -550,7 +793,7 @@ class WasteBinBot:
             logger.error(f"Exception updating bin with photo: {e}")
             return None
 
-    async def update_bin_to_full(self, bin_id: str, current_bin: dict):
+    async def update_bin_to_full(self, bin_id: str, current_bin: BinDetails):
         """Update bin status to full (original function without photo)"""
         await self.ensure_authenticated()  # Ensure we're logged in
         try:
@@ -580,8 +823,8 @@ class WasteBinBot:
             logger.error(f"Exception updating bin: {e}")
             return None
 
-    async def notify_admins(self, bin_id: str, bin_details: dict, user):
-        """Notify admins about the full bin"""
+    async def notify_admins(self, bin_id: str, bin_details: BinDetails, user):
+        """Notify admins about the full bin and dispatch the nearest idle truck"""
         try:
             # In a real implementation, you would notify admins
             # For now, just log the information
@@ -591,6 +834,52 @@ class WasteBinBot:
             # await context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=message)
         except Exception as e:
             logger.error(f"Error notifying admins: {e}")
+        # The pickup is confirmed automatically once a truck dwells at the bin
+        self.gps.geofences.add_bin(bin_details)
+        await self.dispatch_truck(bin_details)
+
+    async def dispatch_truck(self, bin_details: BinDetails):
+        """Assign the nearest idle truck of the bin's Toza Hudud to a full bin"""
+        if self.dispatcher.needs_refresh():
+            await self.refresh_fleet()
+        assignment = self.dispatcher.assign(bin_details)
+        if assignment is None:
+            logger.warning(f"No idle truck available for bin {bin_details.id} in {bin_details.toza_hudud}")
+            return None
+        truck, distance_km = assignment
+        if distance_km is None:
+            logger.info(f"Bin {bin_details.id} already has truck {truck.id} assigned")
+            return truck
+        if not await asyncio.to_thread(self.dispatcher.push_assignment, truck):
+            # Put the truck back so the next report can try again
+            self.dispatcher.release(truck.id)
+            await asyncio.to_thread(self.dispatcher.flush_statuses)
+            return None
+        logger.info(f"Truck {truck.id} ({truck.plate_number}) dispatched to bin {bin_details.id}, {distance_km:.2f} km away")
+        return truck
+
+    async def refresh_fleet(self):
+        """Reload trucks into the dispatcher and full-bin geofences into the GPS ingestor"""
+        await self.ensure_authenticated()
+        # Save IDLE trucks first so the refreshed list does not bring them back as BUSY
+        if self.dispatcher.pending_statuses:
+            await asyncio.to_thread(self.dispatcher.flush_statuses)
+        trucks = await asyncio.to_thread(self.dispatcher.fetch_trucks)
+        if trucks is not None:
+            added, removed = self.dispatcher.apply(trucks)
+            if added or removed:
+                logger.info(f"Fleet refreshed: {len(self.dispatcher)} trucks (+{added}/-{removed})")
+        bins = await asyncio.to_thread(self.gps.fetch_bins)
+        if bins is not None:
+            self.gps.geofences.apply_bins(bins)
+
+    async def refresh_fleet_periodically(self):
+        while True:
+            try:
+                await self.refresh_fleet()
+            except Exception as e:
+                logger.error(f"Fleet refresh loop error: {e}")
+            await asyncio.sleep(FLEET_REFRESH_SECONDS)
     
     def extract_sensor_data(self, message_text: str):
         """Extract sensor data from message in the format:
@@ -715,13 +1004,50 @@ def main():
     # Create bot instance
     waste_bot = WasteBinBot()
     
+    background_tasks = []
+    
+    async def post_init(application: Application):
+        waste_bot.profiler.track_tasks()
+        await waste_bot.profiler.start_http()
+        background_tasks.append(asyncio.create_task(waste_bot.refresh_fleet_periodically()))
+        if GPS_INGEST_ENABLED:
+            await waste_bot.gps.start()
+            background_tasks.append(asyncio.create_task(waste_bot.gps.run()))
+        background_tasks.append(asyncio.create_task(waste_bot.analytics.run()))
+        if CCTV_SCHEDULER_ENABLED and not ai_configured():
+            logger.warning("CCTV scheduler not started: GEMINI_API_KEY is not set")
+        elif CCTV_SCHEDULER_ENABLED:
+            await waste_bot.ensure_authenticated()
+            background_tasks.append(asyncio.create_task(waste_bot.cctv.run()))
+        # Citizen reports sent while the bot was down are replayed in the
+        # background instead of being dropped, live updates are not delayed
+        backlog = await drain_pending_updates(application.bot, BACKLOG_JOURNAL)
+        if backlog:
+            background_tasks.append(asyncio.create_task(waste_bot.catch_up(application, backlog)))
+    
+    async def post_shutdown(application: Application):
+        for task in background_tasks:
+            task.cancel()
+        await waste_bot.profiler.stop_http()
+        waste_bot.images.shutdown()
+        waste_bot.gps.stop()
+        waste_bot.analytics.close()
+        waste_bot.sessions.close()
+    
     # Create main application using builder pattern
-    main_application = Application.builder().token(BOT_TOKEN).build()
+    main_application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Add main bot handlers
     main_application.add_handler(CommandHandler("start", waste_bot.start))
     main_application.add_handler(CommandHandler("scan", waste_bot.scan_command))
     main_application.add_handler(CommandHandler("help", waste_bot.help_command))
+    main_application.add_handler(CommandHandler("perf", waste_bot.profiler.handle_command))
     
     # Handle text messages (for QR codes/IDs)
     main_application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, waste_bot.handle_qr_scan))
@@ -730,7 +1056,8 @@ def main():
     main_application.add_handler(MessageHandler(filters.PHOTO, waste_bot.handle_photo))
     
     logger.info("Main bot is starting...")
-    main_application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    # Pending updates were already drained in post_init for catch-up
+    main_application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=False)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
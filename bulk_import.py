@@ -0,0 +1,390 @@
+"""Bulk onboarding of bins, trucks, drivers and IoT devices.
+
+Rows are streamed from CSV, JSON (array or one object per line) or XLSX
+and validated locally against the platform's field rules before anything
+is sent. Valid rows are upserted in chunks by a bounded pool of worker
+threads: a row whose natural key (bin address, plate number, driver
+login, device_id) already exists is PATCHed, anything else is POSTed.
+Every request carries an Idempotency-Key derived from the row content, so
+re-running an interrupted import does not create duplicates.
+
+Rows that fail validation or are rejected by the API are written with
+their line number and reason to <input>.errors.csv.
+
+Usage:
+    python bulk_import.py bins|trucks|drivers|devices <file> [--dry-run] [--organization <id>]
+"""
+import csv
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+import requests
+
+from api_login import login_headers
+from records import dumps, loads
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://deklorantapi.cdcgroup.uz/api"
+
+# Rows sent by one worker in one go
+IMPORT_CHUNK_SIZE = 50
+# Concurrent upload workers
+IMPORT_WORKERS = 8
+# Retries of a chunk row after a connection error or 5xx
+IMPORT_RETRIES = 2
+
+TOZA_HUDUDS = ('1-sonli Toza Hudud', '2-sonli Toza Hudud')
+TRUCK_STATUSES = ('IDLE', 'BUSY', 'OFFLINE')
+DEVICE_TYPES = ('TEMPERATURE_SENSOR', 'HUMIDITY_SENSOR', 'BOTH')
+
+
+class RowError(ValueError):
+    """A row that cannot be imported"""
+
+
+def _value(row: dict, *keys):
+    """First non-empty value among keys; CSV and XLSX give '' for empty cells"""
+    for key in keys:
+        value = row.get(key)
+        if isinstance(value, str):
+            value = value.strip()
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _required(row: dict, *keys):
+    value = _value(row, *keys)
+    if value is None:
+        raise RowError(f"Missing {keys[0]}")
+    return value
+
+
+def _number(row: dict, *keys, low=None, high=None):
+    value = _value(row, *keys)
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{keys[0]} is not a number: {value!r}")
+    if (low is not None and number < low) or (high is not None and number > high):
+        raise RowError(f"{keys[0]} out of range [{low}, {high}]: {number}")
+    return number
+
+
+def _choice(row: dict, choices: tuple, *keys, default=None):
+    value = _value(row, *keys) or default
+    if value is not None and value not in choices:
+        raise RowError(f"Invalid {keys[0]} {value!r}, expected one of {', '.join(choices)}")
+    return value
+
+
+def _location(row: dict, required: bool = True):
+    """Location from lat/lng columns or a nested location object"""
+    location = row.get('location')
+    if isinstance(location, str) and location.strip().startswith('{'):
+        location = loads(location)
+    if isinstance(location, dict):
+        row = {**row, 'lat': location.get('lat'), 'lng': location.get('lng')}
+    lat = _number(row, 'lat', 'latitude', low=-90, high=90)
+    lng = _number(row, 'lng', 'longitude', 'lon', low=-180, high=180)
+    if lat is None or lng is None:
+        if required:
+            raise RowError("Missing location (lat/lng)")
+        return None
+    return {'lat': lat, 'lng': lng}
+
+
+def _without_none(payload: dict):
+    return {key: value for key, value in payload.items() if value is not None}
+
+
+def bin_payload(row: dict, organization=None):
+    fill_level = _number(row, 'fill_level', 'fillLevel', low=0, high=100)
+    return _without_none({
+        'address': _required(row, 'address'),
+        'location': _location(row),
+        'toza_hudud': _choice(row, TOZA_HUDUDS, 'toza_hudud', 'tozaHudud'),
+        'fill_level': fill_level if fill_level is not None else 0,
+        'fill_rate': _number(row, 'fill_rate', 'fillRate', low=0),
+        'is_full': (fill_level or 0) >= 100,
+        'image_source': _choice(row, ('CCTV', 'BOT'), 'image_source', 'imageSource'),
+        'camera_url': _value(row, 'camera_url', 'cameraUrl'),
+        'google_maps_url': _value(row, 'google_maps_url', 'googleMapsUrl'),
+        'organization_id': _value(row, 'organization_id', 'organization') or organization,
+    })
+
+
+def truck_payload(row: dict, organization=None):
+    return _without_none({
+        'driver_name': _required(row, 'driver_name', 'driverName'),
+        'plate_number': _required(row, 'plate_number', 'plateNumber'),
+        'phone': _value(row, 'phone'),
+        'toza_hudud': _choice(row, TOZA_HUDUDS, 'toza_hudud', 'tozaHudud'),
+        'location': _location(row),
+        'status': _choice(row, TRUCK_STATUSES, 'status', default='IDLE'),
+        'fuel_level': _number(row, 'fuel_level', 'fuelLevel', low=0, high=100),
+        'organization': _value(row, 'organization', 'organization_id') or organization,
+    })
+
+
+def driver_payload(row: dict, organization=None):
+    """A driver is a truck with login credentials (see test_add_driver.py)"""
+    payload = truck_payload(row, organization)
+    payload['login'] = str(_required(row, 'login'))
+    payload['password'] = str(_required(row, 'password'))
+    if payload.get('organization') is None:
+        raise RowError("Missing organization")
+    return payload
+
+
+def device_payload(row: dict, organization=None):
+    room = _value(row, 'room_id', 'room', 'roomId')
+    boiler = _value(row, 'boiler_id', 'boiler', 'boilerId')
+    if room is not None and boiler is not None:
+        raise RowError("A device is linked to a room or a boiler, not both")
+    return _without_none({
+        'device_id': str(_required(row, 'device_id', 'deviceId')),
+        'device_type': _choice(row, DEVICE_TYPES, 'device_type', 'deviceType', default='BOTH'),
+        'room_id': room,
+        'boiler_id': boiler,
+        'location': _location(row, required=False),
+        'is_active': str(_value(row, 'is_active', 'isActive') or 'true').lower() not in ('0', 'false', 'no'),
+    })
+
+
+# kind -> (endpoint, row validator, natural key field shared by rows and existing records)
+IMPORT_KINDS = {
+    'bins': ('waste-bins', bin_payload, 'address'),
+    'trucks': ('trucks', truck_payload, 'plate_number'),
+    'drivers': ('trucks', driver_payload, 'login'),
+    'devices': ('iot-devices', device_payload, 'device_id'),
+}
+
+
+def read_rows(path: str):
+    """Yield (line number, row dict) from a CSV, JSON Lines or XLSX file as it is read;
+    a plain JSON array is parsed in one go"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            # The header is line 1
+            yield from enumerate(csv.DictReader(f), 2)
+    elif extension in ('.jsonl', '.ndjson'):
+        with open(path, 'rb') as f:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_number, loads(line)
+    elif extension == '.json':
+        with open(path, 'rb') as f:
+            data = loads(f.read())
+        if isinstance(data, dict):
+            data = data.get('results', [])
+        yield from enumerate(data, 1)
+    elif extension == '.xlsx':
+        if openpyxl is None:
+            raise RuntimeError("Reading .xlsx files needs openpyxl (pip install openpyxl)")
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+            for line_number, cells in enumerate(rows, 2):
+                if any(cell is not None for cell in cells):
+                    yield line_number, dict(zip(header, cells))
+        finally:
+            workbook.close()
+    else:
+        raise RuntimeError(f"Unsupported input format: {extension or path}")
+
+
+def idempotency_key(kind: str, payload: dict):
+    """Same row content gives the same key, so a retried request is applied once"""
+    return hashlib.sha256(kind.encode() + b'\0' + dumps(dict(sorted(payload.items())))).hexdigest()
+
+
+class BulkImporter:
+    """Validates rows and upserts them through the API in concurrent chunks"""
+    def __init__(self, api_base_url: str, headers: dict, kind: str, organization=None,
+                 workers: int = IMPORT_WORKERS, chunk_size: int = IMPORT_CHUNK_SIZE, dry_run: bool = False):
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f"Unknown import kind {kind!r}, expected one of {', '.join(IMPORT_KINDS)}")
+        self.api_base_url = api_base_url
+        self.headers = headers
+        self.kind = kind
+        self.endpoint, self.validate, self.key_field = IMPORT_KINDS[kind]
+        self.organization = organization
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        # Natural key -> id of records already on the platform
+        self.existing = {}
+        # Natural keys seen in this import, a repeated key is reported instead of sent twice
+        self.seen = set()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.created = self.updated = self.processed = 0
+        # [(line number, natural key, reason)]
+        self.errors = []
+
+    def session(self):
+        """One keep-alive session per worker thread"""
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+            session.headers.update(self.headers)
+        return session
+
+    def load_existing(self):
+        """Map natural keys of existing records to their ids"""
+        response = self.session().get(f"{self.api_base_url}/{self.endpoint}/", timeout=120)
+        response.raise_for_status()
+        data = response.json()
+        records = data.get('results', []) if isinstance(data, dict) else data
+        self.existing = {
+            str(record[self.key_field]): record['id']
+            for record in records if record.get(self.key_field) is not None
+        }
+        logger.info(f"{len(self.existing)} existing {self.endpoint} records on platform")
+
+    def prepare(self, rows):
+        """Validate rows, yielding (line number, key, payload) and recording rejected ones"""
+        for line_number, row in rows:
+            try:
+                payload = self.validate(row, self.organization)
+            except (RowError, ValueError) as e:
+                self.errors.append((line_number, _value(row, self.key_field) or '', str(e)))
+                continue
+            key = str(payload[self.key_field])
+            if key in self.seen:
+                self.errors.append((line_number, key, f"Duplicate {self.key_field} in input"))
+                continue
+            self.seen.add(key)
+            yield line_number, key, payload
+
+    def send(self, key: str, payload: dict):
+        """Create or update one record, returning 'created' or 'updated'; raises RowError when rejected"""
+        existing_id = self.existing.get(key)
+        headers = {'Idempotency-Key': idempotency_key(self.kind, payload)}
+        for attempt in range(IMPORT_RETRIES + 1):
+            try:
+                if existing_id is not None:
+                    response = self.session().patch(
+                        f"{self.api_base_url}/{self.endpoint}/{existing_id}/", json=payload, headers=headers, timeout=60
+                    )
+                else:
+                    response = self.session().post(
+                        f"{self.api_base_url}/{self.endpoint}/", json=payload, headers=headers, timeout=60
+                    )
+            except requests.exceptions.RequestException as e:
+                if attempt == IMPORT_RETRIES:
+                    raise RowError(f"Request failed: {e}")
+                time.sleep(2 ** attempt)
+                continue
+            if response.status_code in [200, 201, 204]:
+                return 'updated' if existing_id is not None else 'created'
+            if response.status_code < 500 or attempt == IMPORT_RETRIES:
+                raise RowError(f"{response.status_code}: {response.text[:300]}")
+            time.sleep(2 ** attempt)
+
+    def send_chunk(self, chunk: list):
+        created = updated = 0
+        errors = []
+        for line_number, key, payload in chunk:
+            if self.dry_run:
+                outcome = 'updated' if key in self.existing else 'created'
+            else:
+                try:
+                    outcome = self.send(key, payload)
+                except RowError as e:
+                    errors.append((line_number, key, str(e)))
+                    continue
+            if outcome == 'created':
+                created += 1
+            else:
+                updated += 1
+        with self.lock:
+            self.created += created
+            self.updated += updated
+            self.processed += len(chunk)
+            self.errors.extend(errors)
+
+    def run(self, rows, progress=None):
+        """Import all rows; at most 2 x workers chunks are read ahead of the uploads"""
+        self.load_existing()
+        prepared = self.prepare(rows)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            in_flight = set()
+            while True:
+                chunk = list(islice(prepared, self.chunk_size))
+                if chunk:
+                    in_flight.add(pool.submit(self.send_chunk, chunk))
+                if len(in_flight) >= self.workers * 2 or (not chunk and in_flight):
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    if progress:
+                        progress(self)
+                if not chunk and not in_flight:
+                    break
+        if progress:
+            progress(self)
+        return self.created, self.updated, self.errors
+
+    def write_errors(self, path: str):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['line', self.key_field, 'error'])
+            writer.writerows(sorted(self.errors, key=lambda error: error[0] or 0))
+
+
+def print_progress(importer: BulkImporter):
+    with importer.lock:
+        line = (f"\r{importer.processed} sent: {importer.created} created, "
+                f"{importer.updated} updated, {len(importer.errors)} errors")
+    print(line, end='', file=sys.stderr, flush=True)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    args = sys.argv[1:]
+    dry_run = '--dry-run' in args
+    organization = None
+    if '--organization' in args:
+        index = args.index('--organization')
+        organization = args[index + 1]
+        del args[index:index + 2]
+    args = [arg for arg in args if arg != '--dry-run']
+    if len(args) != 2 or args[0] not in IMPORT_KINDS:
+        print(__doc__.strip().splitlines()[-1].strip())
+        sys.exit(2)
+    kind, path = args
+
+    headers = login_headers(API_BASE_URL)
+
+    importer = BulkImporter(API_BASE_URL, headers, kind, organization, dry_run=dry_run)
+    started = time.perf_counter()
+    created, updated, errors = importer.run(read_rows(path), print_progress)
+    print(file=sys.stderr)
+    print(f"{kind}: {created} created, {updated} updated, {len(errors)} errors in {time.perf_counter() - started:.1f}s"
+          + (" (dry run, nothing was sent)" if dry_run else ""))
+    if errors:
+        errors_path = f"{os.path.splitext(path)[0]}.errors.csv"
+        importer.write_errors(errors_path)
+        print(f"Rejected rows written to {errors_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""Scheduled AI analysis of bin CCTV snapshots.
+
+Bins with a camera_url are swept every CCTV_SWEEP_SECONDS. Each sweep looks
+at the bins whose predicted fill (last analysed level plus a learned fill
+rate) and staleness make them most urgent, fetches their snapshots and
+compares a small grayscale thumbnail with the previous frame. Only frames
+that changed go to the AI, in batches of CCTV_AI_BATCH_SIZE, and each image
+counts against the AI budget shared with citizen photo reports.
+
+Without numpy and Pillow frames cannot be compared, so every snapshot counts
+as changed.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from dataclasses import dataclass
+from io import BytesIO
+
+import requests
+
+from records import BinDetails
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    # Without them every snapshot counts as changed
+    np = Image = None
+
+logger = logging.getLogger(__name__)
+
+# How often the scheduler picks bins to look at
+CCTV_SWEEP_SECONDS = 300
+# How often bins with cameras are reloaded from the platform
+CCTV_REFRESH_SECONDS = 900
+# Snapshots fetched per sweep, and at most this many at a time
+CCTV_FETCH_PER_SWEEP = 48
+CCTV_FETCH_CONCURRENCY = 8
+# Changed snapshots sent to the AI per sweep, and per request
+CCTV_AI_BUDGET_PER_SWEEP = 16
+CCTV_AI_BATCH_SIZE = 4
+# A bin is not looked at again sooner than this
+CCTV_MIN_INTERVAL_SECONDS = 600
+# A bin unseen for this long is as urgent as a full one
+CCTV_STALE_HOURS = 6
+# Side of the grayscale thumbnail frames are compared on
+CCTV_THUMBNAIL_SIZE = 32
+# Mean absolute thumbnail difference (0-255) below which a frame counts as unchanged
+CCTV_DIFF_THRESHOLD = 6.0
+# Fill rate (percent per hour) assumed until a bin has two analyses
+CCTV_DEFAULT_FILL_RATE = 2.0
+
+
+@dataclass(slots=True)
+class Camera:
+    bin: BinDetails
+    level: float = 0.0
+    # Percent per hour, learned from consecutive analyses
+    rate: float = CCTV_DEFAULT_FILL_RATE
+    analysed_at: float = 0.0
+    # Last time a snapshot was fetched, changed or not
+    checked_at: float = 0.0
+    thumbnail: 'np.ndarray' = None
+
+    def priority(self, now: float):
+        """Predicted fill (0-1) plus staleness; higher is more urgent"""
+        hours = (now - self.analysed_at) / 3600 if self.analysed_at else CCTV_STALE_HOURS
+        predicted = min(self.level + self.rate * hours, 100.0)
+        return predicted / 100.0 + hours / CCTV_STALE_HOURS
+
+
+def thumbnail(image_bytes: bytes):
+    """Small grayscale version of a frame for change detection, None if it cannot be decoded"""
+    if Image is None or np is None:
+        return None
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            image.draft('L', (CCTV_THUMBNAIL_SIZE * 4, CCTV_THUMBNAIL_SIZE * 4))
+            small = image.convert('L').resize((CCTV_THUMBNAIL_SIZE, CCTV_THUMBNAIL_SIZE), Image.BILINEAR)
+            return np.asarray(small, dtype=np.int16)
+    except Exception as e:
+        logger.error(f"Could not decode CCTV snapshot: {e}")
+        return None
+
+
+def frame_difference(previous, current):
+    """Mean absolute difference of two thumbnails, with overall brightness shifts
+    (day/night, camera exposure) removed"""
+    if previous is None or current is None:
+        return float('inf')
+    return float(np.abs((current - current.mean()) - (previous - previous.mean())).mean())
+
+
+class CCTVScheduler:
+    """Priority-driven CCTV sweeps for bins with cameras.
+
+    Every sweep takes the bins most likely to have changed (predicted fill
+    from their last analysis and learned fill rate, plus time since they were
+    last analysed), fetches their snapshots concurrently and drops frames that
+    barely differ from the previous one. Only the remaining frames use the AI
+    budget; they are analysed in batches by `analyze_batch`, a coroutine that
+    takes a list of JPEG bytes and returns one AIAnalysis per image.
+    """
+    def __init__(self, api_base_url: str, get_auth_headers, analyze_batch, on_full=None, images=None):
+        self.api_base_url = api_base_url
+        self.get_auth_headers = get_auth_headers
+        self.analyze_batch = analyze_batch
+        # Coroutine called with the BinDetails of a bin a camera saw full
+        self.on_full = on_full
+        # ImageWorkers to make thumbnails in; a thread is used without one
+        self.images = images
+        # bin id -> Camera
+        self.cameras = {}
+        self.refreshed_at = 0.0
+
+    def __len__(self):
+        return len(self.cameras)
+
+    def apply_bins(self, bins: list):
+        """Sync cameras with a /waste-bins/ listing, keeping what was learned about known bins"""
+        cameras = {}
+        for data in bins:
+            camera_url = (data.get('camera_url') or data.get('cameraUrl') or '').strip()
+            if not camera_url:
+                continue
+            try:
+                details = BinDetails.from_dict(data)
+            except (KeyError, ValueError) as e:
+                logger.error(f"Skipping bin with camera: {e}")
+                continue
+            camera = self.cameras.get(details.id)
+            if camera is None or camera.bin.camera_url != details.camera_url:
+                camera = Camera(details, float(details.fill_level or 0))
+                if details.fill_rate:
+                    camera.rate = float(details.fill_rate)
+            else:
+                camera.bin = details
+            cameras[details.id] = camera
+        self.cameras = cameras
+        self.refreshed_at = time.time()
+
+    def fetch_bins(self):
+        headers = self.get_auth_headers()
+        if not headers:
+            logger.error("CCTV bin refresh skipped: no authentication headers")
+            return None
+        try:
+            response = requests.get(f"{self.api_base_url}/waste-bins/", headers=headers, timeout=60)
+        except Exception as e:
+            logger.error(f"CCTV bin refresh failed: {e}")
+            return None
+        if response.status_code != 200:
+            logger.error(f"CCTV bin refresh failed: {response.status_code}, {response.text}")
+            return None
+        data = response.json()
+        return data.get('results', []) if isinstance(data, dict) else data
+
+    def due(self, now: float, count: int = CCTV_FETCH_PER_SWEEP):
+        """Cameras to look at this sweep, most urgent first"""
+        eligible = (c for c in self.cameras.values() if now - c.checked_at >= CCTV_MIN_INTERVAL_SECONDS)
+        return heapq.nlargest(count, eligible, key=lambda camera: camera.priority(now))
+
+    def fetch_snapshot(self, camera: Camera):
+        try:
+            response = requests.get(camera.bin.camera_url, timeout=20)
+        except Exception as e:
+            logger.error(f"Snapshot of bin {camera.bin.id} failed: {e}")
+            return None
+        if response.status_code != 200 or not response.content:
+            logger.error(f"Snapshot of bin {camera.bin.id} failed: {response.status_code}")
+            return None
+        return response.content
+
+    async def fetch_snapshots(self, cameras: list):
+        """[(camera, image bytes, thumbnail)] for the snapshots that could be fetched"""
+        semaphore = asyncio.Semaphore(CCTV_FETCH_CONCURRENCY)
+
+        async def fetch(camera):
+            async with semaphore:
+                image_bytes = await asyncio.to_thread(self.fetch_snapshot, camera)
+                if image_bytes is None:
+                    # Back off from a camera that is down instead of retrying it every sweep
+                    camera.checked_at = time.time()
+                    return None
+                if self.images is not None:
+                    return camera, image_bytes, await self.images.thumbnail(image_bytes)
+                return camera, image_bytes, await asyncio.to_thread(thumbnail, image_bytes)
+
+        results = await asyncio.gather(*(fetch(camera) for camera in cameras))
+        return [result for result in results if result is not None]
+
+    def upload(self, camera: Camera, image_bytes: bytes, analysis):
+        """Store the analysed snapshot on the bin, like a photo from the bot"""
+        headers = dict(self.get_auth_headers() or {})
+        headers.pop('Content-Type', None)
+        try:
+            response = requests.patch(
+                f"{self.api_base_url}/waste-bins/{camera.bin.id}/update-image-file/",
+                files={'image': (f"cctv_{camera.bin.id}.jpg", image_bytes, 'image/jpeg')},
+                data={
+                    'is_full': analysis.is_full,
+                    'fill_level': analysis.fill_level,
+                    'image_source': 'CCTV',
+                    'last_analysis': analysis.summary(),
+                },
+                headers=headers,
+                timeout=60
+            )
+            if response.status_code in [200, 201]:
+                return True
+            logger.error(f"Error updating bin {camera.bin.id} from CCTV: {response.status_code}, {response.text}")
+        except Exception as e:
+            logger.error(f"Exception updating bin {camera.bin.id} from CCTV: {e}")
+        return False
+
+    def learn(self, camera: Camera, analysis, now: float):
+        """Update a camera's level and fill rate from a new analysis"""
+        level = float(analysis.fill_level)
+        if camera.analysed_at and level >= camera.level:
+            hours = (now - camera.analysed_at) / 3600
+            if hours > 0:
+                # Smooth the rate; drops (emptying) keep the previous rate
+                camera.rate = 0.5 * camera.rate + 0.5 * (level - camera.level) / hours
+        camera.level = level
+        camera.analysed_at = now
+
+    async def sweep(self, now: float = None):
+        """Run one sweep, returning (snapshots fetched, unchanged, analysed)"""
+        now = now or time.time()
+        snapshots = await self.fetch_snapshots(self.due(now))
+        changed = []
+        for camera, image_bytes, small in snapshots:
+            if frame_difference(camera.thumbnail, small) < CCTV_DIFF_THRESHOLD:
+                # Same scene as last time, so the last analysis still holds; analysed_at stays,
+                # so the next fill rate is measured from the analysis, not from this frame
+                camera.checked_at = now
+                continue
+            changed.append((camera, image_bytes, small))
+        unchanged = len(snapshots) - len(changed)
+        # Most urgent first; the rest stays eligible for the next sweep
+        changed = changed[:CCTV_AI_BUDGET_PER_SWEEP]
+
+        analysed = 0
+        for start in range(0, len(changed), CCTV_AI_BATCH_SIZE):
+            batch = changed[start:start + CCTV_AI_BATCH_SIZE]
+            analyses = await self.analyze_batch([image_bytes for _, image_bytes, _ in batch])
+            for (camera, image_bytes, small), analysis in zip(batch, analyses):
+                camera.checked_at = now
+                if analysis is None or not analysis.is_waste_bin:
+                    continue
+                camera.thumbnail = small
+                self.learn(camera, analysis, now)
+                analysed += 1
+                if await asyncio.to_thread(self.upload, camera, image_bytes, analysis):
+                    camera.bin.fill_level = analysis.fill_level
+                    camera.bin.is_full = analysis.is_full
+                    camera.bin.ai_analysis = analysis
+                    if analysis.is_full and self.on_full is not None:
+                        await self.on_full(camera.bin)
+        logger.info(f"CCTV sweep: {len(snapshots)} snapshots, {unchanged} unchanged, {analysed} analysed")
+        return len(snapshots), unchanged, analysed
+
+    async def run(self):
+        while True:
+            try:
+                if time.time() - self.refreshed_at >= CCTV_REFRESH_SECONDS:
+                    bins = await asyncio.to_thread(self.fetch_bins)
+                    if bins is not None:
+                        self.apply_bins(bins)
+                if self.cameras:
+                    await self.sweep()
+            except Exception as e:
+                logger.error(f"CCTV sweep error: {e}")
+            await asyncio.sleep(CCTV_SWEEP_SECONDS)
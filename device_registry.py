@@ -0,0 +1,116 @@
+import logging
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Full refresh interval for the known-device list
+REGISTRY_REFRESH_SECONDS = 600
+# An unknown device ID triggers an early refresh, at most this often,
+# so newly registered devices are accepted without waiting for the full interval
+REGISTRY_MISS_REFRESH_SECONDS = 60
+
+
+class DeviceRegistry:
+    """Local cache of the IoT devices registered on the platform.
+    Lookups are O(1) set/dict operations so unknown device IDs can be dropped
+    before any authenticated API call is made.
+    """
+    def __init__(self, api_base_url: str, get_auth_headers):
+        self.api_base_url = api_base_url
+        self.get_auth_headers = get_auth_headers
+        # device_id -> device record as returned by /iot-devices/
+        self.devices = {}
+        self.loaded = False
+        self.last_refresh = 0.0
+        self.last_miss_refresh = 0.0
+        self.etag = None
+        self.last_modified = None
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __contains__(self, device_id):
+        return device_id in self.devices
+
+    def get(self, device_id: str):
+        """Get the cached device record for a device ID"""
+        return self.devices.get(device_id)
+
+    def is_known(self, device_id: str):
+        """Check whether a device ID is registered.
+        Until the first successful load every ID is accepted so readings are not lost
+        when the API is unreachable at startup.
+        """
+        if not self.loaded:
+            return True
+        return device_id in self.devices
+
+    def needs_refresh(self):
+        """Check whether the periodic refresh is due"""
+        return time.time() - self.last_refresh >= REGISTRY_REFRESH_SECONDS
+
+    def should_refresh_on_miss(self):
+        """Check whether an unknown device may trigger an early refresh"""
+        now = time.time()
+        if now - self.last_miss_refresh < REGISTRY_MISS_REFRESH_SECONDS:
+            return False
+        self.last_miss_refresh = now
+        return True
+
+    def apply(self, devices: list):
+        """Apply a device list to the cache, returning (added, removed) counts"""
+        incoming = {}
+        for device in devices:
+            device_id = device.get('device_id')
+            if device_id:
+                incoming[str(device_id)] = device
+        added = incoming.keys() - self.devices.keys()
+        removed = self.devices.keys() - incoming.keys()
+        # Update in place so readers never see an empty registry mid-refresh
+        for device_id in removed:
+            del self.devices[device_id]
+        self.devices.update(incoming)
+        return len(added), len(removed)
+
+    def refresh(self):
+        """Load the device list from /iot-devices/.
+        Conditional request headers let the server answer 304 when nothing changed.
+        """
+        headers = self.get_auth_headers()
+        if not headers:
+            logger.error("Device registry refresh skipped: no authentication headers")
+            return False
+        headers = dict(headers)
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        try:
+            response = requests.get(f"{self.api_base_url}/iot-devices/", headers=headers, timeout=30)
+        except Exception as e:
+            logger.error(f"Device registry refresh failed: {e}")
+            return False
+
+        self.last_refresh = time.time()
+        if response.status_code == 304:
+            return True
+        if response.status_code != 200:
+            logger.error(f"Device registry refresh failed: {response.status_code}, {response.text}")
+            return False
+
+        try:
+            data = response.json()
+        except ValueError as e:
+            logger.error(f"Device registry refresh failed: invalid JSON: {e}")
+            return False
+        # Support both plain lists and paginated {"results": [...]} responses
+        devices = data.get('results', []) if isinstance(data, dict) else data
+        added, removed = self.apply(devices)
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.loaded = True
+        if added or removed:
+            logger.info(f"Device registry refreshed: {len(self.devices)} devices (+{added}/-{removed})")
+        return True
@@ -0,0 +1,352 @@
+import logging
+import math
+import time
+
+import requests
+
+from records import Truck
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Grid cell edge in degrees, about 1.1 km north-south
+GRID_CELL_DEGREES = 0.01
+# Trucks below this fuel level are not dispatched
+DISPATCH_MIN_FUEL_LEVEL = 15
+# Full refresh interval for the truck list
+FLEET_REFRESH_SECONDS = 300
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float):
+    """Great-circle distance in km between two points given in degrees"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+class GridIndex:
+    """Uniform grid hash over (lat, lng) points.
+
+    Moving a point is O(1): it only changes cell when it crosses a cell edge.
+    Nearest-neighbour queries scan rings of cells outwards from the query
+    cell and stop as soon as no unscanned ring can hold a closer point, so
+    the cost depends on local density, not on how many points are indexed.
+    """
+    def __init__(self, cell_degrees: float = GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        # (row, col) -> set of item ids
+        self.cells = {}
+        # item id -> (lat, lng, (row, col))
+        self.positions = {}
+        # Bounding box of cells ever occupied, limits how far a query scans
+        self.bounds = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, item_id):
+        return item_id in self.positions
+
+    def cell_for(self, lat: float, lng: float):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def update(self, item_id, lat: float, lng: float):
+        """Insert a point or move it to a new position"""
+        cell = self.cell_for(lat, lng)
+        previous = self.positions.get(item_id)
+        if previous is not None and previous[2] != cell:
+            self.discard_from_cell(item_id, previous[2])
+        if previous is None or previous[2] != cell:
+            self.cells.setdefault(cell, set()).add(item_id)
+            self.extend_bounds(cell)
+        self.positions[item_id] = (lat, lng, cell)
+
+    def remove(self, item_id):
+        previous = self.positions.pop(item_id, None)
+        if previous is not None:
+            self.discard_from_cell(item_id, previous[2])
+
+    def discard_from_cell(self, item_id, cell):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(item_id)
+            if not members:
+                del self.cells[cell]
+
+    def extend_bounds(self, cell):
+        row, col = cell
+        if self.bounds is None:
+            self.bounds = [row, row, col, col]
+        else:
+            self.bounds[0] = min(self.bounds[0], row)
+            self.bounds[1] = max(self.bounds[1], row)
+            self.bounds[2] = min(self.bounds[2], col)
+            self.bounds[3] = max(self.bounds[3], col)
+
+    def ring(self, row: int, col: int, radius: int):
+        """Cells at Chebyshev distance radius from (row, col)"""
+        if radius == 0:
+            yield row, col
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, col - radius
+            yield r, col + radius
+
+    def within(self, lat: float, lng: float, radius_km: float):
+        """Yield (item_id, distance_km) for every item within radius_km of a point"""
+        if not self.positions:
+            return
+        dlat = radius_km / KM_PER_DEGREE
+        dlng = dlat / max(math.cos(math.radians(min(89.9, abs(lat) + dlat))), 1e-6)
+        min_row, min_col = self.cell_for(lat - dlat, lng - dlng)
+        max_row, max_col = self.cell_for(lat + dlat, lng + dlng)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for item_id in self.cells.get((row, col), ()):
+                    item_lat, item_lng, _ = self.positions[item_id]
+                    km = haversine_km(lat, lng, item_lat, item_lng)
+                    if km <= radius_km:
+                        yield item_id, km
+
+    def nearest(self, lat: float, lng: float, accept=None, max_km: float = None):
+        """Find the closest item, returning (item_id, distance_km) or None.
+        accept, when given, filters candidates by item id.
+        """
+        if not self.positions:
+            return None
+        row, col = self.cell_for(lat, lng)
+        min_row, max_row, min_col, max_col = self.bounds
+        max_radius = max(row - min_row, max_row - row, col - min_col, max_col - col, 0)
+        best_id, best_km = None, math.inf
+        for radius in range(max_radius + 1):
+            for cell in self.ring(row, col, radius):
+                for item_id in self.cells.get(cell, ()):
+                    if accept is not None and not accept(item_id):
+                        continue
+                    item_lat, item_lng, _ = self.positions[item_id]
+                    km = haversine_km(lat, lng, item_lat, item_lng)
+                    if km < best_km:
+                        best_id, best_km = item_id, km
+            # Every cell in the next ring is at least radius whole cells away
+            lat_edge = min(89.9, abs(lat) + (radius + 1) * self.cell_degrees)
+            next_ring_km = radius * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(lat_edge))
+            if best_km <= next_ring_km or (max_km is not None and next_ring_km > max_km):
+                break
+        if best_id is None or (max_km is not None and best_km > max_km):
+            return None
+        return best_id, best_km
+
+
+class TruckDispatcher:
+    """Assigns the nearest idle truck of a bin's Toza Hudud when the bin is reported full.
+
+    Every Toza Hudud has its own GridIndex holding only dispatchable trucks
+    (IDLE, located, enough fuel), so a query never looks at busy trucks or
+    other districts. GPS fixes update the index in place; the full truck list
+    is only reloaded every FLEET_REFRESH_SECONDS.
+    """
+    def __init__(self, api_base_url: str, get_auth_headers):
+        self.api_base_url = api_base_url
+        self.get_auth_headers = get_auth_headers
+        # truck_id -> Truck
+        self.trucks = {}
+        # toza_hudud -> GridIndex of dispatchable trucks
+        self.indexes = {}
+        # truck_id -> toza_hudud of the index it is currently in
+        self.indexed_in = {}
+        # bin_id -> truck_id
+        self.assignments = {}
+        # truck_id -> status set locally and not yet saved on the platform
+        self.pending_statuses = {}
+        # Trucks whose location comes from GPS fixes, fresher than the truck list
+        self.gps_located = set()
+        self.last_refresh = 0.0
+
+    def __len__(self):
+        return len(self.trucks)
+
+    def is_dispatchable(self, truck: Truck):
+        return (
+            truck.status == 'IDLE'
+            and truck.location is not None
+            and truck.toza_hudud is not None
+            and (truck.fuel_level is None or truck.fuel_level >= DISPATCH_MIN_FUEL_LEVEL)
+        )
+
+    def reindex(self, truck_id: str):
+        """Put a truck in, or take it out of, its district index"""
+        truck = self.trucks.get(truck_id)
+        district = self.indexed_in.get(truck_id)
+        if district is not None and (truck is None or not self.is_dispatchable(truck) or district != truck.toza_hudud):
+            self.indexes[district].remove(truck_id)
+            del self.indexed_in[truck_id]
+            district = None
+        if truck is not None and self.is_dispatchable(truck):
+            index = self.indexes.setdefault(truck.toza_hudud, GridIndex())
+            index.update(truck_id, *truck.location)
+            self.indexed_in[truck_id] = truck.toza_hudud
+
+    def upsert(self, truck: Truck):
+        self.trucks[truck.id] = truck
+        self.reindex(truck.id)
+
+    def apply(self, trucks: list):
+        """Apply a full truck list, returning (added, removed) counts.
+        Statuses not yet saved on the platform and GPS positions win over the list.
+        """
+        incoming = {truck.id: truck for truck in trucks}
+        added = incoming.keys() - self.trucks.keys()
+        removed = self.trucks.keys() - incoming.keys()
+        for truck_id in removed:
+            del self.trucks[truck_id]
+            self.pending_statuses.pop(truck_id, None)
+            self.gps_located.discard(truck_id)
+            self.reindex(truck_id)
+        for truck in incoming.values():
+            current = self.trucks.get(truck.id)
+            if current is not None:
+                if truck.id in self.pending_statuses:
+                    truck.status = current.status
+                if truck.id in self.gps_located:
+                    truck.location = current.location
+            self.upsert(truck)
+        return len(added), len(removed)
+
+    def update_position(self, truck_id: str, lat: float, lng: float):
+        """Apply a GPS fix; unknown trucks are ignored until the next refresh"""
+        truck = self.trucks.get(truck_id)
+        if truck is None:
+            return False
+        truck.location = (lat, lng)
+        self.gps_located.add(truck_id)
+        if truck_id in self.indexed_in:
+            self.indexes[self.indexed_in[truck_id]].update(truck_id, lat, lng)
+        else:
+            self.reindex(truck_id)
+        return True
+
+    def set_status(self, truck_id: str, status: str):
+        truck = self.trucks.get(truck_id)
+        if truck is None:
+            return False
+        truck.status = status
+        self.reindex(truck_id)
+        return True
+
+    def nearest_idle_truck(self, bin_details):
+        """Find (truck, distance_km) closest to a bin within its Toza Hudud, or None"""
+        if bin_details.location is None:
+            return None
+        index = self.indexes.get(bin_details.toza_hudud)
+        if index is None:
+            return None
+        found = index.nearest(*bin_details.location)
+        if found is None:
+            return None
+        truck_id, km = found
+        return self.trucks[truck_id], km
+
+    def assign(self, bin_details):
+        """Reserve the nearest idle truck for a full bin.
+        The truck is marked BUSY locally right away so concurrent reports never
+        get the same truck. Returns (truck, distance_km), or None when no truck
+        is available. A bin that already has a busy truck keeps it.
+        """
+        assigned_id = self.assignments.get(bin_details.id)
+        if assigned_id is not None:
+            truck = self.trucks.get(assigned_id)
+            if truck is not None and truck.status == 'BUSY':
+                return truck, None
+            del self.assignments[bin_details.id]
+        found = self.nearest_idle_truck(bin_details)
+        if found is None:
+            return None
+        truck, km = found
+        self.set_status(truck.id, 'BUSY')
+        # push_assignment saves BUSY; an IDLE still waiting to be saved must not overwrite it
+        self.pending_statuses.pop(truck.id, None)
+        self.assignments[bin_details.id] = truck.id
+        return truck, km
+
+    def set_idle(self, truck_id: str):
+        """Mark a truck IDLE locally and queue the change for flush_statuses"""
+        if self.set_status(truck_id, 'IDLE'):
+            self.pending_statuses[truck_id] = 'IDLE'
+
+    def release(self, truck_id: str):
+        """Return a truck to the idle pool, e.g. after a failed assignment or a completed pickup"""
+        for bin_id, assigned_id in list(self.assignments.items()):
+            if assigned_id == truck_id:
+                del self.assignments[bin_id]
+        self.set_idle(truck_id)
+
+    def complete(self, bin_id: str):
+        """Release the truck assigned to a bin once it has been collected, returning its id"""
+        truck_id = self.assignments.pop(bin_id, None)
+        if truck_id is not None and truck_id not in self.assignments.values():
+            self.set_idle(truck_id)
+        return truck_id
+
+    def push_status(self, truck_id: str, status: str):
+        """Save a truck status on the platform"""
+        try:
+            response = requests.patch(
+                f"{self.api_base_url}/trucks/{truck_id}/",
+                json={'status': status},
+                headers=self.get_auth_headers(),
+                timeout=15
+            )
+            if response.status_code in [200, 201, 204]:
+                return True
+            logger.error(f"Truck status update failed for {truck_id}: {response.status_code}, {response.text}")
+        except Exception as e:
+            logger.error(f"Exception updating truck {truck_id}: {e}")
+        return False
+
+    def push_assignment(self, truck: Truck):
+        """Mark the truck BUSY on the platform"""
+        return self.push_status(truck.id, 'BUSY')
+
+    def flush_statuses(self):
+        """Save queued statuses on the platform, keeping failed ones for the next flush.
+        Blocking; run it in a worker thread. Returns the number saved.
+        """
+        saved = 0
+        for truck_id, status in list(self.pending_statuses.items()):
+            if self.push_status(truck_id, status):
+                saved += 1
+                # Only drop the entry if no newer status was queued meanwhile
+                if self.pending_statuses.get(truck_id) == status:
+                    del self.pending_statuses[truck_id]
+        return saved
+
+    def needs_refresh(self):
+        return time.time() - self.last_refresh >= FLEET_REFRESH_SECONDS
+
+    def fetch_trucks(self):
+        """Load the truck list from /trucks/, returns None on failure"""
+        try:
+            response = requests.get(f"{self.api_base_url}/trucks/", headers=self.get_auth_headers(), timeout=30)
+        except Exception as e:
+            logger.error(f"Fleet refresh failed: {e}")
+            return None
+        self.last_refresh = time.time()
+        if response.status_code != 200:
+            logger.error(f"Fleet refresh failed: {response.status_code}, {response.text}")
+            return None
+        data = response.json()
+        # Support both plain lists and paginated {"results": [...]} responses
+        items = data.get('results', []) if isinstance(data, dict) else data
+        trucks = []
+        for item in items:
+            try:
+                trucks.append(Truck.from_dict(item))
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Skipping invalid truck record: {e}")
+        return trucks
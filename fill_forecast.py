@@ -0,0 +1,192 @@
+"""Fill-rate forecasting for every waste bin in one vectorized pass.
+
+All bins are loaded from /waste-bins/ in one request. The recent trend
+events of every bin are packed into padded (bins x points) NumPy arrays,
+and a recency-weighted linear fill rate is fitted for all bins at once,
+using only the events since the bin was last emptied. Bins without enough
+history fall back to their stored fill_rate (percent per hour).
+
+The result is a predicted time-to-full per bin and a pickup schedule of
+the bins due within PICKUP_HORIZON_HOURS, ordered by due time.
+
+Usage:
+    python fill_forecast.py
+"""
+import logging
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+
+from api_login import login_headers
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://deklorantapi.cdcgroup.uz/api"
+
+# Only the most recent trend events of a bin are used
+MAX_TREND_POINTS = 64
+# A drop in fill level larger than this between two events means the bin was emptied
+EMPTIED_DROP_PERCENT = 20
+# Older events weigh less; weight halves every this many hours
+RATE_HALF_LIFE_HOURS = 48
+FULL_LEVEL_PERCENT = 100
+# Bins predicted to be full within this horizon go into the pickup schedule
+PICKUP_HORIZON_HOURS = 24
+# Pickups are scheduled this long before the predicted full time
+PICKUP_LEAD_HOURS = 2
+
+
+def _timestamp(value):
+    """Trend timestamps are ISO strings; naive ones are taken as UTC"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return np.nan
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def pack_trends(bins: list, max_points: int = MAX_TREND_POINTS):
+    """Pack raw /waste-bins/ records into padded arrays.
+    Returns (ids, toza_hudud, times, levels, fill_levels, fill_rates, is_full); times and
+    levels are (bins, max_points) arrays, oldest event first, NaN padded on the left.
+    """
+    count = len(bins)
+    times = np.full((count, max_points), np.nan)
+    levels = np.full((count, max_points), np.nan, dtype=np.float32)
+    fill_levels = np.zeros(count, dtype=np.float32)
+    fill_rates = np.full(count, np.nan, dtype=np.float32)
+    is_full = np.zeros(count, dtype=bool)
+    ids = []
+    districts = []
+    for row, data in enumerate(bins):
+        ids.append(str(data['id']))
+        districts.append(data.get('toza_hudud') or data.get('tozaHudud'))
+        fill_levels[row] = data.get('fill_level', data.get('fillLevel')) or 0
+        is_full[row] = bool(data.get('is_full', data.get('isFull')))
+        rate = data.get('fill_rate', data.get('fillRate'))
+        if rate is not None:
+            fill_rates[row] = rate
+        trend = (data.get('trend') or data.get('history') or [])[-max_points:]
+        if not trend:
+            continue
+        offset = max_points - len(trend)
+        times[row, offset:] = [_timestamp(event.get('timestamp')) for event in trend]
+        levels[row, offset:] = [
+            event.get('fillLevel', event.get('fill_level', np.nan)) for event in trend
+        ]
+    # Events are expected in time order; sort rows that are not
+    unsorted = np.any(np.diff(times, axis=1) < 0, axis=1)
+    if unsorted.any():
+        order = np.argsort(np.where(np.isnan(times[unsorted]), -np.inf, times[unsorted]), axis=1)
+        times[unsorted] = np.take_along_axis(times[unsorted], order, axis=1)
+        levels[unsorted] = np.take_along_axis(levels[unsorted], order, axis=1)
+    return ids, districts, times, levels, fill_levels, fill_rates, is_full
+
+
+def fit_fill_rates(times, levels, now: float):
+    """Fit fill rate (percent per hour) and level at `now` for every bin.
+    Bins with fewer than two usable events since their last emptying get NaN.
+    """
+    valid = ~np.isnan(times) & ~np.isnan(levels)
+    # Ignore everything up to and including the last emptying
+    drops = np.zeros_like(valid)
+    drops[:, 1:] = (levels[:, 1:] < levels[:, :-1] - EMPTIED_DROP_PERCENT) & valid[:, 1:] & valid[:, :-1]
+    columns = np.arange(times.shape[1])
+    last_drop = np.max(np.where(drops, columns, 0), axis=1)
+    valid &= columns[None, :] >= last_drop[:, None]
+
+    hours = np.where(valid, (times - now) / 3600, 0.0)
+    y = np.where(valid, levels, 0.0).astype(np.float64)
+    weights = np.where(valid, 0.5 ** (-hours / RATE_HALF_LIFE_HOURS), 0.0)
+    total = weights.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_t = (weights * hours).sum(axis=1) / total
+        mean_y = (weights * y).sum(axis=1) / total
+        dt = np.where(valid, hours - mean_t[:, None], 0.0)
+        dy = np.where(valid, y - mean_y[:, None], 0.0)
+        rate = (weights * dt * dy).sum(axis=1) / (weights * dt * dt).sum(axis=1)
+        # Intercept at hour 0 is the level now
+        level_now = mean_y - rate * mean_t
+    enough = valid.sum(axis=1) >= 2
+    rate = np.where(enough, rate, np.nan)
+    level_now = np.where(enough, level_now, np.nan)
+    return rate, level_now
+
+
+def forecast(bins: list, now: float = None):
+    """Predict hours until full for every bin in a raw /waste-bins/ listing.
+    Returns a dict of arrays keyed 'ids', 'toza_hudud', 'level', 'rate', 'hours_to_full', 'fitted';
+    hours_to_full is inf for bins that are not filling and 0 for full ones.
+    """
+    now = now or time.time()
+    ids, districts, times, levels, fill_levels, fill_rates, is_full = pack_trends(bins)
+    rate, level_now = fit_fill_rates(times, levels, now)
+
+    fitted = np.isfinite(rate) & (rate > 0)
+    rate = np.where(fitted, rate, fill_rates)
+    level = np.where(np.isfinite(level_now) & fitted, level_now, fill_levels)
+    level = np.where(is_full, FULL_LEVEL_PERCENT, np.clip(level, 0, FULL_LEVEL_PERCENT))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hours_to_full = np.where(rate > 0, (FULL_LEVEL_PERCENT - level) / rate, np.inf)
+    hours_to_full = np.where(level >= FULL_LEVEL_PERCENT, 0.0, np.nan_to_num(hours_to_full, nan=np.inf, posinf=np.inf))
+    return {
+        'ids': ids,
+        'toza_hudud': districts,
+        'level': level,
+        'rate': np.nan_to_num(rate, nan=0.0),
+        'hours_to_full': hours_to_full,
+        'fitted': fitted,
+    }
+
+
+def pickup_schedule(result: dict, now: float = None, horizon_hours: float = PICKUP_HORIZON_HOURS):
+    """Bins due for pickup within the horizon, earliest first"""
+    now = now or time.time()
+    hours = result['hours_to_full']
+    due = np.flatnonzero(hours <= horizon_hours)
+    due = due[np.argsort(hours[due], kind='stable')]
+    schedule = []
+    for row in due.tolist():
+        full_at = now + hours[row] * 3600
+        schedule.append({
+            'bin_id': result['ids'][row],
+            'toza_hudud': result['toza_hudud'][row],
+            'fill_level': round(float(result['level'][row]), 1),
+            'fill_rate': round(float(result['rate'][row]), 2),
+            'full_at': datetime.fromtimestamp(full_at, tz=timezone.utc).isoformat(),
+            'pickup_at': datetime.fromtimestamp(max(now, full_at - PICKUP_LEAD_HOURS * 3600), tz=timezone.utc).isoformat(),
+        })
+    return schedule
+
+
+def fetch_bins(api_base_url: str, headers: dict):
+    """Load all bins with their trend history"""
+    response = requests.get(f"{api_base_url}/waste-bins/", headers=headers, timeout=120)
+    response.raise_for_status()
+    data = response.json()
+    return data.get('results', []) if isinstance(data, dict) else data
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    headers = login_headers(API_BASE_URL)
+
+    bins = fetch_bins(API_BASE_URL, headers)
+    started = time.perf_counter()
+    result = forecast(bins)
+    schedule = pickup_schedule(result)
+    elapsed = time.perf_counter() - started
+
+    for item in schedule:
+        print(f"{item['pickup_at']}  bin {item['bin_id']} ({item['toza_hudud']}): "
+              f"{item['fill_level']}% +{item['fill_rate']}%/h, full at {item['full_at']}")
+    print(f"{len(schedule)} of {len(bins)} bins due within {PICKUP_HORIZON_HOURS}h, "
+          f"{int(result['fitted'].sum())} fitted from trend, forecast in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""Streaming truck GPS ingestion with automatic pickup confirmation.
+
+Trucks send fixes over UDP, either as JSON or as a compact delta frame:
+
+    <magic 'GP':2s><version:B><id length:B><truck id>
+    <lat*1e6:i><lng*1e6:i><timestamp:I><delta count:H>
+    then `delta count` records <dlat*1e6:h><dlng*1e6:h><dt seconds:H>,
+    each relative to the previous fix
+
+A truck buffering one fix per second sends 6 bytes per extra fix instead of
+a JSON object. JSON datagrams are {"truck_id", "lat", "lng", "ts"} or
+{"truck_id", "fixes": [[ts, lat, lng], ...]}.
+
+Fixes are smoothed per truck, outliers that imply an impossible speed are
+dropped, and positions are pushed to the platform only after the truck has
+moved POSITION_PUSH_METERS. Each smoothed fix is checked against the
+geofences of nearby full bins only, through a grid index; a truck that
+stays inside a geofence for PICKUP_DWELL_SECONDS confirms the pickup.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import struct
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import requests
+
+from dispatch import GridIndex, haversine_km
+from listener_auth import is_local_host, strip_datagram_token
+from records import BinDetails
+
+logger = logging.getLogger(__name__)
+
+# Local only by default; a public interface is only bound when GPS_TOKEN is set
+GPS_HOST = os.getenv('GPS_HOST', "127.0.0.1")
+GPS_UDP_PORT = 9102
+# Shared secret expected on the first line of every datagram, if set
+GPS_TOKEN = os.getenv('GPS_TOKEN') or None
+
+FRAME_MAGIC = b'GP'
+FRAME_HEADER = struct.Struct('<2sB')
+TRACK_HEADER = struct.Struct('<iiIH')
+TRACK_DELTA = struct.Struct('<hhH')
+COORD_SCALE = 1_000_000
+
+# Time constant of the exponential position filter
+SMOOTHING_SECONDS = 3.0
+# Fixes implying a faster jump than this are treated as GPS glitches
+MAX_SPEED_KMH = 130
+# Fixes older than this, or this far ahead of our clock, are dropped
+MAX_FIX_AGE_SECONDS = 300
+MAX_FIX_AHEAD_SECONDS = 60
+# After this many fixes in a row fail the speed check the track restarts from the latest one,
+# so a bad first fix cannot lock a truck out
+REANCHOR_AFTER_REJECTS = 5
+# Smoothed positions are pushed once they moved this far from the last pushed one
+POSITION_PUSH_METERS = 25
+# A truck enters a bin's geofence within ENTER meters and leaves it beyond EXIT meters
+GEOFENCE_ENTER_METERS = 40
+GEOFENCE_EXIT_METERS = 60
+# Geofence grid cells, about 220 m, so a lookup touches one to four cells
+GEOFENCE_CELL_DEGREES = 0.002
+# Time a truck must stay at a bin before the pickup counts
+PICKUP_DWELL_SECONDS = 45
+# How often positions and confirmed pickups are pushed to the platform
+GPS_FLUSH_SECONDS = 10
+
+
+def encode_track(truck_id: str, fixes: list):
+    """Encode [(ts, lat, lng), ...] of one truck as a delta frame"""
+    truck = truck_id.encode('ascii')
+    points = [(int(ts), round(lat * COORD_SCALE), round(lng * COORD_SCALE)) for ts, lat, lng in fixes]
+    deltas = [
+        TRACK_DELTA.pack(lat - prev_lat, lng - prev_lng, ts - prev_ts)
+        for (prev_ts, prev_lat, prev_lng), (ts, lat, lng) in zip(points, points[1:])
+    ]
+    first_ts, first_lat, first_lng = points[0]
+    return (
+        FRAME_HEADER.pack(FRAME_MAGIC, 1)
+        + bytes([len(truck)]) + truck
+        + TRACK_HEADER.pack(first_lat, first_lng, first_ts, len(deltas))
+        + b''.join(deltas)
+    )
+
+
+def decode_track(payload: bytes):
+    """Decode a delta frame into (truck_id, [(ts, lat, lng), ...])"""
+    magic, version = FRAME_HEADER.unpack_from(payload, 0)
+    if magic != FRAME_MAGIC or version != 1:
+        raise ValueError(f"Unsupported GPS frame {magic!r} v{version}")
+    offset = FRAME_HEADER.size
+    id_length = payload[offset]
+    truck_id = payload[offset + 1:offset + 1 + id_length].decode('ascii')
+    offset += 1 + id_length
+    lat, lng, ts, count = TRACK_HEADER.unpack_from(payload, offset)
+    offset += TRACK_HEADER.size
+    end = offset + count * TRACK_DELTA.size
+    if end > len(payload):
+        raise ValueError("Truncated GPS frame")
+    fixes = [(ts, lat / COORD_SCALE, lng / COORD_SCALE)]
+    for dlat, dlng, dt in TRACK_DELTA.iter_unpack(payload[offset:end]):
+        lat += dlat
+        lng += dlng
+        ts += dt
+        fixes.append((ts, lat / COORD_SCALE, lng / COORD_SCALE))
+    return truck_id, fixes
+
+
+def decode_payload(payload: bytes):
+    """Decode a GPS datagram into (truck_id, fixes), JSON or delta frame"""
+    if payload[:2] == FRAME_MAGIC:
+        return decode_track(payload)
+    data = json.loads(payload)
+    truck_id = str(data['truck_id'])
+    if 'fixes' in data:
+        return truck_id, [(float(ts), float(lat), float(lng)) for ts, lat, lng in data['fixes']]
+    return truck_id, [(float(data.get('ts') or time.time()), float(data['lat']), float(data['lng']))]
+
+
+@dataclass(slots=True)
+class TrackState:
+    lat: float
+    lng: float
+    ts: float
+    pushed_lat: float = None
+    pushed_lng: float = None
+    # Consecutive fixes rejected by the speed check
+    rejects: int = 0
+    # bin_id -> time the truck entered its geofence
+    inside: dict = field(default_factory=dict)
+
+
+class PickupGeofences:
+    """Geofences around full bins, indexed by position"""
+    def __init__(self):
+        self.index = GridIndex(GEOFENCE_CELL_DEGREES)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, bin_id):
+        return bin_id in self.index
+
+    def add_bin(self, bin_details):
+        if bin_details.location is not None:
+            self.index.update(bin_details.id, *bin_details.location)
+
+    def remove_bin(self, bin_id: str):
+        self.index.remove(bin_id)
+
+    def apply_bins(self, bins: list):
+        """Keep geofences for exactly the full bins of a /waste-bins/ listing"""
+        full = {b.id: b for b in bins if b.is_full and b.location is not None}
+        for bin_id in list(self.index.positions):
+            if bin_id not in full:
+                self.index.remove(bin_id)
+        for waste_bin in full.values():
+            self.add_bin(waste_bin)
+
+    def nearby(self, lat: float, lng: float, radius_meters: float):
+        return self.index.within(lat, lng, radius_meters / 1000)
+
+
+class GPSDatagramProtocol(asyncio.DatagramProtocol):
+    """Receives GPS datagrams and processes them inline, no task per fix"""
+    def __init__(self, ingestor):
+        self.ingestor = ingestor
+
+    def datagram_received(self, data, addr):
+        payload = strip_datagram_token(data, GPS_TOKEN)
+        if payload is None:
+            self.ingestor.metrics['unauthorized'] += 1
+            return
+        self.ingestor.accept_datagram(payload, source=f"udp:{addr[0]}")
+
+
+class GPSIngestor:
+    """Processes truck GPS fixes: smoothing, geofence dwell detection and batched platform updates.
+
+    Per-fix work is constant time: one filter step, one dispatcher index move
+    and a geofence lookup that only touches grid cells next to the truck.
+    Network calls happen in flush(), off the event loop.
+    """
+    def __init__(self, api_base_url: str, get_auth_headers, dispatcher=None):
+        self.api_base_url = api_base_url
+        self.get_auth_headers = get_auth_headers
+        self.dispatcher = dispatcher
+        self.geofences = PickupGeofences()
+        # truck_id -> TrackState
+        self.tracks = {}
+        # truck_id -> (lat, lng) waiting to be pushed, newer fixes overwrite older ones
+        self.pending_positions = {}
+        # bin_id -> (truck_id, confirmed_at)
+        self.pending_pickups = {}
+        self.metrics = Counter()
+        self.transport = None
+
+    def accept_datagram(self, payload: bytes, source: str = 'udp'):
+        """Decode one datagram and process its fixes, returning the number accepted"""
+        try:
+            truck_id, fixes = decode_payload(payload)
+        except Exception as e:
+            self.metrics['undecodable'] += 1
+            logger.warning(f"Ignored undecodable GPS payload from {source}: {e}")
+            return 0
+        return sum(1 for ts, lat, lng in fixes if self.process_fix(truck_id, ts, lat, lng))
+
+    def process_fix(self, truck_id: str, ts: float, lat: float, lng: float, now: float = None):
+        """Apply one raw fix, returning False when it was rejected"""
+        self.metrics['fixes'] += 1
+        # (0, 0) is what receivers report without a fix
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or (lat == 0 and lng == 0):
+            self.metrics['rejected'] += 1
+            return False
+        now = now or time.time()
+        if not now - MAX_FIX_AGE_SECONDS <= ts <= now + MAX_FIX_AHEAD_SECONDS:
+            self.metrics['stale'] += 1
+            return False
+        state = self.tracks.get(truck_id)
+        if state is None:
+            state = self.tracks[truck_id] = TrackState(lat, lng, ts)
+        else:
+            dt = ts - state.ts
+            if dt <= 0:
+                # Duplicate or out-of-order fix
+                self.metrics['rejected'] += 1
+                return False
+            if haversine_km(state.lat, state.lng, lat, lng) / dt * 3600 > MAX_SPEED_KMH:
+                self.metrics['rejected'] += 1
+                state.rejects += 1
+                if state.rejects < REANCHOR_AFTER_REJECTS:
+                    return False
+                # The fixes agree with each other, not with the anchor: restart the track here
+                logger.warning(f"Re-anchoring track of truck {truck_id} after {state.rejects} rejected fixes")
+                self.metrics['reanchored'] += 1
+                state.lat, state.lng, state.ts = lat, lng, ts
+                state.inside.clear()
+                dt = 0
+            state.rejects = 0
+            alpha = 1 - math.exp(-dt / SMOOTHING_SECONDS)
+            state.lat += alpha * (lat - state.lat)
+            state.lng += alpha * (lng - state.lng)
+            state.ts = ts
+
+        if self.dispatcher is not None:
+            self.dispatcher.update_position(truck_id, state.lat, state.lng)
+        if state.pushed_lat is None or \
+                haversine_km(state.pushed_lat, state.pushed_lng, state.lat, state.lng) * 1000 >= POSITION_PUSH_METERS:
+            state.pushed_lat, state.pushed_lng = state.lat, state.lng
+            self.pending_positions[truck_id] = (state.lat, state.lng)
+        self.check_geofences(truck_id, state)
+        return True
+
+    def check_geofences(self, truck_id: str, state: TrackState):
+        """Update which bin geofences a truck is in and confirm pickups after the dwell time"""
+        if not state.inside and not len(self.geofences):
+            return
+        near = dict(self.geofences.nearby(state.lat, state.lng, GEOFENCE_EXIT_METERS))
+        for bin_id in list(state.inside):
+            if bin_id not in near:
+                # Left the exit radius, or the bin was collected by another truck
+                del state.inside[bin_id]
+        for bin_id, km in near.items():
+            if bin_id not in state.inside:
+                if km * 1000 <= GEOFENCE_ENTER_METERS:
+                    state.inside[bin_id] = state.ts
+            elif state.ts - state.inside[bin_id] >= PICKUP_DWELL_SECONDS:
+                del state.inside[bin_id]
+                self.confirm_pickup(truck_id, bin_id, state.ts)
+
+    def confirm_pickup(self, truck_id: str, bin_id: str, ts: float):
+        self.geofences.remove_bin(bin_id)
+        self.pending_pickups[bin_id] = (truck_id, ts)
+        self.metrics['pickups'] += 1
+        if self.dispatcher is not None:
+            # Frees the truck locally and queues its IDLE status for flush()
+            assigned = self.dispatcher.complete(bin_id)
+            if assigned is not None and assigned != truck_id:
+                logger.info(f"Bin {bin_id} was assigned to truck {assigned} but collected by {truck_id}")
+        logger.info(f"Pickup of bin {bin_id} by truck {truck_id} confirmed by geofence")
+
+    def has_pending(self):
+        return bool(self.pending_positions or self.pending_pickups
+                    or (self.dispatcher is not None and self.dispatcher.pending_statuses))
+
+    def flush(self):
+        """Push changed truck positions, confirmed pickups and freed trucks to the platform"""
+        if not self.has_pending():
+            return 0
+        headers = self.get_auth_headers()
+        if not headers or 'Authorization' not in headers:
+            logger.error("GPS flush skipped: no authentication headers")
+            return 0
+
+        positions, self.pending_positions = self.pending_positions, {}
+        pickups, self.pending_pickups = self.pending_pickups, {}
+        sent = 0
+        with requests.Session() as session:
+            session.headers.update(headers)
+            for bin_id, (truck_id, confirmed_at) in pickups.items():
+                try:
+                    response = session.patch(
+                        f"{self.api_base_url}/waste-bins/{bin_id}/update-image/",
+                        json={'is_full': False, 'fill_level': 0},
+                        timeout=30
+                    )
+                    if response.status_code in [200, 201]:
+                        sent += 1
+                    else:
+                        logger.error(f"Error confirming pickup of bin {bin_id}: {response.status_code}, {response.text}")
+                except Exception as e:
+                    logger.error(f"Exception confirming pickup of bin {bin_id}: {e}")
+                    self.pending_pickups.setdefault(bin_id, (truck_id, confirmed_at))
+            for truck_id, (lat, lng) in positions.items():
+                try:
+                    response = session.patch(
+                        f"{self.api_base_url}/trucks/{truck_id}/",
+                        json={'location': {'lat': round(lat, 6), 'lng': round(lng, 6)}},
+                        timeout=30
+                    )
+                    if response.status_code in [200, 204]:
+                        sent += 1
+                    else:
+                        logger.error(f"Error updating position of truck {truck_id}: {response.status_code}, {response.text}")
+                except Exception as e:
+                    logger.error(f"Exception updating position of truck {truck_id}: {e}")
+                    self.pending_positions.setdefault(truck_id, (lat, lng))
+        if self.dispatcher is not None:
+            # Trucks freed by confirm_pickup; failures stay queued for the next flush
+            sent += self.dispatcher.flush_statuses()
+        return sent
+
+    def fetch_bins(self):
+        """Load the bin list from /waste-bins/ for PickupGeofences.apply_bins, None on failure"""
+        try:
+            response = requests.get(f"{self.api_base_url}/waste-bins/", headers=self.get_auth_headers(), timeout=60)
+        except Exception as e:
+            logger.error(f"Geofence refresh failed: {e}")
+            return None
+        if response.status_code != 200:
+            logger.error(f"Geofence refresh failed: {response.status_code}, {response.text}")
+            return None
+        data = response.json()
+        items = data.get('results', []) if isinstance(data, dict) else data
+        bins = []
+        for item in items:
+            try:
+                bins.append(BinDetails.from_dict(item))
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Skipping invalid bin record: {e}")
+        return bins
+
+    async def start(self, host: str = GPS_HOST, port: int = GPS_UDP_PORT):
+        if not GPS_TOKEN and not is_local_host(host):
+            logger.error(f"GPS listener not started: {host} is not a local address and GPS_TOKEN is not set")
+            return
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: GPSDatagramProtocol(self),
+            local_addr=(host, port)
+        )
+        logger.info(f"GPS listener started (UDP {host}:{port})")
+
+    def stop(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    async def run(self):
+        """Flush positions, pickups and freed trucks every GPS_FLUSH_SECONDS"""
+        while True:
+            await asyncio.sleep(GPS_FLUSH_SECONDS)
+            try:
+                if self.has_pending():
+                    await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"GPS flush loop error: {e}")
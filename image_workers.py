@@ -0,0 +1,184 @@
+"""CPU-bound image work in a process pool, off the bot's event loop.
+
+Base64 encoding a full-resolution photo, hashing it, decoding or resizing
+it all hold the GIL, so doing them on the event loop thread (or in a
+to_thread worker) stalls every other update. ImageWorkers runs them in
+worker processes instead and exposes them as coroutines.
+
+Large images are not pickled: the caller copies them once into a
+multiprocessing shared memory block and the worker reads them in place.
+Large results (base64, resized JPEGs) come back the same way, in a block
+the worker creates and the caller unlinks after copying it out.
+Small inputs go through the pool as plain bytes.
+
+Workers are started from a forkserver, not forked from the bot: a fork would
+copy its log queue handler (with nothing draining the queue in the child)
+and any lock another thread held at that moment.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing import shared_memory
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; at most 4 so the pool does not crowd out the API and bot threads
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', min(4, os.cpu_count() or 1)))
+# Inputs and results smaller than this are pickled instead of going through shared memory
+IMAGE_SHM_MIN_BYTES = 64 * 1024
+# JPEG quality of resized images
+IMAGE_RESIZE_QUALITY = 85
+
+
+def _put(data):
+    """Copy data into a new shared memory block, returning ('shm', name, size)"""
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        block.buf[:len(data)] = data
+    finally:
+        block.close()
+    return 'shm', block.name, len(data)
+
+
+def _take(ref, unlink: bool):
+    """Bytes of a ('shm', name, size) or ('bytes', data) reference"""
+    if ref[0] == 'bytes':
+        return ref[1]
+    block = shared_memory.SharedMemory(name=ref[1])
+    try:
+        return bytes(block.buf[:ref[2]])
+    finally:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def _wrap(data):
+    return _put(data) if len(data) >= IMAGE_SHM_MIN_BYTES else ('bytes', bytes(data))
+
+
+def _with_input(ref, work):
+    """Run work on a memoryview of the input without copying it out of shared memory"""
+    if ref[0] == 'bytes':
+        return work(ref[1])
+    block = shared_memory.SharedMemory(name=ref[1])
+    try:
+        view = block.buf[:ref[2]]
+        try:
+            return work(view)
+        finally:
+            view.release()
+    finally:
+        block.close()
+
+
+def _encode_job(ref):
+    return _wrap(_with_input(ref, base64.b64encode))
+
+
+def _hash_job(ref):
+    return _with_input(ref, lambda data: hashlib.sha256(data).hexdigest())
+
+
+def _decode(data):
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        return {'width': image.width, 'height': image.height, 'format': image.format, 'mode': image.mode}
+
+
+def _decode_job(ref):
+    return _with_input(ref, _decode)
+
+
+def _resize(data, max_side: int, quality: int):
+    with Image.open(BytesIO(data)) as image:
+        if max(image.size) <= max_side and image.format == 'JPEG':
+            return bytes(data)
+        # Let the JPEG decoder downscale while decoding, then finish with a proper filter
+        image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        output = BytesIO()
+        image.save(output, format='JPEG', quality=quality)
+        return output.getvalue()
+
+
+def _resize_job(ref, max_side, quality):
+    return _wrap(_with_input(ref, lambda data: _resize(data, max_side, quality)))
+
+
+def _thumbnail_job(ref):
+    from cctv_scheduler import thumbnail
+    return _with_input(ref, lambda data: thumbnail(bytes(data)))
+
+
+class ImageWorkers:
+    """Awaitable decode, resize, hash and base64 encode, run in a process pool"""
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = max(1, workers)
+        self.pool = None
+
+    def _executor(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('forkserver'))
+        return self.pool
+
+    async def _run(self, job, data, *args):
+        ref = _wrap(data)
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._executor(), job, ref, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool and retry once
+                logger.error("Image worker pool broke, restarting it")
+                self.pool = None
+                return await loop.run_in_executor(self._executor(), job, ref, *args)
+        finally:
+            if ref[0] == 'shm':
+                block = shared_memory.SharedMemory(name=ref[1])
+                block.close()
+                block.unlink()
+
+    async def encode(self, data):
+        """Base64 of data, as bytes"""
+        return _take(await self._run(_encode_job, data), unlink=True)
+
+    async def hash(self, data):
+        """SHA-256 hex digest of data"""
+        return await self._run(_hash_job, data)
+
+    async def decode(self, data):
+        """Decode an image fully, returning its width, height, format and mode"""
+        self._require_pillow()
+        return await self._run(_decode_job, data)
+
+    async def resize(self, data, max_side: int, quality: int = IMAGE_RESIZE_QUALITY):
+        """JPEG of the image scaled to fit max_side; JPEGs that already fit are returned as is"""
+        self._require_pillow()
+        return _take(await self._run(_resize_job, data, max_side, quality), unlink=True)
+
+    async def thumbnail(self, data):
+        """Grayscale change-detection thumbnail (see cctv_scheduler.thumbnail)"""
+        return await self._run(_thumbnail_job, data)
+
+    def _require_pillow(self):
+        if Image is None:
+            raise RuntimeError("Image decoding needs the Pillow package (pip install pillow)")
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
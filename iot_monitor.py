@@ -1,16 +1,32 @@
 import logging
 import asyncio
 import time
+import json
+import os
 import requests
 from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 import re
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+import records
+import sensor_frames
+from log_setup import configure_logging
+from listener_auth import is_local_host, strip_datagram_token, token_matches
+from tracing import Tracer, trace_headers
+from perf_tools import PerfProfiler
+from device_registry import DeviceRegistry, REGISTRY_REFRESH_SECONDS
+from liveness_tracker import DeviceLivenessTracker
+from backlog import clear_journal, drain_pending_updates
+from tsdb import SensorHistoryStore
+from status_rollup import StatusRollup
+from analytics_aggregates import AnalyticsAggregates, ANALYTICS_DB_PATH
+from trend_compaction import downsample_series
+
+# Enable logging (background writer thread, see log_setup.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Monitor bot token (alohida token kerak)
@@ -22,6 +38,44 @@ API_BASE_URL = "https://deklorantapi.cdcgroup.uz/api"
 # Set this to your group ID (e.g., -1001234567890) or None to accept from any chat
 MONITORED_CHAT_ID = -1003670768026  # Replace with your group ID, for example: -1001234567890
 
+# Direct ingestion listener (new firmware can post here instead of Telegram)
+INGEST_ENABLED = True
+# Local only by default; a public interface is only bound when INGEST_TOKEN is set
+INGEST_HOST = os.getenv('INGEST_HOST', "127.0.0.1")
+INGEST_UDP_PORT = 9100
+INGEST_HTTP_PORT = 9101
+INGEST_HTTP_PATH = "/ingest"
+# Shared secret: the X-Ingest-Token header of HTTP requests, and the first line of UDP datagrams
+INGEST_TOKEN = os.getenv('INGEST_TOKEN') or None
+INGEST_MAX_BODY_BYTES = 64 * 1024
+# Aggregated analytics are served as JSON on GET requests to this path of the ingestion HTTP port
+ANALYTICS_HTTP_PATH = "/analytics"
+ANALYTICS_DEFAULT_RANGE_SECONDS = 7 * 86400
+# Chart data for one device from the local sensor history, LTTB-downsampled to a point budget
+HISTORY_HTTP_PATH = "/history"
+HISTORY_DEFAULT_POINTS = 500
+HISTORY_MAX_POINTS = 5000
+
+# Local-only port of the /perf hook (the waste bin bot uses perf_tools.PERF_HTTP_PORT)
+PERF_HTTP_PORT = 9105
+
+# Identical readings from the same device within this window are forwarded only once
+DEDUPE_WINDOW_SECONDS = 60
+
+# Local compressed sensor history (set to None to disable)
+SENSOR_HISTORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sensor_history")
+
+# Timeout of each request forwarding readings to the platform
+FORWARD_TIMEOUT_SECONDS = 15
+
+# Readings recovered from the Telegram backlog are forwarded in batches of this size
+BACKLOG_FORWARD_BATCH_SIZE = 200
+# Drained backlog updates are kept here until they have been forwarded
+BACKLOG_JOURNAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backlog_iot_monitor.jsonl")
+
+# Gateway messages carry one block per device, each starting with 🆔 or "Qurilma:"
+READING_BLOCK_SPLIT = re.compile(r'(?=🆔)|(?=Qurilma:)')
+
 class IoTMonitorBot:
     def __init__(self):
         self.bot_token = MONITOR_BOT_TOKEN
@@ -31,6 +85,28 @@ class IoTMonitorBot:
             'login': 'superadmin',
             'password': '123'
         }
+        # Last forwarded reading per device, used to drop duplicates that
+        # arrive through more than one path (Telegram and direct ingestion)
+        self.recent_readings = {}
+        # Known devices from /iot-devices/, readings from unknown IDs are dropped
+        self.registry = DeviceRegistry(self.api_base_url, self.get_auth_headers)
+        # Expected check-in of every device, offline/online changes are pushed in batches
+        self.liveness = DeviceLivenessTracker(
+            self.api_base_url,
+            self.get_auth_headers,
+            resolve_device_pk=lambda device_id: (self.registry.get(device_id) or {}).get('id')
+        )
+        self.metrics = Counter()
+        # Compressed per-device history for local range and trend queries
+        self.history = SensorHistoryStore(SENSOR_HISTORY_DIR) if SENSOR_HISTORY_DIR else None
+        # Room -> boiler -> facility statuses, recomputed along one path per reading
+        self.rollup = StatusRollup(self.api_base_url, self.get_auth_headers)
+        # Per-facility hourly sensor aggregates, persisted locally for analytics queries
+        self.analytics = AnalyticsAggregates(ANALYTICS_DB_PATH)
+        # Stage timings of every handled channel message (see tracing.py)
+        self.tracer = Tracer('iot-monitor')
+        # /perf command, also served on 127.0.0.1:PERF_HTTP_PORT
+        self.profiler = PerfProfiler('iot-monitor')
     
     def login_to_api(self):
         """Login to API and get authentication token"""
@@ -60,7 +136,8 @@ class IoTMonitorBot:
         
         return {
             'Authorization': f'Token {self.api_token}',
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            **trace_headers()
         }
     
     def extract_sensor_data(self, message_text: str):
@@ -132,6 +209,307 @@ class IoTMonitorBot:
             }
         return None
 
+    def extract_sensor_readings(self, message_text: str):
+        """Extract every reading from a message.
+        Handles base64 sensor frames (#SF ...), gateway messages with several
+        🆔 / Qurilma: blocks, and plain single-reading messages.
+        """
+        if sensor_frames.TEXT_FRAME_PREFIX in message_text:
+            readings = sensor_frames.decode_text_frames(message_text)
+            if readings:
+                return readings
+        
+        blocks = [block for block in READING_BLOCK_SPLIT.split(message_text) if block.strip()]
+        if len(blocks) > 1:
+            readings = [self.extract_sensor_data(block) for block in blocks]
+            return [reading for reading in readings if reading]
+        
+        sensor_data = self.extract_sensor_data(message_text)
+        return [sensor_data] if sensor_data else []
+
+    def normalize_sensor_payload(self, payload: dict):
+        """Convert a JSON reading from direct ingestion to the extract_sensor_data format.
+        Both full and compact keys are accepted, timestamp is optional:
+            {"device_id": "0420101", "temperature": 21.7, "humidity": 43.9, "sleep_seconds": 2000}
+            {"id": "0420101", "t": 21.7, "h": 43.9, "s": 2000, "ts": 1734680400}
+        """
+        if not isinstance(payload, dict):
+            return None
+        try:
+            device_id = payload.get('device_id', payload.get('id'))
+            temperature = payload.get('temperature', payload.get('t'))
+            humidity = payload.get('humidity', payload.get('h'))
+            sleep_seconds = payload.get('sleep_seconds', payload.get('s'))
+            timestamp = payload.get('timestamp', payload.get('ts'))
+            sensor_data = {
+                'device_id': str(device_id).strip() if device_id is not None else None,
+                'temperature': float(temperature) if temperature is not None else None,
+                'humidity': float(humidity) if humidity is not None else None,
+                'sleep_seconds': int(sleep_seconds) if sleep_seconds is not None else None
+            }
+            if timestamp is not None:
+                sensor_data['timestamp'] = int(timestamp)
+        except (TypeError, ValueError):
+            return None
+        
+        if sensor_data['device_id'] and (sensor_data['temperature'] is not None or sensor_data['humidity'] is not None):
+            return sensor_data
+        return None
+
+    def decode_ingest_payload(self, payload: bytes):
+        """Decode a UDP datagram or HTTP body into a list of sensor readings.
+        Accepted payloads: binary frames (see sensor_frames), base64 text frames,
+        and JSON holding one reading, a list of readings, or a gateway batch
+        such as {"gateway": "GW-1", "readings": [...]}.
+        """
+        if sensor_frames.is_frame(payload):
+            return sensor_frames.decode_frame(payload)
+        payload = payload.strip()
+        if not payload:
+            return []
+        if payload[:1] in (b'{', b'['):
+            try:
+                decoded = json.loads(payload)
+            except (ValueError, UnicodeDecodeError):
+                return []
+            if isinstance(decoded, dict) and isinstance(decoded.get('readings'), list):
+                decoded = decoded['readings']
+            items = decoded if isinstance(decoded, list) else [decoded]
+            readings = [self.normalize_sensor_payload(item) for item in items]
+            return [reading for reading in readings if reading]
+        return sensor_frames.decode_text_frames(payload.decode('ascii', errors='ignore'))
+
+    def is_duplicate_reading(self, sensor_data: dict):
+        """Check whether the same reading was already forwarded within DEDUPE_WINDOW_SECONDS"""
+        now = time.time()
+        fingerprint = (
+            sensor_data.get('temperature'),
+            sensor_data.get('humidity'),
+            sensor_data.get('sleep_seconds'),
+            sensor_data.get('timestamp')
+        )
+        previous = self.recent_readings.get(sensor_data['device_id'])
+        if previous and previous[0] == fingerprint and now - previous[1] < DEDUPE_WINDOW_SECONDS:
+            return True
+        self.recent_readings[sensor_data['device_id']] = (fingerprint, now)
+        return False
+
+    def filter_valid_readings(self, readings: list, source: str = 'telegram'):
+        """Drop readings that fail SensorReading validation, before they reach history or statuses"""
+        valid = []
+        for reading in readings:
+            try:
+                records.SensorReading.from_dict(reading)
+            except (KeyError, TypeError, ValueError) as e:
+                self.metrics['invalid'] += 1
+                logger.warning(f"Ignored invalid reading ({source}): {e}")
+                continue
+            valid.append(reading)
+        return valid
+
+    async def filter_known_devices(self, readings: list, source: str = 'telegram'):
+        """Drop readings whose device ID is not registered on the platform"""
+        known = [reading for reading in readings if self.registry.is_known(reading['device_id'])]
+        if len(known) < len(readings) and self.registry.should_refresh_on_miss():
+            # The device may have been registered since the last refresh
+            await asyncio.to_thread(self.registry.refresh)
+            known = [reading for reading in readings if self.registry.is_known(reading['device_id'])]
+        
+        unknown = len(readings) - len(known)
+        if unknown:
+            self.metrics['unknown_device'] += unknown
+            unknown_ids = {reading['device_id'] for reading in readings} - {reading['device_id'] for reading in known}
+            logger.warning(f"Ignored {unknown} readings from unknown devices {sorted(unknown_ids)} ({source})")
+        return known
+
+    def track_liveness(self, readings: list):
+        """Record a check-in for every reading from a known device"""
+        for reading in readings:
+            self.liveness.record_check_in(reading['device_id'], reading.get('sleep_seconds'), reading.get('timestamp'))
+
+    def record_history(self, readings: list):
+        """Append forwarded readings to the local sensor history"""
+        if self.history is None:
+            return
+        for reading in readings:
+            reading.setdefault('timestamp', int(time.time()))
+        try:
+            self.history.append_readings(readings)
+        except Exception as e:
+            logger.error(f"Failed to record sensor history: {e}")
+
+    def update_status_rollup(self, readings: list):
+        """Roll fresh readings up into room, boiler and facility statuses and analytics"""
+        for reading in readings:
+            device = self.registry.get(reading['device_id'])
+            self.rollup.apply_reading(device, reading)
+            self.analytics.record_reading(self.rollup.facility_for_device(device), reading)
+
+    def query_analytics(self, query: str):
+        """Answer an analytics query string: metric, key, from, to (epoch seconds), bucket (seconds)"""
+        params = {name: values[0] for name, values in parse_qs(query).items()}
+        metric = params.get('metric')
+        if metric is None:
+            return {'metrics': {name: self.analytics.keys(name) for name in ('temperature', 'humidity', 'bin_fill')}}
+        end = float(params.get('to') or time.time())
+        start = float(params.get('from') or end - ANALYTICS_DEFAULT_RANGE_SECONDS)
+        bucket = int(params['bucket']) if params.get('bucket') else None
+        try:
+            buckets = self.analytics.query(metric, params.get('key'), start, end, bucket)
+        except KeyError:
+            raise ValueError(f"unknown metric {metric}")
+        return {'metric': metric, 'key': params.get('key'), 'buckets': buckets}
+
+    def query_history(self, query: str):
+        """Answer a chart query string: device_id, from, to (epoch seconds), points (budget per series)"""
+        params = {name: values[0] for name, values in parse_qs(query).items()}
+        if self.history is None:
+            raise ValueError("sensor history is disabled")
+        device_id = params.get('device_id')
+        if not device_id:
+            raise ValueError("device_id is required")
+        end = int(float(params.get('to') or time.time()))
+        start = int(float(params.get('from') or end - ANALYTICS_DEFAULT_RANGE_SECONDS))
+        budget = min(max(int(params.get('points') or HISTORY_DEFAULT_POINTS), 3), HISTORY_MAX_POINTS)
+        points = list(self.history.query(device_id, start, end))
+        return {
+            'device_id': device_id,
+            'total_points': len(points),
+            'temperature': downsample_series([(t, temperature) for t, temperature, _ in points], budget),
+            'humidity': downsample_series([(t, humidity) for t, _, humidity in points], budget),
+        }
+
+    async def refresh_facilities(self):
+        """Reload the facility graph used by the status roll-up"""
+        facilities = await asyncio.to_thread(self.rollup.fetch_facilities)
+        if facilities is not None:
+            self.rollup.load(facilities)
+
+    def seed_liveness_from_registry(self):
+        """Schedule expected check-ins for registered devices from their last_seen time"""
+        for device_id, device in self.registry.devices.items():
+            last_seen = device.get('last_sensor_update') or device.get('last_seen')
+            if not last_seen or device_id in self.liveness.states:
+                continue
+            try:
+                timestamp = datetime.fromisoformat(str(last_seen).replace('Z', '+00:00')).timestamp()
+            except ValueError:
+                continue
+            self.liveness.schedule(device_id, timestamp, device.get('sleep_seconds'))
+
+    async def refresh_registry_periodically(self):
+        """Keep the device registry fresh and log pipeline counters"""
+        while True:
+            try:
+                if self.registry.needs_refresh():
+                    await asyncio.to_thread(self.registry.refresh)
+                    await self.refresh_facilities()
+                logger.info(f"IoT pipeline metrics: {dict(self.metrics)}")
+                if self.history is not None:
+                    # Encode on the loop, which appends to the open chunks; only the write runs in a thread
+                    await asyncio.to_thread(self.history.write_checkpoint, self.history.snapshot_open_chunks())
+            except Exception as e:
+                logger.error(f"Registry refresh error: {e}")
+            await asyncio.sleep(REGISTRY_REFRESH_SECONDS)
+
+    async def process_sensor_data(self, sensor_data: dict, source: str = 'telegram'):
+        """Dedupe an extracted reading and forward it to the platform"""
+        self.metrics['received'] += 1
+        if not self.filter_valid_readings([sensor_data], source):
+            return None
+        with self.tracer.span('filter_known_devices'):
+            if not await self.filter_known_devices([sensor_data], source):
+                return None
+        self.track_liveness([sensor_data])
+        if self.is_duplicate_reading(sensor_data):
+            self.metrics['duplicate'] += 1
+            logger.info(f"Duplicate reading from device {sensor_data['device_id']} ignored ({source})")
+            return None
+        with self.tracer.span('record_history'):
+            self.record_history([sensor_data])
+        with self.tracer.span('status_rollup'):
+            self.update_status_rollup([sensor_data])
+        
+        logger.info(f"Sensor data extracted ({source}): {sensor_data}")
+        
+        # Send the data to the platform
+        with self.tracer.span('forward', device_id=sensor_data['device_id']):
+            result = await self.send_sensor_data_to_platform(sensor_data)
+        
+        if result:
+            self.metrics['forwarded'] += 1
+            logger.info(f"Sensor data successfully sent to platform: {result}")
+        else:
+            self.metrics['forward_failed'] += 1
+            logger.error("Failed to send sensor data to platform")
+        return result
+
+    async def process_sensor_batch(self, readings: list, source: str = 'telegram'):
+        """Dedupe a batch of readings and forward them over one HTTP session"""
+        self.metrics['received'] += len(readings)
+        readings = self.filter_valid_readings(readings, source)
+        with self.tracer.span('filter_known_devices'):
+            readings = await self.filter_known_devices(readings, source)
+        self.track_liveness(readings)
+        fresh = [reading for reading in readings if not self.is_duplicate_reading(reading)]
+        if len(fresh) < len(readings):
+            self.metrics['duplicate'] += len(readings) - len(fresh)
+            logger.info(f"{len(readings) - len(fresh)} duplicate readings ignored ({source})")
+        if not fresh:
+            return []
+        with self.tracer.span('record_history'):
+            self.record_history(fresh)
+        with self.tracer.span('status_rollup'):
+            self.update_status_rollup(fresh)
+        
+        logger.info(f"Forwarding batch of {len(fresh)} readings ({source})")
+        with self.tracer.span('forward', readings=len(fresh)):
+            results = await self.send_sensor_batch_to_platform(fresh)
+        failed = sum(1 for result in results if not result)
+        self.metrics['forwarded'] += len(fresh) - failed
+        self.metrics['forward_failed'] += failed
+        if failed:
+            logger.error(f"Failed to send {failed} of {len(fresh)} readings to platform")
+        return results
+
+    def build_sensor_payload(self, sensor_data: dict):
+        """Validate a reading and encode the /iot-devices/data/update/ request body"""
+        reading = records.SensorReading.from_dict(sensor_data)
+        if reading.timestamp is None:
+            reading.timestamp = int(time.time())
+        return reading.encode()
+
+    async def send_sensor_batch_to_platform(self, readings: list):
+        """Send many readings to the platform from a worker thread, so the event loop keeps running"""
+        return await asyncio.to_thread(self.post_sensor_batch, readings)
+
+    def post_sensor_batch(self, readings: list):
+        """Send many readings to the platform, reusing one keep-alive connection"""
+        headers = self.get_auth_headers()
+        if not headers:
+            logger.error("Failed to get authentication headers")
+            return [None] * len(readings)
+        
+        results = []
+        with requests.Session() as session:
+            session.headers.update(headers)
+            for sensor_data in readings:
+                try:
+                    response = session.post(
+                        f"{self.api_base_url}/iot-devices/data/update/",
+                        data=self.build_sensor_payload(sensor_data),
+                        timeout=FORWARD_TIMEOUT_SECONDS
+                    )
+                    if response.status_code == 200:
+                        results.append(records.loads(response.content))
+                    else:
+                        logger.error(f"Error sending sensor data for {sensor_data['device_id']}: {response.status_code}, {response.text}")
+                        results.append(None)
+                except Exception as e:
+                    logger.error(f"Exception sending sensor data for {sensor_data['device_id']}: {e}")
+                    results.append(None)
+        return results
+
     async def send_sensor_data_to_platform(self, sensor_data: dict):
         """Send sensor data to the platform using the IoT device data endpoint"""
         try:
@@ -141,25 +519,18 @@ class IoTMonitorBot:
                 logger.error("Failed to get authentication headers")
                 return None
             
-            # Prepare the data to send
-            data_to_send = {
-                'device_id': sensor_data['device_id'],
-                'temperature': sensor_data.get('temperature'),
-                'humidity': sensor_data.get('humidity'),
-                'sleep_seconds': sensor_data.get('sleep_seconds'),
-                'timestamp': int(time.time())
-            }
-            
             # Send data to the IoT device data endpoint
-            response = requests.post(
+            response = await asyncio.to_thread(
+                requests.post,
                 f"{self.api_base_url}/iot-devices/data/update/",
-                json=data_to_send,
-                headers=headers
+                data=self.build_sensor_payload(sensor_data),
+                headers=headers,
+                timeout=FORWARD_TIMEOUT_SECONDS
             )
             
             if response.status_code == 200:
                 logger.info(f"Successfully sent sensor data for device {sensor_data['device_id']} to platform")
-                return response.json()
+                return records.loads(response.content)
             else:
                 logger.error(f"Error sending sensor data: {response.status_code}, {response.text}")
                 return None
@@ -167,54 +538,239 @@ class IoTMonitorBot:
             logger.error(f"Exception sending sensor data: {e}")
             return None
 
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle messages from the monitored channel"""
-        if not update.message or not update.message.text:
-            return
+    def readings_from_message(self, message):
+        """Extract readings from a Telegram message of the monitored chat.
+        Readings without their own timestamp get the message's send time, so
+        delayed and backlog messages keep the time the device actually reported.
+        """
+        if not message or not message.text:
+            return []
         
-        chat = update.message.chat
+        chat = message.chat
         # If a specific chat ID is configured, only process messages from that chat
         if MONITORED_CHAT_ID is not None:
             if str(chat.id) != str(MONITORED_CHAT_ID):
-                return
-        
-        message_text = update.message.text
+                return []
         
-        # Extract sensor data (supports multiple formats)
-        sensor_data = self.extract_sensor_data(message_text)
+        # Extract sensor data (supports multiple formats and multi-reading messages)
+        readings = self.extract_sensor_readings(message.text)
         
-        if not sensor_data:
+        if message.date:
+            sent_at = int(message.date.timestamp())
+            for reading in readings:
+                reading.setdefault('timestamp', sent_at)
+        return readings
+
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle messages from the monitored channel"""
+        with self.tracer.trace('handle_message', update_id=update.update_id) as trace:
+            with self.tracer.span('parse'):
+                readings = self.readings_from_message(update.message)
+            trace.set(readings=len(readings))
+            
+            if not readings:
+                return
+            
+            if len(readings) == 1:
+                await self.process_sensor_data(readings[0], source='telegram')
+            else:
+                await self.process_sensor_batch(readings, source='telegram')
+
+    async def catch_up(self, updates: list):
+        """Forward readings from updates that queued up while the monitor was down.
+        Batches are posted from a worker thread (see send_sensor_batch_to_platform)
+        and the loop yields between them, so live updates are handled meanwhile.
+        """
+        logger.info(f"Backlog catch-up: {len(updates)} updates")
+        forwarded = 0
+        readings = []
+        for index, update in enumerate(updates, 1):
+            readings.extend(self.readings_from_message(update.message))
+            while len(readings) >= BACKLOG_FORWARD_BATCH_SIZE or (readings and index == len(updates)):
+                batch, readings = readings[:BACKLOG_FORWARD_BATCH_SIZE], readings[BACKLOG_FORWARD_BATCH_SIZE:]
+                try:
+                    await self.process_sensor_batch(batch, source='backlog')
+                    forwarded += len(batch)
+                except Exception as e:
+                    logger.error(f"Backlog catch-up batch failed: {e}")
+                # Batches that were all duplicates never await; let live updates in regardless
+                await asyncio.sleep(0)
+        clear_journal(BACKLOG_JOURNAL)
+        logger.info(f"Backlog catch-up finished: {forwarded} readings")
+
+class UDPIngestProtocol(asyncio.DatagramProtocol):
+    """Receives sensor datagrams and hands them to the ingestion listener"""
+    def __init__(self, listener):
+        self.listener = listener
+
+    def datagram_received(self, data, addr):
+        payload = strip_datagram_token(data, INGEST_TOKEN)
+        if payload is None:
+            self.listener.iot_bot.metrics['udp_unauthorized'] += 1
             return
-        
-        logger.info(f"Sensor data extracted: {sensor_data}")
-        
-        # Send the data to the platform
-        result = await self.send_sensor_data_to_platform(sensor_data)
-        
-        if result:
-            logger.info(f"Sensor data successfully sent to platform: {result}")
+        self.listener.accept_payload(payload, source=f"udp:{addr[0]}")
+
+class IngestionListener:
+    """Local UDP and HTTP listener that feeds readings straight into IoTMonitorBot,
+    bypassing the Telegram group. Old devices keep posting to Telegram.
+    """
+    def __init__(self, iot_bot: IoTMonitorBot, host: str = INGEST_HOST,
+                 udp_port: int = INGEST_UDP_PORT, http_port: int = INGEST_HTTP_PORT):
+        self.iot_bot = iot_bot
+        self.host = host
+        self.udp_port = udp_port
+        self.http_port = http_port
+        self.udp_transport = None
+        self.http_server = None
+        self.tasks = set()
+
+    async def start(self):
+        """Open the UDP endpoint and the HTTP server on the running event loop"""
+        if not INGEST_TOKEN and not is_local_host(self.host):
+            logger.error(f"Ingestion listener not started: {self.host} is not a local address and INGEST_TOKEN is not set")
+            return
+        loop = asyncio.get_running_loop()
+        self.udp_transport, _ = await loop.create_datagram_endpoint(
+            lambda: UDPIngestProtocol(self),
+            local_addr=(self.host, self.udp_port)
+        )
+        self.http_server = await asyncio.start_server(self.handle_http, self.host, self.http_port)
+        logger.info(f"Ingestion listener started (UDP {self.host}:{self.udp_port}, HTTP {self.host}:{self.http_port}{INGEST_HTTP_PATH})")
+
+    async def stop(self):
+        """Close the listener sockets and wait for in-flight readings"""
+        if self.udp_transport:
+            self.udp_transport.close()
+            self.udp_transport = None
+        if self.http_server:
+            self.http_server.close()
+            await self.http_server.wait_closed()
+            self.http_server = None
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def accept_payload(self, payload: bytes, source: str):
+        """Decode a payload and schedule its readings on the shared pipeline"""
+        readings = self.iot_bot.decode_ingest_payload(payload)
+        if not readings:
+            logger.warning(f"Ignored undecodable ingestion payload from {source}")
+            return 0
+        if len(readings) == 1:
+            task = asyncio.create_task(self.iot_bot.process_sensor_data(readings[0], source=source))
         else:
-            logger.error("Failed to send sensor data to platform")
+            task = asyncio.create_task(self.iot_bot.process_sensor_batch(readings, source=source))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return len(readings)
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Minimal HTTP/1.1 handler for POST INGEST_HTTP_PATH"""
+        peer = writer.get_extra_info('peername')
+        status, body = 500, {'error': 'internal error'}
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            parts = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            
+            length = int(headers.get('content-length', 0) or 0)
+            target = urlparse(parts[1]) if len(parts) >= 2 else None
+            if INGEST_TOKEN and not token_matches(headers.get('x-ingest-token', ''), INGEST_TOKEN):
+                status, body = 401, {'error': 'invalid token'}
+            elif target is not None and parts[0] == 'GET' and target.path == ANALYTICS_HTTP_PATH:
+                status, body = 200, self.iot_bot.query_analytics(target.query)
+            elif target is not None and parts[0] == 'GET' and target.path == HISTORY_HTTP_PATH:
+                status, body = 200, self.iot_bot.query_history(target.query)
+            elif target is None or parts[0] != 'POST' or target.path != INGEST_HTTP_PATH:
+                status, body = 404, {'error': 'not found'}
+            elif length <= 0 or length > INGEST_MAX_BODY_BYTES:
+                status, body = 413 if length > 0 else 400, {'error': 'invalid body length'}
+            else:
+                payload = await asyncio.wait_for(reader.readexactly(length), timeout=10)
+                accepted = self.accept_payload(payload, source=f"http:{peer[0] if peer else 'unknown'}")
+                status, body = (202, {'accepted': accepted}) if accepted else (400, {'error': 'no valid readings'})
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+            status, body = 400, {'error': f'bad request: {e}'}
+        except Exception as e:
+            logger.error(f"Ingestion HTTP handler error: {e}")
+        
+        reasons = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+                   413: 'Payload Too Large', 500: 'Internal Server Error'}
+        content = json.dumps(body).encode('utf-8')
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + content
+            )
+            await writer.drain()
+        finally:
+            writer.close()
 
 def main():
     """Start the IoT monitoring bot"""
     try:
         # Create bot instance
         iot_bot = IoTMonitorBot()
+        listener = IngestionListener(iot_bot) if INGEST_ENABLED else None
+        
+        background_tasks = []
+        
+        async def post_init(application: Application):
+            iot_bot.profiler.track_tasks()
+            await iot_bot.profiler.start_http(port=PERF_HTTP_PORT)
+            # Load the known-device registry before the first reading arrives
+            await asyncio.to_thread(iot_bot.registry.refresh)
+            iot_bot.seed_liveness_from_registry()
+            await iot_bot.refresh_facilities()
+            background_tasks.append(asyncio.create_task(iot_bot.refresh_registry_periodically()))
+            background_tasks.append(asyncio.create_task(iot_bot.liveness.run()))
+            background_tasks.append(asyncio.create_task(iot_bot.rollup.run()))
+            background_tasks.append(asyncio.create_task(iot_bot.analytics.run()))
+            # Readings sent while the monitor was down are drained here and forwarded
+            # in the background, so live polling starts right away
+            backlog = await drain_pending_updates(application.bot, BACKLOG_JOURNAL)
+            if backlog:
+                background_tasks.append(asyncio.create_task(iot_bot.catch_up(backlog)))
+            if listener:
+                await listener.start()
+        
+        async def post_shutdown(application: Application):
+            for task in background_tasks:
+                task.cancel()
+            await iot_bot.profiler.stop_http()
+            if listener:
+                await listener.stop()
+            if iot_bot.history is not None:
+                iot_bot.history.close()
+            iot_bot.analytics.close()
         
         # Create application using builder pattern
-        application = Application.builder().token(MONITOR_BOT_TOKEN).build()
+        application = (
+            Application.builder()
+            .token(MONITOR_BOT_TOKEN)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
         
         # Add message handler for channel messages
+        application.add_handler(CommandHandler("perf", iot_bot.profiler.handle_command))
         application.add_handler(MessageHandler(filters.TEXT, iot_bot.handle_message))
         
         logger.info("IoT Monitor Bot is starting...")
         logger.info(f"Monitoring chat ID: {MONITORED_CHAT_ID}")
         
-        # Clear any pending updates first
+        # Pending updates were already drained in post_init for catch-up
         application.run_polling(
             allowed_updates=Update.ALL_TYPES, 
-            drop_pending_updates=True,
+            drop_pending_updates=False,
             close_loop=False
         )
     except Exception as e:
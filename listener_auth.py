@@ -0,0 +1,35 @@
+"""Shared-secret checks for the local UDP and HTTP listeners.
+
+Listeners bind to 127.0.0.1 by default. A listener on any other interface
+must be given a token: UDP datagrams then carry it on their first line,
+HTTP requests in a header.
+"""
+import hmac
+import ipaddress
+
+
+def is_local_host(host: str):
+    """Whether binding host only exposes the listener to this machine"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def token_matches(presented, token: str):
+    """Constant-time comparison of a presented token (str or bytes) with the expected one"""
+    if isinstance(presented, str):
+        presented = presented.encode('latin-1', errors='replace')
+    return hmac.compare_digest(presented.strip(), token.encode('utf-8'))
+
+
+def strip_datagram_token(data: bytes, token: str = None):
+    """Payload of a datagram, after checking and removing its token line.
+    Returns None when a token is required and the datagram does not carry it.
+    """
+    if not token:
+        return data
+    presented, _, payload = data.partition(b'\n')
+    return payload if token_matches(presented, token) else None
@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timezone
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Used when a device never reported its sleep interval
+DEFAULT_SLEEP_SECONDS = 1800
+# A device is overdue after sleep_seconds * factor + grace without a reading
+LIVENESS_GRACE_FACTOR = 1.5
+LIVENESS_GRACE_SECONDS = 120
+# How often overdue devices are collected and transitions pushed to the platform
+LIVENESS_TICK_SECONDS = 15
+
+
+class DeviceLivenessTracker:
+    """Tracks device check-ins and detects offline devices from their declared sleep interval.
+
+    Each device has one expected check-in deadline kept in a min-heap. A new
+    reading pushes a fresh heap entry and bumps the device's generation, so
+    older entries become stale and are skipped when popped (lazy deletion).
+    Finding overdue devices therefore costs O(log n) per event and never
+    scans the whole fleet.
+    """
+    def __init__(self, api_base_url: str, get_auth_headers, resolve_device_pk=None):
+        self.api_base_url = api_base_url
+        self.get_auth_headers = get_auth_headers
+        # Maps a hardware device_id to the platform primary key used in /iot-devices/<pk>/
+        self.resolve_device_pk = resolve_device_pk or (lambda device_id: device_id)
+        self.heap = []
+        # device_id -> {'deadline', 'generation', 'online', 'last_seen', 'sleep_seconds'}
+        self.states = {}
+        # device_id -> latest pending transition, flaps between flushes collapse into one
+        self.pending = {}
+        # Devices whose pending transition waits for the registry to know their primary key
+        self.unresolved = set()
+
+    def __len__(self):
+        return len(self.states)
+
+    def deadline_for(self, last_seen: float, sleep_seconds: int = None):
+        """Compute when a device that checked in at last_seen becomes overdue"""
+        sleep_seconds = sleep_seconds or DEFAULT_SLEEP_SECONDS
+        return last_seen + sleep_seconds * LIVENESS_GRACE_FACTOR + LIVENESS_GRACE_SECONDS
+
+    def schedule(self, device_id: str, last_seen: float, sleep_seconds: int = None, online=None):
+        """Set a device's next expected check-in without emitting a transition"""
+        state = self.states.get(device_id)
+        if state is None:
+            state = self.states[device_id] = {'generation': 0, 'online': online, 'sleep_seconds': None}
+        if sleep_seconds:
+            state['sleep_seconds'] = sleep_seconds
+        state['generation'] += 1
+        state['last_seen'] = last_seen
+        state['deadline'] = self.deadline_for(last_seen, state['sleep_seconds'])
+        heapq.heappush(self.heap, (state['deadline'], state['generation'], device_id))
+        return state
+
+    def record_check_in(self, device_id: str, sleep_seconds: int = None, timestamp: float = None):
+        """Register a reading from a device, marking it online if it was not"""
+        timestamp = timestamp or time.time()
+        state = self.states.get(device_id)
+        if state is not None and timestamp < state['last_seen']:
+            # Late (backlog) reading older than what we already know about
+            return
+        was_online = state['online'] if state else None
+        state = self.schedule(device_id, timestamp, sleep_seconds)
+        if was_online is not True:
+            state['online'] = True
+            self.queue_transition(device_id, True, timestamp)
+
+    def pop_overdue(self, now: float = None):
+        """Mark every device whose deadline passed as offline, returning their IDs"""
+        now = now or time.time()
+        overdue = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, generation, device_id = heapq.heappop(self.heap)
+            state = self.states.get(device_id)
+            if state is None or state['generation'] != generation:
+                continue
+            if state['online'] is not False:
+                state['online'] = False
+                self.queue_transition(device_id, False, state['last_seen'])
+                overdue.append(device_id)
+        return overdue
+
+    def next_deadline(self):
+        """Get the earliest live deadline, discarding stale heap entries"""
+        while self.heap:
+            deadline, generation, device_id = self.heap[0]
+            state = self.states.get(device_id)
+            if state is not None and state['generation'] == generation:
+                return deadline
+            heapq.heappop(self.heap)
+        return None
+
+    def queue_transition(self, device_id: str, online: bool, last_seen: float):
+        self.pending[device_id] = {'online': online, 'last_seen': last_seen}
+        logger.info(f"Device {device_id} is now {'online' if online else 'offline'}")
+
+    def flush(self):
+        """Push pending online/offline transitions to the platform in one batch"""
+        if not self.pending:
+            return 0
+        headers = self.get_auth_headers()
+        if not headers:
+            logger.error("Liveness flush skipped: no authentication headers")
+            return 0
+
+        pending, self.pending = self.pending, {}
+        sent = 0
+        with requests.Session() as session:
+            session.headers.update(headers)
+            for device_id, transition in pending.items():
+                device_pk = self.resolve_device_pk(device_id)
+                if not device_pk:
+                    # Keep it until the device shows up on the platform
+                    if device_id not in self.unresolved:
+                        self.unresolved.add(device_id)
+                        logger.warning(f"Liveness of {device_id} kept pending: device not registered on the platform")
+                    self.pending.setdefault(device_id, transition)
+                    continue
+                self.unresolved.discard(device_id)
+                last_ping = datetime.fromtimestamp(transition['last_seen'], tz=timezone.utc).isoformat()
+                try:
+                    response = session.patch(
+                        f"{self.api_base_url}/iot-devices/{device_pk}/",
+                        json={
+                            'last_seen': last_ping,
+                            'device_health': {
+                                'is_online': transition['online'],
+                                'last_ping': last_ping
+                            }
+                        },
+                        timeout=30
+                    )
+                    if response.status_code in [200, 204]:
+                        sent += 1
+                    else:
+                        logger.error(f"Error updating liveness of {device_id}: {response.status_code}, {response.text}")
+                except Exception as e:
+                    logger.error(f"Exception updating liveness of {device_id}: {e}")
+                    # Keep it for the next flush unless a newer transition replaced it
+                    self.pending.setdefault(device_id, transition)
+        if sent:
+            logger.info(f"Pushed {sent} device liveness transitions to platform")
+        return sent
+
+    async def run(self):
+        """Collect overdue devices and flush transitions every LIVENESS_TICK_SECONDS"""
+        while True:
+            try:
+                self.pop_overdue()
+                if self.pending:
+                    await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Liveness loop error: {e}")
+            await asyncio.sleep(LIVENESS_TICK_SECONDS)
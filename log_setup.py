@@ -0,0 +1,192 @@
+"""Logging for the bots: a background writer thread, optional JSON output,
+per-call-site sampling and log levels that can be changed at runtime.
+
+Log calls only build the record and put it on a queue; formatting and
+writing happen in a QueueListener thread, so the event loop never waits on
+log I/O. INFO and DEBUG records are sampled per call site (file and line):
+at most LOG_SAMPLE_LIMIT records every LOG_SAMPLE_WINDOW_SECONDS get
+through, and the next record that does carries the number suppressed in
+between. Warnings and errors are never sampled.
+
+Environment:
+    LOG_LEVEL     root level, INFO by default
+    LOG_FORMAT    'json' for one JSON object per line, plain text otherwise
+    LOG_LEVELS    path of a JSON file {"logger name": "LEVEL", ...}; it is
+                  applied at start and re-read on SIGHUP
+"""
+import atexit
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+import records
+
+LOG_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Records let through per call site and window
+LOG_SAMPLE_LIMIT = 20
+LOG_SAMPLE_WINDOW_SECONDS = 10
+# Records waiting for the writer thread; beyond this new INFO/DEBUG records are dropped
+LOG_QUEUE_SIZE = 10000
+LOG_LEVELS_PATH = os.getenv('LOG_LEVELS')
+
+_listener = None
+
+
+class CallSiteSampler(logging.Filter):
+    """Lets at most `limit` INFO/DEBUG records per call site through every `window` seconds"""
+    def __init__(self, limit: int = LOG_SAMPLE_LIMIT, window: float = LOG_SAMPLE_WINDOW_SECONDS):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        # (pathname, lineno) -> [window start, passed, suppressed]
+        self.sites = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.limit <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                suppressed = site[2] if site else 0
+                self.sites[key] = [now, 1, 0]
+            elif site[1] < self.limit:
+                site[1] += 1
+                suppressed, site[2] = site[2], 0
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops INFO/DEBUG records instead of waiting when the queue is full"""
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Resolve the message and traceback, which cannot cross threads safely, but leave
+        formatting to the writer thread"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f"{message} (+{suppressed} similar suppressed)" if suppressed else message
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record"""
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'site': f"{record.module}:{record.lineno}",
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return records.dumps(entry).decode('utf-8')
+
+
+def set_level(level, name: str = ''):
+    """Change the level of a logger ('' for the root) while running"""
+    logging.getLogger(name or None).setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def current_levels():
+    """Levels explicitly set on the root and named loggers"""
+    levels = {'': logging.getLevelName(logging.getLogger().level)}
+    for name, logger in list(logging.Logger.manager.loggerDict.items()):
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+    return levels
+
+
+def load_levels(path: str = None):
+    """Apply {"logger name": "LEVEL"} from a JSON file, returning the number applied"""
+    path = path or LOG_LEVELS_PATH
+    if not path:
+        return 0
+    try:
+        with open(path, 'rb') as f:
+            levels = records.loads(f.read())
+        for name, level in levels.items():
+            set_level(level, name)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Could not load log levels from {path}: {e}")
+        return 0
+    return len(levels)
+
+
+def configure_logging(level: str = None, json_output: bool = None, sample_limit: int = LOG_SAMPLE_LIMIT):
+    """Route all logging through a queue to a background writer thread; safe to call more than once"""
+    global _listener
+    level = level or os.getenv('LOG_LEVEL', 'INFO')
+    if json_output is None:
+        json_output = os.getenv('LOG_FORMAT', '').lower() == 'json'
+
+    root = logging.getLogger()
+    if _listener is not None:
+        _listener.stop()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(JSONFormatter() if json_output else TextFormatter(LOG_TEXT_FORMAT))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(CallSiteSampler(sample_limit))
+    root.addHandler(handler)
+    set_level(level)
+    load_levels()
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, lambda signum, frame: load_levels())
+    return handler
+
+
+def stop_logging():
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,368 @@
+"""Precomputed map layers: zoom-level clusters and gridded heatmaps served per tile.
+
+Every layer keeps, for each zoom level from MIN_ZOOM to MAX_ZOOM, a grid of
+cells in Web Mercator pixel space with running aggregates (count, centroid,
+value sum, per-category counts). Adding, moving or removing an entity
+touches one cell per zoom level, so updates are O(zoom levels) and never
+rebuild a layer. A tile holds at most (256 / cell pixels)^2 cells, so
+its payload has a fixed upper bound however many entities are on the map.
+
+Layers:
+    bins, trucks       clusters, CLUSTER_CELL_PIXELS cells (16 per tile)
+    moisture, air      heatmaps, HEAT_CELL_PIXELS cells (64 per tile)
+
+Tiles are served as JSON on GET /tiles/<layer>/<z>/<x>/<y> with an ETag;
+a client that sends it back in If-None-Match gets 304 while the tile is
+unchanged. GET /layers lists the layers and zoom range.
+
+The server only listens on localhost unless MAP_TOKEN is set; with a token
+every request must carry it in an X-Map-Token header or a ?token= parameter.
+
+Usage:
+    python map_layers.py
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+from collections import Counter
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from api_login import ToolLogin
+from listener_auth import is_local_host, token_matches
+from records import BinDetails, Truck
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://deklorantapi.cdcgroup.uz/api"
+
+# Local only by default; a public interface is only bound when MAP_TOKEN is set
+MAP_HOST = os.getenv('MAP_HOST', "127.0.0.1")
+# Shared secret expected on every request, if set
+MAP_TOKEN = os.getenv('MAP_TOKEN') or None
+MAP_HTTP_PORT = 9103
+# How often entity lists are reloaded and diffed into the layers
+MAP_REFRESH_SECONDS = 60
+
+TILE_SIZE = 256
+MIN_ZOOM = 10
+MAX_ZOOM = 18
+CLUSTER_CELL_PIXELS = 64
+HEAT_CELL_PIXELS = 32
+# Encoded tiles kept in memory; the cache is dropped when it grows past this
+MAX_CACHED_TILES = 50000
+MAX_LATITUDE = 85.05112878
+
+
+def project(lat: float, lng: float, zoom: int):
+    """Web Mercator global pixel coordinates of a point at a zoom level"""
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    scale = TILE_SIZE * (1 << zoom)
+    x = (lng + 180.0) / 360.0 * scale
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def _point(value):
+    if isinstance(value, dict) and value.get('lat') is not None and value.get('lng') is not None:
+        return float(value['lat']), float(value['lng'])
+    return None
+
+
+class GridLayer:
+    """Per-zoom cell aggregates of one entity layer"""
+    def __init__(self, cell_pixels: int):
+        self.cell_pixels = cell_pixels
+        # entity id -> (lat, lng, value, category, cells) where cells[i] is the cell at MIN_ZOOM + i
+        self.entities = {}
+        # per zoom: (col, row) -> [count, sum_lat, sum_lng, sum_value, value_count, Counter(categories), ids]
+        self.cells = [{} for _ in range(MIN_ZOOM, MAX_ZOOM + 1)]
+        # (zoom, tile_x, tile_y) -> version, bumped on every change inside the tile
+        self.tile_versions = {}
+
+    def __len__(self):
+        return len(self.entities)
+
+    def cells_for(self, lat: float, lng: float):
+        # Pixel coordinates halve with every zoom level down, so project once
+        x, y = project(lat, lng, MAX_ZOOM)
+        return tuple(
+            (int(x // (self.cell_pixels << shift)), int(y // (self.cell_pixels << shift)))
+            for shift in range(MAX_ZOOM - MIN_ZOOM, -1, -1)
+        )
+
+    def touch(self, level: int, cell):
+        per_tile = TILE_SIZE // self.cell_pixels
+        key = (MIN_ZOOM + level, cell[0] // per_tile, cell[1] // per_tile)
+        self.tile_versions[key] = self.tile_versions.get(key, 0) + 1
+
+    def apply(self, entity_id, lat: float, lng: float, value, category, cells, sign: int):
+        for level, cell in enumerate(cells):
+            aggregate = self.cells[level].get(cell)
+            if aggregate is None:
+                aggregate = self.cells[level][cell] = [0, 0.0, 0.0, 0.0, 0, Counter(), set()]
+            aggregate[0] += sign
+            aggregate[1] += sign * lat
+            aggregate[2] += sign * lng
+            if value is not None:
+                aggregate[3] += sign * value
+                aggregate[4] += sign
+            if category is not None:
+                aggregate[5][category] += sign
+                if aggregate[5][category] <= 0:
+                    del aggregate[5][category]
+            if sign > 0:
+                aggregate[6].add(entity_id)
+            else:
+                aggregate[6].discard(entity_id)
+            if aggregate[0] <= 0:
+                del self.cells[level][cell]
+            self.touch(level, cell)
+
+    def upsert(self, entity_id, lat: float, lng: float, value=None, category=None):
+        """Add or update an entity, returning False when nothing changed"""
+        value = float(value) if value is not None else None
+        previous = self.entities.get(entity_id)
+        if previous is not None and previous[:4] == (lat, lng, value, category):
+            return False
+        if previous is not None:
+            self.apply(entity_id, *previous[:4], previous[4], -1)
+        cells = previous[4] if previous is not None and previous[:2] == (lat, lng) else self.cells_for(lat, lng)
+        self.entities[entity_id] = (lat, lng, value, category, cells)
+        self.apply(entity_id, lat, lng, value, category, cells, 1)
+        return True
+
+    def remove(self, entity_id):
+        previous = self.entities.pop(entity_id, None)
+        if previous is not None:
+            self.apply(entity_id, *previous[:4], previous[4], -1)
+
+    def sync(self, items: dict):
+        """Make the layer hold exactly items {id: (lat, lng, value, category)}, returning changes"""
+        changed = 0
+        for entity_id in list(self.entities):
+            if entity_id not in items:
+                self.remove(entity_id)
+                changed += 1
+        for entity_id, (lat, lng, value, category) in items.items():
+            changed += self.upsert(entity_id, lat, lng, value, category)
+        return changed
+
+    def tile_cells(self, zoom: int, tile_x: int, tile_y: int):
+        """Aggregates of the cells inside a tile as ((col, row) within the tile, aggregate)"""
+        if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+            return []
+        per_tile = TILE_SIZE // self.cell_pixels
+        level = self.cells[zoom - MIN_ZOOM]
+        found = []
+        for row in range(per_tile):
+            for col in range(per_tile):
+                aggregate = level.get((tile_x * per_tile + col, tile_y * per_tile + row))
+                if aggregate is not None:
+                    found.append(((col, row), aggregate))
+        return found
+
+    def cluster_tile(self, zoom: int, tile_x: int, tile_y: int):
+        """Clusters as [lat, lng, count, {category: count}, id of a single entity or None]"""
+        clusters = []
+        for _, (count, sum_lat, sum_lng, _, _, categories, ids) in self.tile_cells(zoom, tile_x, tile_y):
+            clusters.append([
+                round(sum_lat / count, 6),
+                round(sum_lng / count, 6),
+                count,
+                dict(categories),
+                next(iter(ids)) if count == 1 else None,
+            ])
+        return clusters
+
+    def heat_tile(self, zoom: int, tile_x: int, tile_y: int):
+        """Heat cells as [col, row, mean value, count], col/row within the tile"""
+        cells = []
+        for (col, row), (count, _, _, sum_value, value_count, _, _) in self.tile_cells(zoom, tile_x, tile_y):
+            if value_count:
+                cells.append([col, row, round(sum_value / value_count, 2), value_count])
+        return cells
+
+
+class MapLayerService:
+    """Keeps map layers in sync with the platform and serves compact tiles"""
+    def __init__(self, api_base_url: str, get_auth_headers, relogin=None):
+        self.api_base_url = api_base_url
+        self.get_auth_headers = get_auth_headers
+        # Called when the platform rejects the token, before retrying once
+        self.relogin = relogin
+        self.layers = {
+            'bins': GridLayer(CLUSTER_CELL_PIXELS),
+            'trucks': GridLayer(CLUSTER_CELL_PIXELS),
+            'moisture': GridLayer(HEAT_CELL_PIXELS),
+            'air': GridLayer(HEAT_CELL_PIXELS),
+        }
+        self.heat_layers = {'moisture', 'air'}
+        # (layer, z, x, y) -> (version, encoded payload)
+        self.tile_cache = {}
+        self.server = None
+
+    def fetch(self, endpoint: str):
+        response = requests.get(f"{self.api_base_url}/{endpoint}/", headers=self.get_auth_headers(), timeout=60)
+        if response.status_code == 401 and self.relogin is not None:
+            logger.info("Map layer token rejected, logging in again")
+            self.relogin()
+            response = requests.get(f"{self.api_base_url}/{endpoint}/", headers=self.get_auth_headers(), timeout=60)
+        response.raise_for_status()
+        data = response.json()
+        return data.get('results', []) if isinstance(data, dict) else data
+
+    def load_entities(self):
+        """Fetch every layer's entities as {layer: {id: (lat, lng, value, category)}}"""
+        entities = {}
+        items = {}
+        for raw in self.fetch('waste-bins'):
+            waste_bin = BinDetails.from_dict(raw)
+            if waste_bin.location:
+                items[waste_bin.id] = (*waste_bin.location, waste_bin.fill_level, 'full' if waste_bin.is_full else 'ok')
+        entities['bins'] = items
+        items = {}
+        for raw in self.fetch('trucks'):
+            truck = Truck.from_dict(raw)
+            if truck.location:
+                items[truck.id] = (*truck.location, truck.fuel_level, truck.status)
+        entities['trucks'] = items
+        for layer, endpoint, value_keys in (
+            ('moisture', 'moisture-sensors', ('moisture_level', 'moistureLevel')),
+            ('air', 'air-sensors', ('aqi',)),
+        ):
+            items = {}
+            for raw in self.fetch(endpoint):
+                point = _point(raw.get('location'))
+                if point is None:
+                    continue
+                value = next((raw[key] for key in value_keys if raw.get(key) is not None), None)
+                items[str(raw['id'])] = (*point, value, raw.get('status'))
+            entities[layer] = items
+        return entities
+
+    def apply_entities(self, entities: dict):
+        changed = {name: self.layers[name].sync(items) for name, items in entities.items()}
+        if any(changed.values()):
+            logger.info(f"Map layers updated: {changed}")
+        return changed
+
+    def tile(self, layer: str, zoom: int, tile_x: int, tile_y: int):
+        """Encoded tile payload and its ETag"""
+        grid = self.layers[layer]
+        version = grid.tile_versions.get((zoom, tile_x, tile_y), 0)
+        key = (layer, zoom, tile_x, tile_y)
+        cached = self.tile_cache.get(key)
+        if cached is None or cached[0] != version:
+            if len(self.tile_cache) >= MAX_CACHED_TILES:
+                self.tile_cache.clear()
+            if layer in self.heat_layers:
+                data = {'cell_pixels': grid.cell_pixels, 'cells': grid.heat_tile(zoom, tile_x, tile_y)}
+            else:
+                data = {'clusters': grid.cluster_tile(zoom, tile_x, tile_y)}
+            cached = self.tile_cache[key] = (version, json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        return cached[1], f'"{layer}-{zoom}-{tile_x}-{tile_y}-{version}"'
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Minimal HTTP/1.1 handler for GET /tiles/<layer>/<z>/<x>/<y> and GET /layers"""
+        status, content, etag = 500, b'{"error":"internal error"}', None
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            parts = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            target = urlparse(parts[1]) if len(parts) >= 2 else None
+            path = target.path.strip('/').split('/') if target is not None else []
+            if MAP_TOKEN and not token_matches(
+                    headers.get('x-map-token') or parse_qs(target.query if target else '').get('token', [''])[0],
+                    MAP_TOKEN):
+                status, content = 401, b'{"error":"invalid token"}'
+            elif target is None or parts[0] != 'GET':
+                status, content = 404, b'{"error":"not found"}'
+            elif path == ['layers']:
+                status = 200
+                content = json.dumps({
+                    'layers': {name: len(grid) for name, grid in self.layers.items()},
+                    'min_zoom': MIN_ZOOM,
+                    'max_zoom': MAX_ZOOM,
+                }).encode('utf-8')
+            elif len(path) == 5 and path[0] == 'tiles' and path[1] in self.layers:
+                zoom, tile_x, tile_y = int(path[2]), int(path[3]), int(path[4].removesuffix('.json'))
+                content, etag = self.tile(path[1], zoom, tile_x, tile_y)
+                status = 304 if headers.get('if-none-match') == etag else 200
+            else:
+                status, content = 404, b'{"error":"not found"}'
+        except (asyncio.TimeoutError, ValueError) as e:
+            status, content = 400, json.dumps({'error': f'bad request: {e}'}).encode('utf-8')
+        except Exception as e:
+            logger.error(f"Map layer HTTP handler error: {e}")
+
+        reasons = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+                   500: 'Internal Server Error'}
+        if status == 304:
+            content = b''
+        head = (
+            f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(content)}\r\n"
+            f"Access-Control-Allow-Origin: *\r\n"
+            + (f"ETag: {etag}\r\n" if etag else "")
+            + "Connection: close\r\n\r\n"
+        )
+        try:
+            writer.write(head.encode('latin-1') + content)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host: str = MAP_HOST, port: int = MAP_HTTP_PORT):
+        if not MAP_TOKEN and not is_local_host(host):
+            raise RuntimeError(f"Refusing to serve map layers on {host} without MAP_TOKEN")
+        self.server = await asyncio.start_server(self.handle_http, host, port)
+        logger.info(f"Map layer server started (HTTP {host}:{port})")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def run(self):
+        """Reload entity lists and diff them into the layers every MAP_REFRESH_SECONDS"""
+        while True:
+            try:
+                entities = await asyncio.to_thread(self.load_entities)
+                self.apply_entities(entities)
+            except Exception as e:
+                logger.error(f"Map layer refresh failed: {e}")
+            await asyncio.sleep(MAP_REFRESH_SECONDS)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    login = ToolLogin(API_BASE_URL)
+    login.headers()
+    service = MapLayerService(API_BASE_URL, login.headers, login.invalidate)
+
+    async def serve():
+        await service.start()
+        try:
+            await service.run()
+        finally:
+            await service.stop()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
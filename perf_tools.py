@@ -0,0 +1,315 @@
+"""On-demand profiling inside a running bot.
+
+A profiling run lasts a few seconds and collects, without restarting the
+process:
+
+  * a sampling profile: a thread reads every other thread's Python stack
+    every PERF_SAMPLE_INTERVAL_SECONDS; samples parked in an idle wait
+    (selector, lock, queue) are counted as idle rather than busy
+  * a tracemalloc snapshot diff between the start and the end of the run
+  * a dump of the event loop's asyncio tasks, oldest first
+
+A compact summary is returned; the full artefacts (collapsed stacks for
+flame graph tools, the allocation diff, every task's stack) are written to
+PERF_ARTIFACTS_DIR/<timestamp>/.
+
+It is started with the admin-only /perf [seconds] bot command, or with
+GET /perf?seconds=N on the local HTTP hook.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+PERF_ARTIFACTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perf_artifacts")
+# Telegram user ids allowed to run /perf, comma separated
+PERF_ADMIN_IDS = {int(user_id) for user_id in os.getenv('PERF_ADMIN_IDS', '').split(',') if user_id.strip()}
+PERF_DEFAULT_SECONDS = 10
+PERF_MAX_SECONDS = 60
+PERF_SAMPLE_INTERVAL_SECONDS = 0.005
+# Stack frames kept per tracemalloc allocation site
+PERF_TRACEMALLOC_FRAMES = 5
+# Entries in each section of the summary
+PERF_SUMMARY_ROWS = 8
+# Local HTTP hook of the waste bin bot; the IoT monitor serves /perf on its ingestion port
+PERF_HTTP_HOST = "127.0.0.1"
+PERF_HTTP_PORT = 9104
+PERF_HTTP_PATH = "/perf"
+
+# (file name, function) of Python frames where a thread is waiting, not working
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+}
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def _function_key(frame):
+    code = frame.f_code
+    return f"{code.co_qualname if hasattr(code, 'co_qualname') else code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+class StackSampler(threading.Thread):
+    """Samples the Python stacks of all other threads at a fixed interval"""
+    def __init__(self, interval: float = PERF_SAMPLE_INTERVAL_SECONDS):
+        super().__init__(name='perf-sampler', daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        # Collapsed stack "thread;outer;...;leaf" -> samples
+        self.stacks = Counter()
+        # Function -> samples where it was the leaf / anywhere on the stack
+        self.own = Counter()
+        self.total = Counter()
+        self.samples = 0
+        self.idle = 0
+
+    def run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self.stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.samples += 1
+                if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                    self.idle += 1
+                    continue
+                self.own[_function_key(frame)] += 1
+                stack = []
+                seen = set()
+                while frame is not None:
+                    stack.append(_frame_key(frame))
+                    function = _function_key(frame)
+                    if function not in seen:
+                        seen.add(function)
+                        self.total[function] += 1
+                    frame = frame.f_back
+                self.stacks[';'.join([names.get(thread_id, str(thread_id)), *reversed(stack)])] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class PerfProfiler:
+    """Runs time-boxed profiles of the process it lives in"""
+    def __init__(self, service: str, artifacts_dir: str = PERF_ARTIFACTS_DIR, admin_ids: set = None):
+        self.service = service
+        self.artifacts_dir = artifacts_dir
+        self.admin_ids = PERF_ADMIN_IDS if admin_ids is None else admin_ids
+        self.lock = asyncio.Lock()
+        # Task -> monotonic creation time, filled by the task factory
+        self.task_started = weakref.WeakKeyDictionary()
+        self.http_server = None
+
+    def track_tasks(self, loop=None):
+        """Stamp the creation time of every task created on the loop from now on"""
+        loop = loop or asyncio.get_running_loop()
+        previous_factory = loop.get_task_factory()
+
+        def factory(loop, coro, **kwargs):
+            if previous_factory is not None:
+                task = previous_factory(loop, coro, **kwargs)
+            else:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+            self.task_started[task] = time.monotonic()
+            return task
+
+        loop.set_task_factory(factory)
+        for task in asyncio.all_tasks(loop):
+            self.task_started.setdefault(task, time.monotonic())
+
+    def is_admin(self, user_id):
+        return user_id in self.admin_ids
+
+    def task_dump(self):
+        now = time.monotonic()
+        tasks = []
+        for task in asyncio.all_tasks():
+            stack = task.get_stack(limit=1)
+            where = _frame_key(stack[0]) if stack else 'not started'
+            started = self.task_started.get(task)
+            tasks.append({
+                'name': task.get_name(),
+                'coro': getattr(task.get_coro(), '__qualname__', repr(task.get_coro())),
+                'age_seconds': round(now - started, 1) if started is not None else None,
+                'where': where,
+                'task': task,
+            })
+        # Tasks of unknown age were already running when tracking started, so they are the oldest
+        tasks.sort(key=lambda item: -(item['age_seconds'] if item['age_seconds'] is not None else float('inf')))
+        return tasks
+
+    async def run(self, seconds: float = PERF_DEFAULT_SECONDS):
+        """Profile the process for `seconds`, returning the summary dict"""
+        seconds = min(max(float(seconds), 1.0), PERF_MAX_SECONDS)
+        if self.lock.locked():
+            raise RuntimeError("a profiling run is already in progress")
+        async with self.lock:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(PERF_TRACEMALLOC_FRAMES)
+            before = tracemalloc.take_snapshot()
+            sampler = StackSampler()
+            sampler.start()
+            started = time.perf_counter()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                sampler.stop()
+                after = tracemalloc.take_snapshot()
+                if started_tracing:
+                    tracemalloc.stop()
+            elapsed = time.perf_counter() - started
+            tasks = self.task_dump()
+            # Leave out the profiler's own allocations
+            exclude = [tracemalloc.Filter(False, path) for path in (__file__, tracemalloc.__file__, threading.__file__)]
+            allocations = after.filter_traces(exclude).compare_to(before.filter_traces(exclude), 'lineno')
+            directory = await asyncio.to_thread(self.write_artifacts, sampler, allocations, after, tasks)
+            return self.summarize(sampler, allocations, tasks, elapsed, directory)
+
+    def summarize(self, sampler: StackSampler, allocations: list, tasks: list, elapsed: float, directory: str):
+        busy = sampler.samples - sampler.idle
+        return {
+            'service': self.service,
+            'seconds': round(elapsed, 1),
+            'samples': sampler.samples,
+            'busy_percent': round(100 * busy / sampler.samples, 1) if sampler.samples else 0.0,
+            'top_functions': [
+                {'function': function, 'own_percent': round(100 * count / busy, 1),
+                 'total_percent': round(100 * sampler.total[function] / busy, 1)}
+                for function, count in sampler.own.most_common(PERF_SUMMARY_ROWS)
+            ] if busy else [],
+            'top_allocations': [
+                {'site': str(stat.traceback[0]), 'size_diff_kb': round(stat.size_diff / 1024, 1),
+                 'count_diff': stat.count_diff}
+                for stat in allocations[:PERF_SUMMARY_ROWS]
+            ],
+            'tasks': len(tasks),
+            'longest_tasks': [
+                {key: value for key, value in item.items() if key != 'task'} for item in tasks[:PERF_SUMMARY_ROWS]
+            ],
+            'artifacts': directory,
+        }
+
+    def write_artifacts(self, sampler: StackSampler, allocations: list, snapshot, tasks: list):
+        directory = os.path.join(self.artifacts_dir, f"{self.service}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+        os.makedirs(directory, exist_ok=True)
+        # One "frame;frame;frame count" line per stack, the input format of flamegraph.pl and speedscope
+        with open(os.path.join(directory, 'cpu_collapsed.txt'), 'w', encoding='utf-8') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(directory, 'allocations_diff.txt'), 'w', encoding='utf-8') as f:
+            for stat in allocations[:200]:
+                f.write(f"{stat}\n")
+                for line in stat.traceback.format():
+                    f.write(f"    {line}\n")
+        snapshot.dump(os.path.join(directory, 'tracemalloc.snapshot'))
+        with open(os.path.join(directory, 'tasks.txt'), 'w', encoding='utf-8') as f:
+            for item in tasks:
+                f.write(f"{item['name']} {item['coro']} age={item['age_seconds']}s at {item['where']}\n")
+                item['task'].print_stack(file=f)
+                f.write("\n")
+        return directory
+
+    def format_summary(self, summary: dict):
+        """Compact plain-text summary that fits in one Telegram message"""
+        lines = [
+            f"{summary['service']}: {summary['seconds']}s, {summary['samples']} samples, "
+            f"{summary['busy_percent']}% busy, {summary['tasks']} tasks",
+            "",
+            "Top functions (own% / total%):",
+        ]
+        lines += [f"  {row['own_percent']:5.1f} {row['total_percent']:5.1f}  {row['function']}"
+                  for row in summary['top_functions']] or ["  (idle)"]
+        lines += ["", "Top allocation growth:"]
+        lines += [f"  {row['size_diff_kb']:+9.1f} KiB {row['count_diff']:+6d}  {row['site']}"
+                  for row in summary['top_allocations']]
+        lines += ["", "Longest-running tasks:"]
+        lines += [f"  {row['age_seconds'] if row['age_seconds'] is not None else '?':>8}s  {row['name']} "
+                  f"{row['coro']} @ {row['where']}" for row in summary['longest_tasks']]
+        lines += ["", f"Artefacts: {summary['artifacts']}"]
+        return '\n'.join(lines)[:4000]
+
+    async def handle_command(self, update, context):
+        """/perf [seconds] for admins listed in PERF_ADMIN_IDS"""
+        user = update.effective_user
+        if not update.message:
+            return
+        if not user or not self.is_admin(user.id):
+            logger.warning(f"/perf refused for user {user.id if user else 'unknown'}")
+            return
+        try:
+            seconds = float(context.args[0]) if context.args else PERF_DEFAULT_SECONDS
+        except ValueError:
+            await update.message.reply_text("Foydalanish: /perf [soniya]")
+            return
+        await update.message.reply_text(f"Profiling {min(max(seconds, 1), PERF_MAX_SECONDS):.0f}s...")
+        try:
+            summary = await self.run(seconds)
+        except RuntimeError as e:
+            await update.message.reply_text(str(e))
+            return
+        await update.message.reply_text(self.format_summary(summary))
+
+    async def start_http(self, host: str = PERF_HTTP_HOST, port: int = PERF_HTTP_PORT):
+        self.http_server = await asyncio.start_server(self.handle_http, host, port)
+        logger.info(f"Perf hook listening on http://{host}:{port}{PERF_HTTP_PATH}")
+
+    async def stop_http(self):
+        if self.http_server:
+            self.http_server.close()
+            await self.http_server.wait_closed()
+            self.http_server = None
+
+    async def handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """GET /perf?seconds=N, answered with the JSON summary"""
+        status, body = 500, {'error': 'internal error'}
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            while (await asyncio.wait_for(reader.readline(), timeout=10)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            target = urlparse(parts[1]) if len(parts) >= 2 else None
+            if target is None or parts[0] != 'GET' or target.path != PERF_HTTP_PATH:
+                status, body = 404, {'error': 'not found'}
+            else:
+                seconds = parse_qs(target.query).get('seconds', [PERF_DEFAULT_SECONDS])[0]
+                status, body = 200, await self.run(float(seconds))
+        except RuntimeError as e:
+            status, body = 409, {'error': str(e)}
+        except (asyncio.TimeoutError, ValueError) as e:
+            status, body = 400, {'error': f'bad request: {e}'}
+        except Exception as e:
+            logger.error(f"Perf hook error: {e}")
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict', 500: 'Internal Server Error'}
+        content = json.dumps(body).encode('utf-8')
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {reasons[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + content
+            )
+            await writer.drain()
+        finally:
+            writer.close()
@@ -0,0 +1,264 @@
+"""Print-ready QR code sheets for waste bins, grouped by Toza Hudud.
+
+Every bin gets a QR code of its bot deep link
+(https://t.me/<bot>?start=<bin_id>, handled by the bot's /start command)
+rendered as a labelled tile. Tiles are cached on disk under the SHA-256 of
+everything drawn on them, so a run only renders bins that are new or whose
+link, address or district changed; those are rendered across a process
+pool. Sheets are then composed from cached tiles: one multi-page PDF and
+one PNG per page for every Toza Hudud.
+
+The bot username is asked from Telegram (getMe) with the bot's token, so
+printed codes cannot point at a mistyped bot.
+
+Needs the qrcode and Pillow packages.
+
+Usage:
+    BOT_TOKEN=<token> python qr_sheets.py [output directory]
+"""
+import hashlib
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+
+from api_login import login_headers
+from records import dumps, loads
+
+try:
+    import qrcode
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    qrcode = None
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://deklorantapi.cdcgroup.uz/api"
+
+# Token of the bot the deep links point at; its username is resolved with getMe
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+QR_SHEETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "qr_sheets")
+# Page keys of the sheets written by the last run
+SHEET_MANIFEST = "sheets.json"
+# Bump when the tile layout changes so cached tiles are re-rendered
+QR_TILE_VERSION = 1
+
+# A4 at 300 DPI
+SHEET_DPI = 300
+SHEET_SIZE = (2480, 3508)
+SHEET_MARGIN = 120
+SHEET_COLUMNS = 3
+SHEET_ROWS = 4
+TILE_SIZE = ((SHEET_SIZE[0] - 2 * SHEET_MARGIN) // SHEET_COLUMNS, (SHEET_SIZE[1] - 2 * SHEET_MARGIN) // SHEET_ROWS)
+# Height of the text under the code
+LABEL_HEIGHT = 170
+LABEL_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+LABEL_FONT_SIZE = 34
+# Longer addresses are cut to fit the tile
+MAX_ADDRESS_CHARS = 48
+
+
+def resolve_bot_username(bot_token: str):
+    """Username of the bot a token belongs to, from Telegram's getMe"""
+    response = requests.get(f"https://api.telegram.org/bot{bot_token}/getMe", timeout=30)
+    response.raise_for_status()
+    result = response.json()
+    if not result.get('ok') or not result['result'].get('username'):
+        raise RuntimeError(f"getMe failed: {result}")
+    return result['result']['username']
+
+
+def deep_link(bin_id: str, bot_username: str):
+    """Link that opens the bot with /start <bin_id>"""
+    return f"https://t.me/{bot_username}?start={bin_id}"
+
+
+def tile_spec(waste_bin: dict, bot_username: str):
+    """Everything drawn on a bin's tile"""
+    bin_id = str(waste_bin['id'])
+    return {
+        'id': bin_id,
+        'link': deep_link(bin_id, bot_username),
+        'address': (waste_bin.get('address') or '')[:MAX_ADDRESS_CHARS],
+        'toza_hudud': waste_bin.get('toza_hudud') or waste_bin.get('tozaHudud') or 'Noma\'lum',
+    }
+
+
+def tile_key(spec: dict):
+    content = '\0'.join([str(QR_TILE_VERSION), spec['link'], spec['address'], spec['toza_hudud']])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _font(size: int = LABEL_FONT_SIZE):
+    try:
+        return ImageFont.truetype(LABEL_FONT_PATH, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def render_tile(spec: dict, path: str):
+    """Render one labelled QR tile to path; runs in a worker process"""
+    code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=1, border=2)
+    code.add_data(spec['link'])
+    code.make(fit=True)
+    # Whole pixels per module, so every module prints the same size
+    modules = code.modules_count + 2 * code.border
+    side = (min(TILE_SIZE[0], TILE_SIZE[1] - LABEL_HEIGHT) - 40) // modules * modules
+    image = code.make_image(fill_color='black', back_color='white').get_image().convert('L')
+    image = image.resize((side, side), Image.NEAREST)
+
+    tile = Image.new('L', TILE_SIZE, 255)
+    tile.paste(image, ((TILE_SIZE[0] - side) // 2, 20))
+    draw = ImageDraw.Draw(tile)
+    font = _font()
+    lines = [spec['address'], f"ID: {spec['id'][:8]}  {spec['toza_hudud']}"]
+    y = side + 30
+    for line in lines:
+        width = draw.textlength(line, font=font)
+        draw.text(((TILE_SIZE[0] - width) / 2, y), line, fill=0, font=font)
+        y += LABEL_FONT_SIZE + 16
+    # Cut guide
+    draw.rectangle([0, 0, TILE_SIZE[0] - 1, TILE_SIZE[1] - 1], outline=200)
+    # Write then rename, so an interrupted run never leaves a truncated tile in the cache
+    temporary = f"{path}.{os.getpid()}.tmp"
+    tile.save(temporary, format='PNG', compress_level=1)
+    os.replace(temporary, path)
+    return path
+
+
+def _render_job(job):
+    spec, path = job
+    return render_tile(spec, path)
+
+
+class QRSheetGenerator:
+    """Renders changed tiles in parallel and composes per-district sheets from the cache"""
+    def __init__(self, bot_username: str, output_dir: str = QR_SHEETS_DIR, cache_dir: str = None,
+                 workers: int = None):
+        if qrcode is None:
+            raise RuntimeError("QR sheets need the qrcode and Pillow packages (pip install qrcode pillow)")
+        self.output_dir = output_dir
+        # Rendered tiles, named by content hash
+        self.cache_dir = cache_dir or os.path.join(output_dir, "cache")
+        self.bot_username = bot_username
+        self.workers = workers
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def tile_path(self, key: str):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def render_tiles(self, bins: list):
+        """Render tiles missing from the cache.
+        Returns ({toza_hudud: [tile path, ...]}, number of tiles rendered).
+        """
+        groups = {}
+        missing = {}
+        for waste_bin in bins:
+            spec = tile_spec(waste_bin, self.bot_username)
+            path = self.tile_path(tile_key(spec))
+            groups.setdefault(spec['toza_hudud'], []).append(path)
+            if not os.path.exists(path):
+                missing[path] = spec
+        if missing:
+            jobs = [(spec, path) for path, spec in missing.items()]
+            if len(jobs) == 1 or self.workers == 1:
+                for job in jobs:
+                    _render_job(job)
+            else:
+                with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                    for _ in pool.map(_render_job, jobs, chunksize=max(1, len(jobs) // 64)):
+                        pass
+        return groups, len(missing)
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.output_dir, SHEET_MANIFEST), 'rb') as f:
+                return loads(f.read())
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest: dict):
+        with open(os.path.join(self.output_dir, SHEET_MANIFEST), 'wb') as f:
+            f.write(dumps(manifest))
+
+    def compose(self, district: str, tile_paths: list, manifest: dict):
+        """Write a district's sheets, returning the PDF path.
+        Pages whose tiles are unchanged since the last run (per the manifest) are reused.
+        """
+        per_page = SHEET_COLUMNS * SHEET_ROWS
+        name = ''.join(c if c.isalnum() else '_' for c in district).strip('_') or 'bins'
+        pdf_path = os.path.join(self.output_dir, f"{name}.pdf")
+        page_keys = [
+            hashlib.sha256('\0'.join(tile_paths[start:start + per_page]).encode()).hexdigest()
+            for start in range(0, len(tile_paths), per_page)
+        ]
+        if manifest.get(name) == page_keys and os.path.exists(pdf_path):
+            return pdf_path
+
+        previous = manifest.get(name) or []
+        pages = []
+        for page_index, page_key in enumerate(page_keys):
+            page_path = os.path.join(self.output_dir, f"{name}_{page_index + 1:03d}.png")
+            if page_index < len(previous) and previous[page_index] == page_key and os.path.exists(page_path):
+                with Image.open(page_path) as page:
+                    pages.append(page.copy())
+                continue
+            page = Image.new('L', SHEET_SIZE, 255)
+            start = page_index * per_page
+            for index, path in enumerate(tile_paths[start:start + per_page]):
+                row, column = divmod(index, SHEET_COLUMNS)
+                with Image.open(path) as tile:
+                    page.paste(tile, (SHEET_MARGIN + column * TILE_SIZE[0], SHEET_MARGIN + row * TILE_SIZE[1]))
+            page.save(page_path, dpi=(SHEET_DPI, SHEET_DPI), compress_level=1)
+            pages.append(page)
+        # Pages left over from a district that shrank
+        for page_index in range(len(page_keys), len(previous)):
+            stale = os.path.join(self.output_dir, f"{name}_{page_index + 1:03d}.png")
+            if os.path.exists(stale):
+                os.remove(stale)
+        if pages:
+            pages[0].save(pdf_path, save_all=True, append_images=pages[1:], resolution=SHEET_DPI)
+        manifest[name] = page_keys
+        return pdf_path
+
+    def generate(self, bins: list):
+        """Render and compose sheets for all bins, returning (PDF paths, tiles rendered)"""
+        groups, rendered = self.render_tiles(bins)
+        logger.info(f"QR tiles: {rendered} rendered, {sum(map(len, groups.values())) - rendered} from cache")
+        manifest = self.load_manifest()
+        pdf_paths = [self.compose(district, paths, manifest) for district, paths in sorted(groups.items())]
+        self.save_manifest(manifest)
+        return pdf_paths, rendered
+
+
+def fetch_bins(api_base_url: str, headers: dict):
+    response = requests.get(f"{api_base_url}/waste-bins/", headers=headers, timeout=120)
+    response.raise_for_status()
+    data = response.json()
+    return data.get('results', []) if isinstance(data, dict) else data
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else QR_SHEETS_DIR
+    if not BOT_TOKEN:
+        print("Set BOT_TOKEN to the token of the bot the QR codes should open")
+        sys.exit(2)
+    bot_username = resolve_bot_username(BOT_TOKEN)
+    print(f"Deep links point at @{bot_username}")
+    bins = fetch_bins(API_BASE_URL, login_headers(API_BASE_URL))
+
+    started = time.perf_counter()
+    generator = QRSheetGenerator(bot_username, output_dir)
+    pdf_paths, rendered = generator.generate(bins)
+    print(f"{len(bins)} bins, {rendered} tiles rendered, {len(pdf_paths)} district sheets "
+          f"in {time.perf_counter() - started:.1f}s")
+    for path in pdf_paths:
+        print(f"  {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""Typed records passed between the bots, the AI service and the platform API.
+
+Records use slotted dataclasses so hot paths (sensor ingestion, photo
+analysis) allocate one small object instead of several dicts, and encode
+straight to JSON bytes. orjson is used when installed, otherwise the
+standard json module.
+"""
+import json
+from dataclasses import dataclass, field
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj):
+    """Encode an object to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    """Decode JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _first(data: dict, *keys, default=None):
+    """Read the first present key, the API mixes snake_case and camelCase"""
+    for key in keys:
+        value = data.get(key)
+        if value is not None:
+            return value
+    return default
+
+
+def _location(value):
+    if isinstance(value, dict) and value.get('lat') is not None and value.get('lng') is not None:
+        return float(value['lat']), float(value['lng'])
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        return float(value[0]), float(value[1])
+    return None
+
+
+@dataclass(slots=True)
+class SensorReading:
+    device_id: str
+    temperature: float = None
+    humidity: float = None
+    sleep_seconds: int = None
+    timestamp: int = None
+
+    def __post_init__(self):
+        if not self.device_id or not isinstance(self.device_id, str):
+            raise ValueError(f"Invalid device_id: {self.device_id!r}")
+        if self.temperature is None and self.humidity is None:
+            raise ValueError(f"Reading from {self.device_id} has neither temperature nor humidity")
+        if self.temperature is not None and not -80 <= self.temperature <= 150:
+            raise ValueError(f"Temperature out of range for {self.device_id}: {self.temperature}")
+        if self.humidity is not None and not 0 <= self.humidity <= 100:
+            raise ValueError(f"Humidity out of range for {self.device_id}: {self.humidity}")
+        if self.sleep_seconds is not None and self.sleep_seconds < 0:
+            raise ValueError(f"Negative sleep_seconds for {self.device_id}: {self.sleep_seconds}")
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            data['device_id'],
+            data.get('temperature'),
+            data.get('humidity'),
+            data.get('sleep_seconds'),
+            data.get('timestamp'),
+        )
+
+    def to_payload(self):
+        """Request body for /iot-devices/data/update/"""
+        return {
+            'device_id': self.device_id,
+            'temperature': self.temperature,
+            'humidity': self.humidity,
+            'sleep_seconds': self.sleep_seconds,
+            'timestamp': self.timestamp,
+        }
+
+    def encode(self):
+        return dumps(self.to_payload())
+
+
+@dataclass(slots=True)
+class AIAnalysis:
+    is_waste_bin: bool
+    is_full: bool
+    fill_level: int
+    confidence: int
+    notes: str = ''
+    detected_objects: list = field(default_factory=list)
+    suggestions: str = ''
+
+    def __post_init__(self):
+        # Percentages, stored as whole numbers the way the bin API expects them
+        self.fill_level = min(max(round(float(self.fill_level or 0)), 0), 100)
+        self.confidence = min(max(round(float(self.confidence or 0)), 0), 100)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Build from the Gemini response schema (camelCase keys)"""
+        return cls(
+            bool(data.get('isWasteBin', False)),
+            bool(data.get('isFull', False)),
+            data.get('fillLevel', 0),
+            data.get('confidence', 0),
+            data.get('notes', '') or '',
+            list(data.get('detectedObjects') or []),
+            data.get('suggestions', '') or '',
+        )
+
+    @classmethod
+    def failed(cls, notes: str, suggestions: str):
+        """Analysis result used when the AI service could not be reached"""
+        return cls(False, False, 0, 0, notes, [], suggestions)
+
+    @classmethod
+    def combine(cls, analyses: list):
+        """One verdict for several photos of the same bin, and the index of the best photo.
+        Fill level and fullness are confidence-weighted over the photos that show a bin;
+        the text comes from the most confident of them.
+        """
+        bins = [(index, analysis) for index, analysis in enumerate(analyses) if analysis.is_waste_bin]
+        if not bins:
+            best = max(range(len(analyses)), key=lambda index: analyses[index].confidence)
+            return analyses[best], best
+        best, top = max(bins, key=lambda item: item[1].confidence)
+        weights = [(analysis.confidence or 1, analysis) for _, analysis in bins]
+        total = sum(weight for weight, _ in weights)
+        objects = []
+        for _, analysis in bins:
+            objects.extend(item for item in analysis.detected_objects if item not in objects)
+        combined = cls(
+            True,
+            sum(weight for weight, analysis in weights if analysis.is_full) * 2 >= total,
+            sum(weight * analysis.fill_level for weight, analysis in weights) / total,
+            top.confidence,
+            top.notes,
+            objects,
+            top.suggestions,
+        )
+        return combined, best
+
+    def to_dict(self):
+        return {
+            'isWasteBin': self.is_waste_bin,
+            'isFull': self.is_full,
+            'fillLevel': self.fill_level,
+            'confidence': self.confidence,
+            'notes': self.notes,
+            'detectedObjects': self.detected_objects,
+            'suggestions': self.suggestions,
+        }
+
+    def summary(self):
+        """Text stored in the bin's last_analysis field"""
+        return (
+            f"AI tahlili: {self.notes or 'Tahlil amalga oshirildi'}, Isbot: {self.is_waste_bin}, "
+            f"IsFull: {self.is_full}, Conf: {self.confidence}%"
+        )
+
+
+@dataclass(slots=True)
+class BinDetails:
+    id: str
+    address: str = None
+    fill_level: float = 0
+    is_full: bool = False
+    toza_hudud: str = None
+    location: tuple = None
+    fill_rate: float = None
+    image_source: str = None
+    camera_url: str = None
+    qr_code_url: str = None
+    ai_analysis: AIAnalysis = None
+
+    def __post_init__(self):
+        if not self.id:
+            raise ValueError("Bin record without id")
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Build from a /waste-bins/ response"""
+        return cls(
+            str(data['id']),
+            data.get('address'),
+            _first(data, 'fill_level', 'fillLevel', default=0),
+            bool(_first(data, 'is_full', 'isFull', default=False)),
+            _first(data, 'toza_hudud', 'tozaHudud'),
+            _location(data.get('location')),
+            _first(data, 'fill_rate', 'fillRate'),
+            _first(data, 'image_source', 'imageSource'),
+            _first(data, 'camera_url', 'cameraUrl'),
+            _first(data, 'qr_code_url', 'qrCodeUrl'),
+        )
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'address': self.address,
+            'fill_level': self.fill_level,
+            'is_full': self.is_full,
+            'toza_hudud': self.toza_hudud,
+            'location': {'lat': self.location[0], 'lng': self.location[1]} if self.location else None,
+            'fill_rate': self.fill_rate,
+            'image_source': self.image_source,
+            'camera_url': self.camera_url,
+            'qr_code_url': self.qr_code_url,
+        }
+        if self.ai_analysis is not None:
+            data['ai_analysis'] = self.ai_analysis.to_dict()
+        return data
+
+    def encode(self):
+        return dumps(self.to_dict())
+
+
+@dataclass(slots=True)
+class Truck:
+    id: str
+    driver_name: str = None
+    plate_number: str = None
+    toza_hudud: str = None
+    location: tuple = None
+    status: str = 'IDLE'
+    fuel_level: float = None
+    phone: str = None
+
+    def __post_init__(self):
+        if not self.id:
+            raise ValueError("Truck record without id")
+        if self.status not in ('IDLE', 'BUSY', 'OFFLINE'):
+            raise ValueError(f"Invalid truck status for {self.id}: {self.status!r}")
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Build from a /trucks/ response"""
+        return cls(
+            str(data['id']),
+            _first(data, 'driver_name', 'driverName'),
+            _first(data, 'plate_number', 'plateNumber'),
+            _first(data, 'toza_hudud', 'tozaHudud'),
+            _location(data.get('location')),
+            data.get('status') or 'IDLE',
+            _first(data, 'fuel_level', 'fuelLevel'),
+            data.get('phone'),
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'driver_name': self.driver_name,
+            'plate_number': self.plate_number,
+            'toza_hudud': self.toza_hudud,
+            'location': {'lat': self.location[0], 'lng': self.location[1]} if self.location else None,
+            'status': self.status,
+            'fuel_level': self.fuel_level,
+            'phone': self.phone,
+        }
+
+    def encode(self):
+        return dumps(self.to_dict())
@@ -0,0 +1,236 @@
+"""Collection route optimizer for full waste bins.
+
+Bins and trucks come from /waste-bins/ and /trucks/. Routes never cross
+Toza Hudud boundaries: every district is solved independently with its own
+trucks. For each district the haversine distance matrix is built in one
+vectorized NumPy pass. Routes are constructed by greedy nearest neighbour
+across all trucks of the district and then improved with 2-opt and Or-opt
+moves whose gains are evaluated for all candidate positions at once.
+
+Routes are open paths that start at the truck's current location.
+
+Usage:
+    python route_optimizer.py
+"""
+import logging
+import time
+
+import numpy as np
+import requests
+
+from api_login import login_headers
+from records import BinDetails, Truck
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://deklorantapi.cdcgroup.uz/api"
+
+EARTH_RADIUS_KM = 6371.0088
+# Maximum number of bins one truck collects per route
+TRUCK_CAPACITY_BINS = 40
+# Trucks below this fuel level are not given routes
+MIN_FUEL_LEVEL = 15
+# Time budget for the improvement phase of one district, split between its routes;
+# time a route does not use passes on to the next ones
+IMPROVEMENT_SECONDS = 2.0
+OR_OPT_SEGMENT_LENGTHS = (1, 2, 3)
+
+
+def haversine_matrix(origins, destinations):
+    """Great-circle distances in km between every origin and destination.
+    Both arguments are (n, 2) arrays of (lat, lng) in degrees.
+    """
+    origins = np.radians(np.asarray(origins, dtype=np.float64))
+    destinations = np.radians(np.asarray(destinations, dtype=np.float64))
+    lat1 = origins[:, 0][:, None]
+    lat2 = destinations[:, 0][None, :]
+    dlat = lat2 - lat1
+    dlng = destinations[:, 1][None, :] - origins[:, 1][:, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))).astype(np.float32)
+
+
+def build_distance_matrix(truck_points, bin_points):
+    """Distance matrix over [trucks..., bins..., sink].
+    The sink is a zero-distance node that terminates every open route, which
+    lets route moves treat the last stop like any other.
+    """
+    points = np.vstack([truck_points, bin_points])
+    size = len(points)
+    dist = np.zeros((size + 1, size + 1), dtype=np.float32)
+    dist[:size, :size] = haversine_matrix(points, points)
+    return dist
+
+
+def construct_routes(dist, truck_count: int, bin_count: int, capacity: int):
+    """Greedy nearest-neighbour construction over all trucks at once.
+    Each step extends whichever truck has the cheapest next bin, so trucks
+    grow compact, mostly non-overlapping routes. Node i < truck_count is
+    truck i's start; bins are nodes truck_count.. .
+    """
+    routes = [[truck] for truck in range(truck_count)]
+    unvisited = np.zeros(dist.shape[0], dtype=bool)
+    unvisited[truck_count:truck_count + bin_count] = True
+    ends = np.arange(truck_count)
+    open_trucks = np.ones(truck_count, dtype=bool)
+    for _ in range(bin_count):
+        if not open_trucks.any():
+            break
+        costs = np.where(unvisited[None, :] & open_trucks[:, None], dist[ends], np.inf)
+        flat = int(np.argmin(costs))
+        truck, nearest = divmod(flat, costs.shape[1])
+        routes[truck].append(nearest)
+        unvisited[nearest] = False
+        ends[truck] = nearest
+        if len(routes[truck]) - 1 >= capacity:
+            open_trucks[truck] = False
+    unassigned = np.flatnonzero(unvisited).tolist()
+    return [np.array(route, dtype=np.int64) for route in routes], unassigned
+
+
+def route_length(route, dist):
+    return float(dist[route[:-1], route[1:]].sum()) if len(route) > 1 else 0.0
+
+
+def two_opt(route, dist, sink: int, deadline: float):
+    """Reverse segments while it shortens the route; position 0 (the truck) is fixed"""
+    route = route.copy()
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        n = len(route)
+        for i in range(1, n - 1):
+            a, b = route[i - 1], route[i]
+            c = route[i + 1:]
+            d = np.append(route[i + 2:], sink)
+            # Gain of reversing route[i..j] for every j > i at once
+            delta = dist[a, c] + dist[b, d] - dist[a, b] - dist[c, d]
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-6:
+                j = i + 1 + k
+                route[i:j + 1] = route[i:j + 1][::-1].copy()
+                improved = True
+    return route
+
+
+def or_opt(route, dist, sink: int, deadline: float):
+    """Move segments of 1-3 stops to the cheapest other position in the route"""
+    route = route.copy()
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for length in OR_OPT_SEGMENT_LENGTHS:
+            i = 1
+            while i + length <= len(route):
+                segment = route[i:i + length]
+                prev_node = route[i - 1]
+                next_node = route[i + length] if i + length < len(route) else sink
+                removal_gain = dist[prev_node, segment[0]] + dist[segment[-1], next_node] - dist[prev_node, next_node]
+                rest = np.concatenate([route[:i], route[i + length:]])
+                after = np.append(rest[1:], sink)
+                # Insert between rest[p] and after[p], in both orientations
+                forward = dist[rest, segment[0]] + dist[segment[-1], after] - dist[rest, after]
+                backward = dist[rest, segment[-1]] + dist[segment[0], after] - dist[rest, after]
+                costs = np.minimum(forward, backward)
+                p = int(np.argmin(costs))
+                if costs[p] < removal_gain - 1e-6:
+                    piece = segment if forward[p] <= backward[p] else segment[::-1]
+                    route = np.concatenate([rest[:p + 1], piece, rest[p + 1:]])
+                    improved = True
+                else:
+                    i += 1
+    return route
+
+
+def optimize_district(trucks: list, bins: list, capacity: int = TRUCK_CAPACITY_BINS,
+                      improvement_seconds: float = IMPROVEMENT_SECONDS):
+    """Build routes for one Toza Hudud.
+    Returns ({truck_id: {'bins': [...], 'distance_km': float}}, [unassigned bin ids]).
+    """
+    if not trucks or not bins:
+        return {}, [b.id for b in bins]
+    truck_points = np.array([t.location for t in trucks])
+    bin_points = np.array([b.location for b in bins])
+    dist = build_distance_matrix(truck_points, bin_points)
+    sink = dist.shape[0] - 1
+    routes, unassigned = construct_routes(dist, len(trucks), len(bins), capacity)
+
+    budget_end = time.perf_counter() + improvement_seconds
+    left = sum(1 for route in routes if len(route) > 3)
+    result = {}
+    for truck_index, route in enumerate(routes):
+        if len(route) > 3:
+            # Every route gets its own slice, so the last trucks are improved too
+            now = time.perf_counter()
+            deadline = now + max(0.0, budget_end - now) / left
+            left -= 1
+            route = two_opt(route, dist, sink, deadline)
+            route = or_opt(route, dist, sink, deadline)
+            route = two_opt(route, dist, sink, deadline)
+        result[trucks[truck_index].id] = {
+            'bins': [bins[node - len(trucks)].id for node in route[1:]],
+            'distance_km': round(route_length(route, dist), 3)
+        }
+    return result, [bins[node - len(trucks)].id for node in unassigned]
+
+
+def plan_routes(trucks: list, bins: list, capacity: int = TRUCK_CAPACITY_BINS,
+                improvement_seconds: float = IMPROVEMENT_SECONDS):
+    """Plan collection routes for all full bins, district by district.
+    Only idle trucks get routes, as in dispatch.TruckDispatcher.
+    """
+    available = [
+        t for t in trucks
+        if t.status == 'IDLE' and t.location and (t.fuel_level is None or t.fuel_level >= MIN_FUEL_LEVEL)
+    ]
+    full_bins = [b for b in bins if b.is_full and b.location]
+
+    trucks_by_district = {}
+    for truck in available:
+        trucks_by_district.setdefault(truck.toza_hudud, []).append(truck)
+    bins_by_district = {}
+    for waste_bin in full_bins:
+        bins_by_district.setdefault(waste_bin.toza_hudud, []).append(waste_bin)
+
+    routes = {}
+    unassigned = []
+    for district, district_bins in bins_by_district.items():
+        district_trucks = trucks_by_district.get(district, [])
+        if not district_trucks:
+            logger.warning(f"No available trucks in {district} for {len(district_bins)} full bins")
+        district_routes, district_unassigned = optimize_district(
+            district_trucks, district_bins, capacity, improvement_seconds
+        )
+        routes.update(district_routes)
+        unassigned.extend(district_unassigned)
+    return {'routes': routes, 'unassigned': unassigned}
+
+
+def fetch_fleet(api_base_url: str, headers: dict):
+    """Load bins and trucks from the platform API"""
+    bins_response = requests.get(f"{api_base_url}/waste-bins/", headers=headers, timeout=60)
+    bins_response.raise_for_status()
+    trucks_response = requests.get(f"{api_base_url}/trucks/", headers=headers, timeout=60)
+    trucks_response.raise_for_status()
+    bins = [BinDetails.from_dict(b) for b in bins_response.json()]
+    trucks = [Truck.from_dict(t) for t in trucks_response.json()]
+    return trucks, bins
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    headers = login_headers(API_BASE_URL)
+
+    trucks, bins = fetch_fleet(API_BASE_URL, headers)
+    started = time.perf_counter()
+    plan = plan_routes(trucks, bins)
+    elapsed = time.perf_counter() - started
+
+    for truck_id, route in plan['routes'].items():
+        print(f"Truck {truck_id}: {len(route['bins'])} bins, {route['distance_km']} km")
+    print(f"Unassigned bins: {len(plan['unassigned'])}")
+    print(f"Planned in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Compact sensor frames for ESP nodes and gateway devices.
+
+Every frame starts with FRAME_MAGIC followed by a schema version byte:
+
+    v1  one reading
+        <id length:B><device id><temperature*10:h><humidity*10:H><sleep:I>
+    v2  batch of readings (gateways aggregating several ESP nodes)
+        <base timestamp:I><count:H>, then `count` fixed-size records
+        <device id:12s><temperature*10:h><humidity*10:H><sleep:I><timestamp offset:H>
+
+The maximum value of a numeric field (minimum for temperature) means
+"not reported". A v2 timestamp offset is 16 bits, so one batch spans at
+most V2_MAX_SPAN_SECONDS (about 18 h); encode_batch raises ValueError for
+a longer one. Over Telegram a frame is sent as text: TEXT_FRAME_PREFIX
+followed by the base64 encoded frame, several frames per message allowed.
+
+Decoded readings use the same dict format as IoTMonitorBot.extract_sensor_data,
+plus a 'timestamp' key when the frame carries one.
+"""
+import base64
+import binascii
+import re
+import struct
+
+FRAME_MAGIC = b'SF'
+FRAME_HEADER = struct.Struct('<2sB')
+
+V1_READING = struct.Struct('<hHI')
+
+V2_HEADER = struct.Struct('<IH')
+V2_RECORD = struct.Struct('<12shHIH')
+V2_MAX_RECORDS = 0xFFFF
+
+TEMPERATURE_MISSING = -0x8000
+HUMIDITY_MISSING = 0xFFFF
+SLEEP_MISSING = 0xFFFFFFFF
+TIMESTAMP_MISSING = 0xFFFF
+V2_MAX_SPAN_SECONDS = TIMESTAMP_MISSING - 1
+
+TEXT_FRAME_PREFIX = '#SF'
+TEXT_FRAME_PATTERN = re.compile(re.escape(TEXT_FRAME_PREFIX) + r'\s*([A-Za-z0-9+/=_-]{8,})')
+
+
+def _pack_values(reading: dict):
+    temperature = reading.get('temperature')
+    humidity = reading.get('humidity')
+    sleep_seconds = reading.get('sleep_seconds')
+    return (
+        round(temperature * 10) if temperature is not None else TEMPERATURE_MISSING,
+        round(humidity * 10) if humidity is not None else HUMIDITY_MISSING,
+        sleep_seconds if sleep_seconds is not None else SLEEP_MISSING,
+    )
+
+
+def encode_reading(reading: dict):
+    """Encode one reading as a v1 frame"""
+    device_id = reading['device_id'].encode('ascii')
+    return (
+        FRAME_HEADER.pack(FRAME_MAGIC, 1)
+        + bytes([len(device_id)]) + device_id
+        + V1_READING.pack(*_pack_values(reading))
+    )
+
+
+def encode_batch(readings: list, base_timestamp: int = None):
+    """Encode many readings as a v2 batch frame.
+    Reading timestamps are stored as offsets from base_timestamp (defaults to the oldest one).
+    """
+    if len(readings) > V2_MAX_RECORDS:
+        raise ValueError(f"A batch frame holds at most {V2_MAX_RECORDS} readings")
+    timestamps = [r['timestamp'] for r in readings if r.get('timestamp') is not None]
+    if base_timestamp is None:
+        base_timestamp = min(timestamps) if timestamps else 0
+    if timestamps and not (base_timestamp <= min(timestamps) and max(timestamps) - base_timestamp <= V2_MAX_SPAN_SECONDS):
+        raise ValueError(
+            f"Batch timestamps must lie within {V2_MAX_SPAN_SECONDS} s after the base timestamp {base_timestamp}, "
+            f"got {min(timestamps)}..{max(timestamps)}; split the batch"
+        )
+    records = [
+        V2_RECORD.pack(
+            r['device_id'].encode('ascii'),
+            *_pack_values(r),
+            (r['timestamp'] - base_timestamp) if r.get('timestamp') is not None else TIMESTAMP_MISSING
+        )
+        for r in readings
+    ]
+    return FRAME_HEADER.pack(FRAME_MAGIC, 2) + V2_HEADER.pack(base_timestamp, len(records)) + b''.join(records)
+
+
+def _reading(device_id, temperature, humidity, sleep_seconds):
+    return {
+        'device_id': device_id,
+        'temperature': temperature / 10 if temperature != TEMPERATURE_MISSING else None,
+        'humidity': humidity / 10 if humidity != HUMIDITY_MISSING else None,
+        'sleep_seconds': sleep_seconds if sleep_seconds != SLEEP_MISSING else None
+    }
+
+
+def _decode_v1(frame: bytes):
+    offset = FRAME_HEADER.size
+    if len(frame) < offset + 1:
+        return []
+    id_length = frame[offset]
+    start = offset + 1
+    end = start + id_length
+    if len(frame) < end + V1_READING.size:
+        return []
+    device_id = frame[start:end].decode('ascii', errors='ignore').strip()
+    return [_reading(device_id, *V1_READING.unpack_from(frame, end))]
+
+
+def _decode_v2(frame: bytes):
+    offset = FRAME_HEADER.size
+    if len(frame) < offset + V2_HEADER.size:
+        return []
+    base_timestamp, count = V2_HEADER.unpack_from(frame, offset)
+    body_start = offset + V2_HEADER.size
+    body = memoryview(frame)[body_start:body_start + count * V2_RECORD.size]
+    # Truncated frames keep every complete record
+    body = body[:len(body) - len(body) % V2_RECORD.size]
+    readings = []
+    append = readings.append
+    # iter_unpack walks all fixed-size records in one C-level pass
+    for raw_id, temperature, humidity, sleep_seconds, ts_offset in V2_RECORD.iter_unpack(body):
+        reading = _reading(raw_id.rstrip(b'\x00 ').decode('ascii', errors='ignore'),
+                           temperature, humidity, sleep_seconds)
+        reading['timestamp'] = base_timestamp + ts_offset if base_timestamp and ts_offset != TIMESTAMP_MISSING else None
+        append(reading)
+    return readings
+
+
+DECODERS = {
+    1: _decode_v1,
+    2: _decode_v2,
+}
+
+
+def is_frame(payload: bytes):
+    """Check whether a payload starts with a known frame header"""
+    return len(payload) >= FRAME_HEADER.size and payload[:2] == FRAME_MAGIC and payload[2] in DECODERS
+
+
+def decode_frame(frame: bytes):
+    """Decode a binary frame of any known version into a list of readings"""
+    if not is_frame(frame):
+        return []
+    readings = DECODERS[frame[2]](frame)
+    return [r for r in readings if r['device_id'] and (r['temperature'] is not None or r['humidity'] is not None)]
+
+
+def decode_text_frames(message_text: str):
+    """Decode every base64 frame embedded in a text message"""
+    readings = []
+    for match in TEXT_FRAME_PATTERN.finditer(message_text):
+        encoded = match.group(1)
+        try:
+            frame = base64.urlsafe_b64decode(encoded.replace('+', '-').replace('/', '_') + '=' * (-len(encoded) % 4))
+        except (binascii.Error, ValueError):
+            continue
+        readings.extend(decode_frame(frame))
+    return readings
+
+
+def encode_text_frame(frame: bytes):
+    """Wrap a binary frame for sending as a Telegram text message"""
+    return f"{TEXT_FRAME_PREFIX} {base64.b64encode(frame).decode('ascii')}"
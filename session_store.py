@@ -0,0 +1,128 @@
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Expired rows are purged from the database after this many writes
+PURGE_EVERY_WRITES = 500
+
+
+class SessionStore:
+    """Per-user conversation state with a fixed memory ceiling.
+
+    Hot sessions live in an in-memory LRU capped at max_entries; entries expire
+    ttl_seconds after their last write. When db_path is set, sessions are written
+    through to SQLite and loaded back one user at a time on a cache miss, so a
+    restart needs no full reload and memory stays flat as the user base grows.
+    """
+    def __init__(self, max_entries: int = 10000, ttl_seconds: int = 6 * 3600, db_path: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        # user_id -> (expires_at, data)
+        self.cache = OrderedDict()
+        self.db = None
+        self.writes = 0
+
+    def __len__(self):
+        return len(self.cache)
+
+    def get_db(self):
+        """Open the SQLite backend on first use"""
+        if self.db is None and self.db_path:
+            self.db = sqlite3.connect(self.db_path)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        return self.db
+
+    def load(self, user_id: str):
+        """Get a user's session dict, or None if missing or expired"""
+        user_id = str(user_id)
+        now = time.time()
+        entry = self.cache.get(user_id)
+        if entry is None:
+            entry = self.load_from_db(user_id)
+            if entry is None:
+                return None
+            self.remember(user_id, entry)
+        if entry[0] <= now:
+            self.delete(user_id)
+            return None
+        self.cache.move_to_end(user_id)
+        return entry[1]
+
+    def load_from_db(self, user_id: str):
+        db = self.get_db()
+        if db is None:
+            return None
+        try:
+            row = db.execute("SELECT expires_at, data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Session store read failed: {e}")
+            return None
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def remember(self, user_id: str, entry: tuple):
+        self.cache[user_id] = entry
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    def get(self, user_id, key: str, default=None):
+        """Get one value from a user's session"""
+        data = self.load(user_id)
+        if data is None:
+            return default
+        return data.get(key, default)
+
+    def set(self, user_id, key: str, value):
+        """Set one value in a user's session and refresh its TTL"""
+        user_id = str(user_id)
+        data = dict(self.load(user_id) or {})
+        data[key] = value
+        entry = (time.time() + self.ttl_seconds, data)
+        self.remember(user_id, entry)
+        self.save_to_db(user_id, entry)
+
+    def save_to_db(self, user_id: str, entry: tuple):
+        db = self.get_db()
+        if db is None:
+            return
+        try:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO sessions (user_id, expires_at, data) VALUES (?, ?, ?)",
+                    (user_id, entry[0], json.dumps(entry[1]))
+                )
+                self.writes += 1
+                if self.writes % PURGE_EVERY_WRITES == 0:
+                    db.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.error(f"Session store write failed: {e}")
+
+    def delete(self, user_id):
+        """Drop a user's session"""
+        user_id = str(user_id)
+        self.cache.pop(user_id, None)
+        db = self.get_db()
+        if db is None:
+            return
+        try:
+            with db:
+                db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        except sqlite3.Error as e:
+            logger.error(f"Session store delete failed: {e}")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
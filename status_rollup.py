@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# SensorStatus values, least to most severe
+STATUSES = ('OPTIMAL', 'WARNING', 'CRITICAL')
+
+# Same ranges as the climate dashboard (ClimateMonitor.tsx)
+ROOM_HUMIDITY_RANGE = (40, 60)
+BOILER_HUMIDITY_RANGE = (30, 70)
+TEMPERATURE_RANGE = (18, 24)
+TEMPERATURE_OPTIMAL = 21
+# Deviation outside the range still reported as WARNING
+WARNING_DEVIATION = 3
+
+# How often status changes are pushed to the platform
+ROLLUP_FLUSH_SECONDS = 15
+
+# Status field and endpoint of every node kind
+STATUS_FIELDS = {
+    'room': ('rooms', 'status'),
+    'boiler': ('boilers', 'status'),
+    'facility': ('facilities', 'overall_status'),
+}
+
+
+def humidity_severity(value, low: float, high: float):
+    if value is None or low <= value <= high:
+        return 0
+    return 1 if max(low - value, value - high) <= WARNING_DEVIATION else 2
+
+
+def temperature_severity(value):
+    if value is None or TEMPERATURE_RANGE[0] <= value <= TEMPERATURE_RANGE[1]:
+        return 0
+    return 1 if abs(TEMPERATURE_OPTIMAL - value) <= WARNING_DEVIATION else 2
+
+
+@dataclass(slots=True)
+class StatusNode:
+    kind: str
+    id: str
+    parent: 'StatusNode' = None
+    humidity: float = None
+    temperature: float = None
+    updated_at: float = 0.0
+    # Severity from this node's own reading, and rolled up over its children
+    own: int = 0
+    rolled: int = 0
+    # Number of children at each severity
+    child_counts: list = field(default_factory=lambda: [0, 0, 0])
+    # Whether this node or one below it received a reading since start; only then is
+    # the computed status trusted over the one the platform holds
+    live: bool = False
+
+    def own_severity(self):
+        humidity_range = BOILER_HUMIDITY_RANGE if self.kind == 'boiler' else ROOM_HUMIDITY_RANGE
+        return max(humidity_severity(self.humidity, *humidity_range), temperature_severity(self.temperature))
+
+    def rolled_severity(self):
+        for severity in (2, 1):
+            if self.child_counts[severity]:
+                return max(self.own, severity)
+        return self.own
+
+
+class StatusRollup:
+    """In-memory room -> boiler -> facility graph with incremental status roll-up.
+
+    Every node keeps a count of its children per severity, so a new reading
+    updates its node and walks up the parent chain only while the rolled-up
+    status actually changes: O(depth) per reading, never the whole tree.
+    Status changes are collected per node and pushed in batches; a node that
+    flips back and forth between flushes is sent once with its final status.
+    """
+    def __init__(self, api_base_url: str, get_auth_headers):
+        self.api_base_url = api_base_url
+        self.get_auth_headers = get_auth_headers
+        # (kind, id) -> StatusNode
+        self.nodes = {}
+        # (kind, id) -> status still to be pushed
+        self.pending = {}
+        # (kind, id) -> status last known to the platform
+        self.published = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def load(self, facilities: list):
+        """Build the graph from a /facilities/ listing (boilers -> connected_rooms nested).
+        Nodes that already exist keep their latest readings. Statuses the platform
+        holds that disagree with the computed ones are queued for correction, but only
+        for nodes with readings since start: the rest would be computed from nothing.
+        """
+        old_nodes, self.nodes = self.nodes, {}
+        for facility in facilities:
+            facility_node = self.add_node('facility', facility, None, old_nodes)
+            for boiler in facility.get('boilers') or []:
+                boiler_node = self.add_node('boiler', boiler, facility_node, old_nodes)
+                for room in boiler.get('connected_rooms') or boiler.get('connectedRooms') or []:
+                    if ('room', str(room['id'])) in self.nodes:
+                        # A room is rolled up under the first boiler it is connected to
+                        continue
+                    self.add_node('room', room, boiler_node, old_nodes)
+        # Children are added before their roll-up is known, so settle bottom-up
+        for kind in ('room', 'boiler', 'facility'):
+            for node in self.nodes.values():
+                if node.kind == kind:
+                    node.rolled = node.rolled_severity()
+                    if node.parent is not None:
+                        node.parent.child_counts[node.rolled] += 1
+        for key, node in self.nodes.items():
+            status = STATUSES[node.rolled]
+            if node.live and self.published.get(key) != status:
+                self.pending[key] = status
+        logger.info(f"Status roll-up graph loaded: {len(self.nodes)} nodes from {len(facilities)} facilities")
+
+    def add_node(self, kind: str, data: dict, parent: StatusNode, old_nodes: dict):
+        key = (kind, str(data['id']))
+        node = StatusNode(kind, key[1], parent)
+        previous = old_nodes.get(key)
+        if previous is not None:
+            node.live = previous.live
+        if previous is not None and previous.updated_at:
+            node.humidity, node.temperature, node.updated_at = previous.humidity, previous.temperature, previous.updated_at
+        else:
+            node.humidity, node.temperature = data.get('humidity'), data.get('temperature')
+        node.own = node.own_severity()
+        self.nodes[key] = node
+        status_field = STATUS_FIELDS[kind][1]
+        self.published[key] = data.get(status_field) or data.get('overallStatus' if kind == 'facility' else 'status')
+        return node
+
+    def node_for_device(self, device: dict):
+        """Room or boiler a registered device reports for"""
+        if not device:
+            return None
+        if device.get('room') is not None:
+            return self.nodes.get(('room', str(device['room'])))
+        if device.get('boiler') is not None:
+            return self.nodes.get(('boiler', str(device['boiler'])))
+        return None
+
+    def facility_for_device(self, device: dict):
+        """Id of the facility a registered device belongs to, or None"""
+        node = self.node_for_device(device)
+        while node is not None and node.kind != 'facility':
+            node = node.parent
+        return node.id if node else None
+
+    def apply_reading(self, device: dict, reading: dict):
+        """Apply one reading, returning the number of nodes whose status changed"""
+        node = self.node_for_device(device)
+        if node is None:
+            return 0
+        timestamp = reading.get('timestamp') or time.time()
+        if timestamp < node.updated_at:
+            # Late (backlog) reading older than what we already know about
+            return 0
+        node.updated_at = timestamp
+        if reading.get('humidity') is not None:
+            node.humidity = reading['humidity']
+        if reading.get('temperature') is not None:
+            node.temperature = reading['temperature']
+        node.own = node.own_severity()
+        woken = []
+        parent = node
+        while parent is not None and not parent.live:
+            parent.live = True
+            woken.append(parent)
+            parent = parent.parent
+        changed = self.propagate(node)
+        # Nodes seeing their first reading may already disagree with the platform without changing here
+        for woken_node in woken:
+            key = (woken_node.kind, woken_node.id)
+            if self.published.get(key) != STATUSES[woken_node.rolled]:
+                self.pending[key] = STATUSES[woken_node.rolled]
+        return changed
+
+    def propagate(self, node: StatusNode):
+        """Recompute rolled-up statuses from node upwards, stopping where nothing changes"""
+        changed = 0
+        while node is not None:
+            rolled = node.rolled_severity()
+            if rolled == node.rolled:
+                break
+            if node.parent is not None:
+                node.parent.child_counts[node.rolled] -= 1
+                node.parent.child_counts[rolled] += 1
+            logger.info(f"{node.kind.capitalize()} {node.id} status {STATUSES[node.rolled]} -> {STATUSES[rolled]}")
+            node.rolled = rolled
+            self.pending[(node.kind, node.id)] = STATUSES[rolled]
+            changed += 1
+            node = node.parent
+        return changed
+
+    def status(self, kind: str, node_id):
+        node = self.nodes.get((kind, str(node_id)))
+        return STATUSES[node.rolled] if node else None
+
+    def flush(self):
+        """Push pending status changes to the platform"""
+        pending, self.pending = self.pending, {}
+        # Changes that flipped back to what the platform already has need no request
+        pending = {key: status for key, status in pending.items() if self.published.get(key) != status}
+        if not pending:
+            return 0
+        headers = self.get_auth_headers()
+        if not headers:
+            logger.error("Status roll-up flush skipped: no authentication headers")
+            for key, status in pending.items():
+                self.pending.setdefault(key, status)
+            return 0
+
+        sent = 0
+        with requests.Session() as session:
+            session.headers.update(headers)
+            for (kind, node_id), status in pending.items():
+                endpoint, status_field = STATUS_FIELDS[kind]
+                try:
+                    response = session.patch(
+                        f"{self.api_base_url}/{endpoint}/{node_id}/",
+                        json={status_field: status},
+                        timeout=30
+                    )
+                    if response.status_code in [200, 204]:
+                        self.published[(kind, node_id)] = status
+                        sent += 1
+                    else:
+                        logger.error(f"Error updating status of {kind} {node_id}: {response.status_code}, {response.text}")
+                except Exception as e:
+                    logger.error(f"Exception updating status of {kind} {node_id}: {e}")
+                    # Keep it for the next flush unless a newer change replaced it
+                    self.pending.setdefault((kind, node_id), status)
+        if sent:
+            logger.info(f"Pushed {sent} status changes to platform")
+        return sent
+
+    def fetch_facilities(self):
+        """Load the nested /facilities/ listing, None on failure"""
+        headers = self.get_auth_headers()
+        if not headers:
+            logger.error("Facility refresh skipped: no authentication headers")
+            return None
+        try:
+            response = requests.get(f"{self.api_base_url}/facilities/", headers=headers, timeout=60)
+        except Exception as e:
+            logger.error(f"Facility refresh failed: {e}")
+            return None
+        if response.status_code != 200:
+            logger.error(f"Facility refresh failed: {response.status_code}, {response.text}")
+            return None
+        data = response.json()
+        return data.get('results', []) if isinstance(data, dict) else data
+
+    async def run(self):
+        """Flush status changes every ROLLUP_FLUSH_SECONDS"""
+        while True:
+            await asyncio.sleep(ROLLUP_FLUSH_SECONDS)
+            try:
+                if self.pending:
+                    await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Status roll-up flush loop error: {e}")
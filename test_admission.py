@@ -0,0 +1,111 @@
+"""Unit tests for photo report admission control"""
+import asyncio
+
+from admission import (
+    ADMIT, AI_BURST, BIN_BURST, BIN_LIMITED, CHAT_BURST, CHAT_LIMITED, LIMITED_NOTICE_SECONDS, RECENTLY_VERIFIED,
+    USER_BURST, USER_LIMITED, VERIFIED_TTL_SECONDS, AdmissionControl, TokenBucket
+)
+
+
+def test_token_bucket_burst_then_refill():
+    bucket = TokenBucket(3, 1.0)
+    assert [bucket.take(100.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.take(101.0)
+    assert not bucket.take(101.0)
+    # Refill never goes past capacity
+    bucket.refill(1000.0)
+    assert bucket.tokens == 3
+
+
+def test_token_bucket_reserve_goes_into_debt():
+    bucket = TokenBucket(1, 0.5)
+    assert bucket.reserve(0.0, max_wait=10) == 0.0
+    assert bucket.reserve(0.0, max_wait=10) == 2.0
+    assert bucket.reserve(0.0, max_wait=10) == 4.0
+    # Too long a wait is declined without taking anything
+    assert bucket.reserve(0.0, max_wait=5) is None
+    assert bucket.tokens == -2
+
+
+def test_user_limit():
+    admission = AdmissionControl()
+    decisions = [admission.admit(1, f'bin-{i}', now=100.0)[0] for i in range(USER_BURST + 1)]
+    assert decisions == [ADMIT] * USER_BURST + [USER_LIMITED]
+
+
+def test_bin_limit():
+    admission = AdmissionControl()
+    decisions = [admission.admit(user, 'bin-1', now=100.0)[0] for user in range(BIN_BURST + 1)]
+    assert decisions == [ADMIT] * BIN_BURST + [BIN_LIMITED]
+
+
+def test_group_chat_limit_spans_members():
+    admission = AdmissionControl()
+    decisions = [admission.admit(user, f'bin-{user}', now=100.0, chat_id=-500)[0] for user in range(CHAT_BURST + 1)]
+    assert decisions == [ADMIT] * CHAT_BURST + [CHAT_LIMITED]
+
+
+def test_private_chat_uses_only_the_user_bucket():
+    admission = AdmissionControl()
+    admission.admit(7, 'bin-1', now=100.0, chat_id=7)
+    assert 7 not in admission.chats
+
+
+def test_recent_verdict_is_reused_until_ttl():
+    admission = AdmissionControl()
+    verdict = object()
+    admission.record_verdict('bin-1', verdict, now=100.0)
+    assert admission.admit(1, 'bin-1', now=150.0) == (RECENTLY_VERIFIED, verdict)
+    assert admission.admit(2, 'bin-1', now=100.0 + VERIFIED_TTL_SECONDS) == (ADMIT, None)
+
+
+def test_least_recently_seen_keys_are_forgotten():
+    admission = AdmissionControl(max_keys=2)
+    for user in (1, 2, 3):
+        admission.admit(user, 'bin', now=100.0)
+    assert list(admission.users) == [2, 3]
+
+
+def test_acquire_ai_declines_when_wait_is_too_long():
+    admission = AdmissionControl()
+    admission.ai = TokenBucket(AI_BURST, 1e-6)
+    results = asyncio.run(_acquire(admission, AI_BURST + 1))
+    assert results == [True] * AI_BURST + [False]
+    assert admission.counts['ai_declined'] == 1
+
+
+async def _acquire(admission, times):
+    return [await admission.acquire_ai() for _ in range(times)]
+
+
+def test_refund_gives_the_bin_its_turn_back():
+    admission = AdmissionControl()
+    for user in range(BIN_BURST):
+        assert admission.admit(user, 'bin-1', now=100.0)[0] == ADMIT
+    # The last admitted report was declined by the AI budget
+    admission.refund('bin-1')
+    assert admission.admit(99, 'bin-1', now=100.0)[0] == ADMIT
+    assert admission.admit(98, 'bin-1', now=100.0)[0] == BIN_LIMITED
+    # Refunds never go past the burst
+    for _ in range(5):
+        admission.refund('bin-1')
+    assert admission.bins['bin-1'].tokens == BIN_BURST
+
+
+def test_limited_sender_is_told_once_per_window():
+    admission = AdmissionControl()
+    assert admission.should_notify(USER_LIMITED, 1, 'bin-1', now=100.0)
+    assert not admission.should_notify(USER_LIMITED, 1, 'bin-2', now=130.0)
+    assert admission.should_notify(USER_LIMITED, 2, 'bin-1', now=130.0)
+    assert admission.should_notify(USER_LIMITED, 1, 'bin-1', now=100.0 + LIMITED_NOTICE_SECONDS)
+    assert admission.should_notify(CHAT_LIMITED, 1, 'bin-1', chat_id=-500, now=100.0)
+    assert not admission.should_notify(CHAT_LIMITED, 3, 'bin-9', chat_id=-500, now=101.0)
+    assert admission.counts['notice_suppressed'] == 2
+
+
+def test_acquire_ai_charges_every_image():
+    admission = AdmissionControl()
+    admission.ai = TokenBucket(AI_BURST, 1e-6)
+    assert asyncio.run(admission.acquire_ai(AI_BURST - 1))
+    assert asyncio.run(admission.acquire_ai(1))
+    assert not asyncio.run(admission.acquire_ai(1))
@@ -0,0 +1,76 @@
+"""Unit tests for time-bucketed analytics aggregates"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from analytics_aggregates import AnalyticsAggregates
+from records import BinDetails
+
+TASHKENT = timezone(timedelta(hours=5))
+# 2025-10-09 14:30 local time
+NOW = datetime(2025, 10, 9, 14, 30, tzinfo=TASHKENT).timestamp()
+HOUR = 3600
+DAY = 86400
+
+
+@pytest.fixture
+def aggregates(tmp_path):
+    store = AnalyticsAggregates(str(tmp_path / 'analytics.sqlite3'))
+    yield store
+    store.close()
+
+
+def test_buckets_align_to_local_hours_and_midnight(aggregates):
+    assert aggregates.bucket_start(NOW, HOUR) == datetime(2025, 10, 9, 14, tzinfo=TASHKENT).timestamp()
+    assert aggregates.bucket_start(NOW, DAY) == datetime(2025, 10, 9, tzinfo=TASHKENT).timestamp()
+    # 23:30 UTC is already the next local day
+    late = datetime(2025, 10, 9, 23, 30, tzinfo=timezone.utc).timestamp()
+    assert aggregates.bucket_start(late, DAY) == datetime(2025, 10, 10, tzinfo=TASHKENT).timestamp()
+
+
+def test_query_merges_flushed_and_pending_values(aggregates):
+    aggregates.record_reading(7, {'temperature': 20.0, 'humidity': 50, 'timestamp': NOW})
+    assert aggregates.flush() == 2
+    aggregates.record_reading(7, {'temperature': 24.0, 'timestamp': NOW + 60})
+    [bucket] = aggregates.query('temperature', 7, NOW - HOUR, NOW + HOUR)
+    assert bucket == {'bucket': aggregates.bucket_start(NOW, HOUR), 'count': 2, 'sum': 44.0, 'avg': 22.0,
+                      'min': 20.0, 'max': 24.0}
+    assert aggregates.query('humidity', 7, NOW - HOUR, NOW + HOUR)[0]['count'] == 1
+
+
+def test_late_value_corrects_its_own_bucket(aggregates):
+    for offset in (0, HOUR, 2 * HOUR):
+        aggregates.add('temperature', 7, 20.0, NOW + offset)
+    aggregates.flush()
+    aggregates.add('temperature', 7, 30.0, NOW)
+    aggregates.flush()
+    rows = aggregates.query('temperature', 7, NOW - HOUR, NOW + 3 * HOUR)
+    assert [row['count'] for row in rows] == [2, 1, 1]
+    assert [row['max'] for row in rows] == [30.0, 20.0, 20.0]
+
+
+def test_hourly_buckets_roll_up_to_days(aggregates):
+    for hour in range(48):
+        aggregates.add('humidity', 7, hour, NOW + hour * HOUR)
+    aggregates.flush()
+    days = aggregates.query('humidity', 7, NOW - DAY, NOW + 3 * DAY, bucket_seconds=DAY)
+    assert [row['count'] for row in days] == [10, 24, 14]
+    assert sum(row['sum'] for row in days) == sum(range(48))
+    with pytest.raises(ValueError):
+        aggregates.query('bin_fill', 'Chilonzor', NOW - DAY, NOW, bucket_seconds=HOUR)
+
+
+def test_bots_sharing_a_database_see_each_others_series(tmp_path):
+    path = str(tmp_path / 'analytics.sqlite3')
+    first, second = AnalyticsAggregates(path), AnalyticsAggregates(path)
+    try:
+        first.record_bin_update(BinDetails('b1', toza_hudud='Chilonzor', fill_level=80), NOW)
+        first.flush()
+        second.record_bin_update(BinDetails('b2', toza_hudud='Chilonzor', fill_level=40), NOW)
+        second.flush()
+        [day] = first.query('bin_fill', 'Chilonzor', NOW - DAY, NOW + DAY)
+        assert (day['count'], day['avg']) == (2, 60.0)
+        assert second.keys('bin_fill') == ['Chilonzor']
+    finally:
+        first.close()
+        second.close()
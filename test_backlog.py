@@ -0,0 +1,59 @@
+"""Unit tests for draining the Telegram backlog through the journal"""
+import asyncio
+from datetime import datetime, timezone
+
+from telegram import Chat, Message, Update, User
+
+import backlog
+
+
+def make_update(update_id):
+    message = Message(update_id, datetime.now(timezone.utc), Chat(1, 'private'),
+                      from_user=User(1, 'citizen', False), text=f"message {update_id}")
+    return Update(update_id, message=message)
+
+
+class FakeBot:
+    """getUpdates with Telegram's semantics: an offset confirms every older update"""
+    def __init__(self, update_ids):
+        self.queue = [make_update(update_id) for update_id in update_ids]
+        self.offsets = []
+
+    async def delete_webhook(self, **kwargs):
+        pass
+
+    async def get_updates(self, offset=None, limit=100, **kwargs):
+        self.offsets.append(offset)
+        if offset is not None:
+            self.queue = [update for update in self.queue if update.update_id >= offset]
+        return self.queue[:limit]
+
+
+def test_drain_confirms_everything_and_journals_it(tmp_path):
+    journal = str(tmp_path / 'backlog.jsonl')
+    bot = FakeBot(range(1, 251))
+    updates = asyncio.run(backlog.drain_pending_updates(bot, journal))
+    assert [update.update_id for update in updates] == list(range(1, 251))
+    assert bot.queue == []
+    assert len(open(journal).read().splitlines()) == 250
+
+
+def test_unfinished_replay_is_replayed_after_a_restart(tmp_path):
+    journal = str(tmp_path / 'backlog.jsonl')
+    asyncio.run(backlog.drain_pending_updates(FakeBot(range(1, 11)), journal))
+    # Crashed before clear_journal; Telegram has nothing queued any more
+    updates = asyncio.run(backlog.drain_pending_updates(FakeBot([]), journal))
+    assert [update.update_id for update in updates] == list(range(1, 11))
+    assert updates[0].message.text == 'message 1'
+    backlog.clear_journal(journal)
+    assert asyncio.run(backlog.drain_pending_updates(FakeBot([]), journal)) == []
+
+
+def test_journaled_but_unconfirmed_updates_are_not_duplicated(tmp_path):
+    journal = str(tmp_path / 'backlog.jsonl')
+    asyncio.run(backlog.drain_pending_updates(FakeBot(range(1, 11)), journal))
+    # Crashed after journaling 6..10 but before confirming them
+    bot = FakeBot(range(6, 16))
+    updates = asyncio.run(backlog.drain_pending_updates(bot, journal))
+    assert [update.update_id for update in updates] == list(range(1, 16))
+    assert bot.queue == []
@@ -0,0 +1,80 @@
+"""Unit tests for bulk import row validation"""
+import pytest
+
+from bulk_import import (
+    BulkImporter, RowError, bin_payload, device_payload, driver_payload, idempotency_key, read_rows, truck_payload
+)
+
+
+def test_bin_row_from_csv_cells():
+    row = {'address': ' Navoiy 12 ', 'lat': '41.31', 'lng': '69.24', 'toza_hudud': '1-sonli Toza Hudud',
+           'fillLevel': '100', 'fill_rate': '', 'camera_url': ''}
+    assert bin_payload(row, organization=3) == {
+        'address': 'Navoiy 12', 'location': {'lat': 41.31, 'lng': 69.24}, 'toza_hudud': '1-sonli Toza Hudud',
+        'fill_level': 100.0, 'is_full': True, 'organization_id': 3,
+    }
+
+
+def test_bin_location_from_nested_json():
+    row = {'address': 'Navoiy 12', 'location': '{"lat": 41.31, "lng": 69.24}'}
+    assert bin_payload(row)['location'] == {'lat': 41.31, 'lng': 69.24}
+    assert bin_payload(row)['fill_level'] == 0
+
+
+@pytest.mark.parametrize('validator, row, message', [
+    (bin_payload, {'lat': 41, 'lng': 69}, 'Missing address'),
+    (bin_payload, {'address': 'a', 'lat': 41}, 'Missing location'),
+    (bin_payload, {'address': 'a', 'lat': 91, 'lng': 69}, 'lat out of range'),
+    (bin_payload, {'address': 'a', 'lat': 41, 'lng': 69, 'fill_level': 'half'}, 'fill_level is not a number'),
+    (bin_payload, {'address': 'a', 'lat': 41, 'lng': 69, 'toza_hudud': '3-sonli'}, 'Invalid toza_hudud'),
+    (truck_payload, {'driver_name': 'A', 'plate_number': '01A', 'lat': 41, 'lng': 69, 'status': 'PARKED'},
+     'Invalid status'),
+    (driver_payload, {'driver_name': 'A', 'plate_number': '01A', 'lat': 41, 'lng': 69, 'login': 'a',
+                      'password': 'p'}, 'Missing organization'),
+    (device_payload, {'device_id': 'esp-1', 'room': 1, 'boiler': 2}, 'room or a boiler'),
+])
+def test_invalid_rows_are_rejected_with_a_reason(validator, row, message):
+    with pytest.raises(RowError, match=message):
+        validator(row)
+
+
+def test_truck_and_device_defaults():
+    truck = truck_payload({'driverName': 'A', 'plateNumber': '01A', 'latitude': 41, 'lon': 69})
+    assert truck['status'] == 'IDLE' and 'fuel_level' not in truck
+    device = device_payload({'deviceId': 4201, 'is_active': 'No'})
+    assert device == {'device_id': '4201', 'device_type': 'BOTH', 'is_active': False}
+
+
+def test_idempotency_key_ignores_field_order():
+    assert idempotency_key('bins', {'a': 1, 'b': 2}) == idempotency_key('bins', {'b': 2, 'a': 1})
+    assert idempotency_key('bins', {'a': 1}) != idempotency_key('trucks', {'a': 1})
+
+
+def test_csv_rows_are_validated_with_line_numbers(tmp_path, monkeypatch):
+    path = tmp_path / 'bins.csv'
+    path.write_text(
+        "\ufeffaddress,lat,lng,fill_level\n"
+        "Navoiy 12,41.31,69.24,10\n"
+        "Navoiy 14,41.32,,20\n"
+        "Navoiy 12,41.31,69.24,30\n"
+        "Navoiy 16,41.33,69.26,\n",
+        encoding='utf-8'
+    )
+    importer = BulkImporter('http://api', {}, 'bins', dry_run=True)
+    monkeypatch.setattr(importer, 'load_existing', lambda: importer.existing.update({'Navoiy 16': 7}))
+    created, updated, errors = importer.run(read_rows(str(path)))
+    assert (created, updated) == (1, 1)
+    assert errors == [
+        (3, 'Navoiy 14', 'Missing location (lat/lng)'),
+        (4, 'Navoiy 12', 'Duplicate address in input'),
+    ]
+
+    importer.write_errors(str(tmp_path / 'bins.errors.csv'))
+    assert (tmp_path / 'bins.errors.csv').read_text().splitlines()[0] == 'line,address,error'
+
+
+def test_unknown_kind_and_format():
+    with pytest.raises(ValueError):
+        BulkImporter('http://api', {}, 'boilers')
+    with pytest.raises(RuntimeError):
+        list(read_rows('bins.txt'))
@@ -0,0 +1,121 @@
+"""Unit tests for CCTV sweep scheduling and fill-rate learning"""
+import asyncio
+from io import BytesIO
+
+import pytest
+
+import cctv_scheduler
+from cctv_scheduler import (
+    CCTV_DEFAULT_FILL_RATE, CCTV_MIN_INTERVAL_SECONDS, CCTV_STALE_HOURS, CCTVScheduler, Camera
+)
+from records import AIAnalysis, BinDetails
+
+NOW = 1_760_000_000.0
+HOUR = 3600
+
+
+def scheduler(analyze_batch=None):
+    return CCTVScheduler('http://api', lambda: {'Authorization': 'Token x'}, analyze_batch)
+
+
+def camera(bin_id, level=0.0, analysed_hours_ago=None, checked_hours_ago=None, rate=CCTV_DEFAULT_FILL_RATE):
+    result = Camera(BinDetails(bin_id, camera_url=f"http://cam/{bin_id}.jpg"), level, rate)
+    if analysed_hours_ago is not None:
+        result.analysed_at = NOW - analysed_hours_ago * HOUR
+    if checked_hours_ago is not None:
+        result.checked_at = NOW - checked_hours_ago * HOUR
+    return result
+
+
+def analysis(fill_level, is_full=False):
+    return AIAnalysis(True, is_full, fill_level, 90)
+
+
+def test_due_orders_by_predicted_fill_and_staleness():
+    cctv = scheduler()
+    cameras = [
+        camera('fresh-empty', level=10, analysed_hours_ago=0.5),
+        camera('fresh-full', level=90, analysed_hours_ago=0.5),
+        camera('stale', level=10, analysed_hours_ago=CCTV_STALE_HOURS),
+        camera('fast', level=10, analysed_hours_ago=1, rate=100),
+        camera('never'),
+    ]
+    cctv.cameras = {c.bin.id: c for c in cameras}
+    order = [c.bin.id for c in cctv.due(NOW)]
+    # Priorities: stale 0.22 + 1, fast 1.0 (fill capped) + 1/6, never (counts as stale) 0.12 + 1,
+    # fresh-full 0.91 + 1/12, fresh-empty 0.11 + 1/12
+    assert order == ['stale', 'fast', 'never', 'fresh-full', 'fresh-empty']
+    assert [c.bin.id for c in cctv.due(NOW, count=1)] == ['stale']
+
+
+def test_recently_checked_cameras_are_not_due():
+    cctv = scheduler()
+    recent = camera('recent', level=100, analysed_hours_ago=1)
+    recent.checked_at = NOW - CCTV_MIN_INTERVAL_SECONDS + 1
+    cctv.cameras = {'recent': recent, 'other': camera('other', checked_hours_ago=1)}
+    assert [c.bin.id for c in cctv.due(NOW)] == ['other']
+
+
+def test_learn_smooths_rate_and_keeps_it_across_emptying():
+    cctv = scheduler()
+    cam = camera('b1')
+    cctv.learn(cam, analysis(20), NOW)
+    # The first analysis only sets the baseline
+    assert (cam.level, cam.rate, cam.analysed_at) == (20, CCTV_DEFAULT_FILL_RATE, NOW)
+    cctv.learn(cam, analysis(40), NOW + 2 * HOUR)
+    assert cam.rate == pytest.approx(0.5 * CCTV_DEFAULT_FILL_RATE + 0.5 * 10)
+    rate = cam.rate
+    cctv.learn(cam, analysis(5), NOW + 3 * HOUR)
+    assert (cam.level, cam.rate) == (5, rate)
+
+
+def test_apply_bins_keeps_learned_state_unless_the_camera_changes():
+    cctv = scheduler()
+    cctv.apply_bins([
+        {'id': 1, 'camera_url': 'http://cam/1.jpg', 'fill_level': 30, 'fill_rate': 4},
+        {'id': 2, 'camera_url': 'http://cam/2.jpg'},
+        {'id': 3, 'camera_url': '  '},
+    ])
+    assert sorted(cctv.cameras) == ['1', '2']
+    assert (cctv.cameras['1'].level, cctv.cameras['1'].rate) == (30, 4)
+    cctv.learn(cctv.cameras['1'], analysis(60), NOW)
+    cctv.learn(cctv.cameras['2'], analysis(60), NOW)
+    cctv.apply_bins([
+        {'id': 1, 'camera_url': 'http://cam/1.jpg', 'fill_level': 30},
+        {'id': 2, 'camera_url': 'http://cam/2-new.jpg'},
+    ])
+    assert cctv.cameras['1'].level == 60
+    assert (cctv.cameras['2'].level, cctv.cameras['2'].analysed_at) == (0, 0.0)
+
+
+def jpeg(shade: int, box=(0, 0, 64, 64)):
+    """A flat frame with one brighter square"""
+    image = cctv_scheduler.Image.new('L', (128, 128), shade)
+    image.paste(shade + 50, box)
+    output = BytesIO()
+    image.save(output, 'JPEG')
+    return output.getvalue()
+
+
+@pytest.mark.skipif(cctv_scheduler.np is None or cctv_scheduler.Image is None, reason="needs numpy and Pillow")
+def test_sweep_sends_only_changed_frames_to_the_ai(monkeypatch):
+    batches = []
+
+    async def analyze_batch(images):
+        batches.append(len(images))
+        return [analysis(50) for _ in images]
+
+    cctv = scheduler(analyze_batch)
+    cctv.cameras = {c.bin.id: c for c in (camera('a'), camera('b'))}
+    frames = {'a': jpeg(40), 'b': jpeg(40)}
+    monkeypatch.setattr(cctv, 'fetch_snapshot', lambda cam: frames[cam.bin.id])
+    monkeypatch.setattr(cctv, 'upload', lambda cam, image_bytes, result: True)
+
+    assert asyncio.run(cctv.sweep(NOW)) == (2, 0, 2)
+    # Camera b now shows a different scene, a only got brighter overall
+    frames['a'], frames['b'] = jpeg(60), jpeg(40, box=(64, 64, 128, 128))
+    later = NOW + CCTV_MIN_INTERVAL_SECONDS
+    assert asyncio.run(cctv.sweep(later)) == (2, 1, 1)
+    assert batches == [2, 1]
+    assert cctv.cameras['a'].analysed_at == NOW
+    assert cctv.cameras['a'].checked_at == later
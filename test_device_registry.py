@@ -0,0 +1,82 @@
+"""Unit tests for the cached IoT device registry"""
+import device_registry
+from device_registry import REGISTRY_MISS_REFRESH_SECONDS, DeviceRegistry
+
+NOW = 1_760_000_000.0
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, devices=None, headers=None):
+        self.status_code = status_code
+        self.devices = devices
+        self.headers = headers or {}
+        self.text = ''
+
+    def json(self):
+        return {'results': self.devices}
+
+
+class FakeAPI:
+    """Stands in for requests.get, answering with queued responses"""
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, url, headers, **kwargs):
+        self.calls.append(headers)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def registry(monkeypatch, *responses):
+    api = FakeAPI(*responses)
+    monkeypatch.setattr(device_registry.requests, 'get', api)
+    return DeviceRegistry('http://api', lambda: {'Authorization': 'Token x'}), api
+
+
+def test_every_device_is_accepted_until_the_first_load(monkeypatch):
+    devices, _ = registry(monkeypatch, ConnectionError('down'))
+    assert devices.is_known('anything')
+    assert not devices.refresh()
+    assert devices.is_known('anything')
+
+
+def test_refresh_loads_and_applies_changes(monkeypatch):
+    devices, _ = registry(
+        monkeypatch,
+        FakeResponse(devices=[{'device_id': 'a', 'room': 1}, {'device_id': 'b'}, {'name': 'no id'}]),
+        FakeResponse(devices=[{'device_id': 'b'}, {'device_id': 'c'}]),
+    )
+    assert devices.refresh()
+    assert devices.is_known('a') and not devices.is_known('c')
+    assert devices.get('a') == {'device_id': 'a', 'room': 1}
+    assert devices.refresh()
+    assert sorted(devices.devices) == ['b', 'c']
+
+
+def test_conditional_refresh_keeps_cache_on_304(monkeypatch):
+    devices, api = registry(
+        monkeypatch,
+        FakeResponse(devices=[{'device_id': 'a'}], headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Sep 2025'}),
+        FakeResponse(304),
+        FakeResponse(500),
+    )
+    devices.refresh()
+    assert devices.refresh()
+    assert api.calls[1]['If-None-Match'] == '"v1"'
+    assert api.calls[1]['If-Modified-Since'] == 'Mon, 01 Sep 2025'
+    assert not devices.refresh()
+    assert devices.is_known('a')
+
+
+def test_refresh_on_miss_is_rate_limited(monkeypatch):
+    devices, _ = registry(monkeypatch)
+    clock = [NOW]
+    monkeypatch.setattr(device_registry.time, 'time', lambda: clock[0])
+    assert devices.should_refresh_on_miss()
+    clock[0] += REGISTRY_MISS_REFRESH_SECONDS - 1
+    assert not devices.should_refresh_on_miss()
+    clock[0] += 1
+    assert devices.should_refresh_on_miss()
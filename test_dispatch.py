@@ -0,0 +1,136 @@
+"""Unit tests for the truck GridIndex and TruckDispatcher"""
+import random
+
+import dispatch
+from dispatch import GridIndex, TruckDispatcher, haversine_km
+from records import BinDetails, Truck
+
+# Around Tashkent, with a spread of a few cells to tens of km
+CENTER = (41.31, 69.28)
+
+
+def random_points(rng, count, spread):
+    return {
+        f'truck-{i}': (CENTER[0] + rng.uniform(-spread, spread), CENTER[1] + rng.uniform(-spread, spread))
+        for i in range(count)
+    }
+
+
+def brute_nearest(points, lat, lng, accept=None, max_km=None):
+    candidates = [
+        (haversine_km(lat, lng, p_lat, p_lng), item_id)
+        for item_id, (p_lat, p_lng) in points.items()
+        if accept is None or accept(item_id)
+    ]
+    if not candidates:
+        return None
+    km, item_id = min(candidates)
+    if max_km is not None and km > max_km:
+        return None
+    return item_id, km
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(35)
+    for spread in (0.005, 0.05, 0.5):
+        points = random_points(rng, 200, spread)
+        index = GridIndex()
+        for item_id, (lat, lng) in points.items():
+            index.update(item_id, lat, lng)
+        for _ in range(50):
+            lat = CENTER[0] + rng.uniform(-spread * 1.5, spread * 1.5)
+            lng = CENTER[1] + rng.uniform(-spread * 1.5, spread * 1.5)
+            expected = brute_nearest(points, lat, lng)
+            found = index.nearest(lat, lng)
+            assert found[1] == expected[1]
+
+
+def test_nearest_with_filter_and_limit():
+    rng = random.Random(36)
+    points = random_points(rng, 100, 0.2)
+    index = GridIndex()
+    for item_id, (lat, lng) in points.items():
+        index.update(item_id, lat, lng)
+    accept = lambda item_id: int(item_id.split('-')[1]) % 3 == 0
+    for _ in range(30):
+        lat, lng = CENTER[0] + rng.uniform(-0.2, 0.2), CENTER[1] + rng.uniform(-0.2, 0.2)
+        assert index.nearest(lat, lng, accept=accept) == brute_nearest(points, lat, lng, accept=accept)
+        assert index.nearest(lat, lng, max_km=2) == brute_nearest(points, lat, lng, max_km=2)
+
+
+def test_within_matches_brute_force():
+    rng = random.Random(37)
+    points = random_points(rng, 300, 0.1)
+    index = GridIndex()
+    for item_id, (lat, lng) in points.items():
+        index.update(item_id, lat, lng)
+    for radius_km in (0.5, 3, 10):
+        found = {item_id for item_id, _ in index.within(*CENTER, radius_km)}
+        expected = {item_id for item_id, (lat, lng) in points.items() if haversine_km(*CENTER, lat, lng) <= radius_km}
+        assert found == expected
+
+
+def test_moves_and_removals():
+    index = GridIndex()
+    index.update('a', 41.30, 69.20)
+    index.update('b', 41.40, 69.40)
+    # Moving across cells leaves no stale entry behind
+    index.update('a', 41.45, 69.45)
+    assert index.nearest(41.30, 69.20)[0] == 'b'
+    assert sum(len(members) for members in index.cells.values()) == 2
+    index.remove('b')
+    assert 'b' not in index and len(index) == 1
+    assert index.nearest(41.30, 69.20)[0] == 'a'
+    index.remove('a')
+    assert index.nearest(41.30, 69.20) is None
+    assert index.cells == {}
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ''
+
+
+def fleet(status='IDLE', location=(41.30, 69.20)):
+    return [Truck('t1', toza_hudud='Chilonzor', location=location, status=status)]
+
+
+def test_completed_pickup_survives_fleet_refresh(monkeypatch):
+    saved = []
+    monkeypatch.setattr(dispatch.requests, 'patch',
+                        lambda url, json, **kwargs: saved.append((url, json)) or FakeResponse(503))
+    dispatcher = TruckDispatcher('http://api', lambda: {})
+    dispatcher.apply(fleet())
+    full_bin = BinDetails('b1', toza_hudud='Chilonzor', location=(41.301, 69.201))
+    truck, _ = dispatcher.assign(full_bin)
+    assert dispatcher.push_assignment(truck) is False
+    dispatcher.update_position('t1', 41.31, 69.21)
+    assert dispatcher.complete('b1') == 't1'
+
+    # The IDLE save failed, so the next refresh still lists the truck as BUSY at its old position
+    assert dispatcher.flush_statuses() == 0
+    dispatcher.apply(fleet(status='BUSY'))
+    assert dispatcher.trucks['t1'].status == 'IDLE'
+    assert dispatcher.trucks['t1'].location == (41.31, 69.21)
+    assert dispatcher.nearest_idle_truck(full_bin)[0].id == 't1'
+
+    monkeypatch.setattr(dispatch.requests, 'patch',
+                        lambda url, json, **kwargs: saved.append((url, json)) or FakeResponse(200))
+    assert dispatcher.flush_statuses() == 1
+    assert dispatcher.pending_statuses == {}
+    assert saved[-1] == ('http://api/trucks/t1/', {'status': 'IDLE'})
+    # Once saved, the platform is authoritative again
+    dispatcher.apply(fleet(status='OFFLINE'))
+    assert dispatcher.nearest_idle_truck(full_bin) is None
+
+
+def test_new_assignment_drops_queued_idle():
+    dispatcher = TruckDispatcher('http://api', lambda: {})
+    dispatcher.apply(fleet())
+    dispatcher.assign(BinDetails('b1', toza_hudud='Chilonzor', location=(41.30, 69.20)))
+    dispatcher.complete('b1')
+    assert dispatcher.pending_statuses == {'t1': 'IDLE'}
+    dispatcher.assign(BinDetails('b2', toza_hudud='Chilonzor', location=(41.30, 69.20)))
+    assert dispatcher.pending_statuses == {}
+    assert dispatcher.trucks['t1'].status == 'BUSY'
@@ -0,0 +1,70 @@
+"""Unit tests for vectorized fill-rate forecasting"""
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from fill_forecast import PICKUP_LEAD_HOURS, fit_fill_rates, forecast, pack_trends, pickup_schedule
+
+NOW = 1_760_000_000.0
+
+
+def iso(hours_ago, naive=False):
+    parsed = datetime.fromtimestamp(NOW - hours_ago * 3600, tz=timezone.utc)
+    return (parsed.replace(tzinfo=None) if naive else parsed).isoformat()
+
+
+def waste_bin(bin_id, levels, **fields):
+    """levels: (hours_ago, fill level) pairs"""
+    trend = [{'timestamp': iso(hours), 'fillLevel': level} for hours, level in levels]
+    return {'id': bin_id, 'toza_hudud': 'Chilonzor', 'fill_level': 0, 'trend': trend, **fields}
+
+
+def test_linear_fill_gives_exact_rate_and_time_to_full():
+    result = forecast([waste_bin(1, [(10, 30), (5, 45), (0, 60)])], now=NOW)
+    assert result['fitted'][0]
+    assert result['rate'][0] == pytest.approx(3.0)
+    assert result['level'][0] == pytest.approx(60.0)
+    assert result['hours_to_full'][0] == pytest.approx(40 / 3)
+
+
+def test_events_before_the_last_emptying_are_ignored():
+    levels = [(30, 10), (20, 90), (10, 5), (5, 15), (0, 25)]
+    rate, level_now = fit_fill_rates(*pack_trends([waste_bin(1, levels)])[2:4], now=NOW)
+    assert rate[0] == pytest.approx(2.0)
+    assert level_now[0] == pytest.approx(25.0)
+
+
+def test_unsorted_trend_and_naive_timestamps_are_handled():
+    data = waste_bin(1, [(0, 60), (10, 30), (5, 45)])
+    data['trend'][1]['timestamp'] = iso(10, naive=True)
+    _, _, times, levels, *_ = pack_trends([data], max_points=4)
+    assert np.isnan(times[0, 0])
+    assert times[0, 1:].tolist() == [NOW - 36000, NOW - 18000, NOW]
+    assert levels[0, 1:].tolist() == [30, 45, 60]
+
+
+def test_bins_without_history_fall_back_to_stored_rate():
+    bins = [
+        waste_bin(1, [], fill_level=50, fill_rate=5),
+        waste_bin(2, [(0, 40)], fill_level=40),
+        waste_bin(3, [], fill_level=70, is_full=True),
+    ]
+    result = forecast(bins, now=NOW)
+    assert not result['fitted'].any()
+    assert result['hours_to_full'].tolist() == [10.0, np.inf, 0.0]
+
+
+def test_pickup_schedule_is_ordered_and_bounded_by_horizon():
+    bins = [
+        waste_bin('slow', [(10, 0), (0, 10)]),
+        waste_bin('soon', [(10, 40), (0, 90)]),
+        waste_bin('later', [(10, 20), (0, 50)]),
+    ]
+    schedule = pickup_schedule(forecast(bins, now=NOW), now=NOW, horizon_hours=24)
+    assert [entry['bin_id'] for entry in schedule] == ['soon', 'later']
+    soon = schedule[0]
+    # Due in 2 h, so the pickup lead time is capped at now
+    assert soon['full_at'] == iso(-2)
+    assert soon['pickup_at'] == datetime.fromtimestamp(NOW, tz=timezone.utc).isoformat()
+    assert schedule[1]['pickup_at'] == iso(-(50 / 3 - PICKUP_LEAD_HOURS))
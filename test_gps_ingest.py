@@ -0,0 +1,126 @@
+"""Unit tests for GPS fix processing and geofence pickups"""
+import dispatch
+import gps_ingest
+from dispatch import TruckDispatcher
+from gps_ingest import PICKUP_DWELL_SECONDS, GPSIngestor
+from records import BinDetails, Truck
+
+NOW = 1_760_000_000.0
+BIN = BinDetails('b1', toza_hudud='Chilonzor', location=(41.3000, 69.2000), is_full=True)
+
+
+class FakeResponse:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.text = ''
+
+
+class FakeSession:
+    """requests.Session stand-in recording PATCH calls"""
+    calls = []
+
+    def __init__(self):
+        self.headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def patch(self, url, json, **kwargs):
+        self.calls.append((url, json))
+        return FakeResponse()
+
+
+def dwell(ingestor, truck_id, lat, lng, start, seconds, step=5):
+    for ts in range(int(start), int(start + seconds) + 1, step):
+        ingestor.process_fix(truck_id, ts, lat, lng, now=ts)
+
+
+def test_confirmed_pickup_saves_idle_truck(monkeypatch):
+    FakeSession.calls = []
+    saved = []
+    monkeypatch.setattr(gps_ingest.requests, 'Session', FakeSession)
+    monkeypatch.setattr(dispatch.requests, 'patch', lambda url, json, **kwargs: saved.append((url, json)) or FakeResponse())
+    dispatcher = TruckDispatcher('http://api', lambda: {'Authorization': 'Token x'})
+    dispatcher.apply([Truck('t1', toza_hudud='Chilonzor', location=(41.31, 69.21))])
+    dispatcher.assign(BIN)
+    ingestor = GPSIngestor('http://api', lambda: {'Authorization': 'Token x'}, dispatcher)
+    ingestor.geofences.add_bin(BIN)
+
+    dwell(ingestor, 't1', 41.3000, 69.2000, NOW, PICKUP_DWELL_SECONDS + 10)
+    assert 'b1' in ingestor.pending_pickups
+    assert dispatcher.pending_statuses == {'t1': 'IDLE'}
+
+    ingestor.flush()
+    assert ('http://api/waste-bins/b1/update-image/', {'is_full': False, 'fill_level': 0}) in FakeSession.calls
+    assert saved == [('http://api/trucks/t1/', {'status': 'IDLE'})]
+    assert not ingestor.has_pending()
+
+
+def ingestor_with_bin():
+    ingestor = GPSIngestor('http://api', lambda: {'Authorization': 'Token x'})
+    ingestor.geofences.add_bin(BIN)
+    return ingestor
+
+
+def test_short_stop_is_not_a_pickup():
+    ingestor = ingestor_with_bin()
+    dwell(ingestor, 't1', 41.3000, 69.2000, NOW, PICKUP_DWELL_SECONDS - 10)
+    assert not ingestor.pending_pickups
+    assert 'b1' in ingestor.geofences
+
+
+def test_leaving_the_exit_radius_restarts_the_dwell():
+    ingestor = ingestor_with_bin()
+    dwell(ingestor, 't1', 41.3000, 69.2000, NOW, 30)
+    # About 110 m north, outside the exit radius
+    dwell(ingestor, 't1', 41.3010, 69.2000, NOW + 35, 30)
+    assert 'b1' not in ingestor.tracks['t1'].inside
+    dwell(ingestor, 't1', 41.3000, 69.2000, NOW + 70, 30)
+    assert not ingestor.pending_pickups
+
+
+def test_waiting_between_enter_and_exit_radius_keeps_the_dwell():
+    ingestor = ingestor_with_bin()
+    dwell(ingestor, 't1', 41.3000, 69.2000, NOW, 20)
+    # About 50 m away: too far to enter, close enough to stay inside
+    dwell(ingestor, 't1', 41.30045, 69.2000, NOW + 25, PICKUP_DWELL_SECONDS)
+    assert ingestor.pending_pickups['b1'][0] == 't1'
+
+
+def test_rejects_missing_stale_and_out_of_order_fixes():
+    ingestor = GPSIngestor('http://api', lambda: {})
+    assert not ingestor.process_fix('t1', NOW, 0.0, 0.0, now=NOW)
+    assert not ingestor.process_fix('t1', NOW, 91.0, 69.2, now=NOW)
+    assert not ingestor.process_fix('t1', NOW - gps_ingest.MAX_FIX_AGE_SECONDS - 1, 41.3, 69.2, now=NOW)
+    assert not ingestor.process_fix('t1', NOW + gps_ingest.MAX_FIX_AHEAD_SECONDS + 1, 41.3, 69.2, now=NOW)
+    assert ingestor.process_fix('t1', NOW, 41.3, 69.2, now=NOW)
+    assert not ingestor.process_fix('t1', NOW - 5, 41.3, 69.2, now=NOW)
+    assert ingestor.metrics['stale'] == 2
+    assert ingestor.metrics['rejected'] == 3
+
+
+def test_single_jump_is_rejected_but_a_consistent_one_reanchors():
+    ingestor = GPSIngestor('http://api', lambda: {})
+    ingestor.process_fix('t1', NOW, 41.3000, 69.2000, now=NOW)
+    # About 11 km in 5 s
+    assert not ingestor.process_fix('t1', NOW + 5, 41.4000, 69.2000, now=NOW + 5)
+    assert ingestor.tracks['t1'].lat == 41.3000
+
+    for i in range(2, gps_ingest.REANCHOR_AFTER_REJECTS + 1):
+        accepted = ingestor.process_fix('t1', NOW + 5 * i, 41.4000, 69.2000, now=NOW + 5 * i)
+    assert accepted
+    assert ingestor.metrics['reanchored'] == 1
+    state = ingestor.tracks['t1']
+    assert (state.lat, state.lng, state.rejects) == (41.4000, 69.2000, 0)
+
+
+def test_track_frames_round_trip():
+    fixes = [(int(NOW), 41.300001, 69.200001), (int(NOW) + 5, 41.300101, 69.200201)]
+    truck_id, decoded = gps_ingest.decode_payload(gps_ingest.encode_track('t1', fixes))
+    assert truck_id == 't1'
+    assert [ts for ts, _, _ in decoded] == [ts for ts, _, _ in fixes]
+    for (_, lat, lng), (_, dlat, dlng) in zip(fixes, decoded):
+        assert abs(lat - dlat) < 1e-6 and abs(lng - dlng) < 1e-6
@@ -0,0 +1,68 @@
+"""Unit tests for the image worker pool and its shared memory hand-off"""
+import asyncio
+import base64
+import hashlib
+import os
+from io import BytesIO
+from multiprocessing import shared_memory
+
+import pytest
+
+import image_workers
+from image_workers import IMAGE_SHM_MIN_BYTES, ImageWorkers, _encode_job, _hash_job, _take, _wrap
+
+SMALL = b'small payload'
+LARGE = os.urandom(IMAGE_SHM_MIN_BYTES + 1)
+
+needs_pillow = pytest.mark.skipif(image_workers.Image is None, reason="needs Pillow")
+
+
+def jpeg(size):
+    output = BytesIO()
+    image_workers.Image.new('RGB', size, (120, 60, 30)).save(output, 'JPEG')
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('data', [SMALL, LARGE], ids=['bytes', 'shm'])
+def test_jobs_round_trip_through_bytes_and_shared_memory(data):
+    ref = _wrap(data)
+    assert ref[0] == ('shm' if len(data) >= IMAGE_SHM_MIN_BYTES else 'bytes')
+    try:
+        assert _hash_job(ref) == hashlib.sha256(data).hexdigest()
+        result = _encode_job(ref)
+        assert _take(result, unlink=True) == base64.b64encode(data)
+    finally:
+        if ref[0] == 'shm':
+            _take(ref, unlink=True)
+
+
+def test_taken_result_blocks_are_unlinked():
+    ref = _wrap(LARGE)
+    assert _take(ref, unlink=True) == LARGE
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=ref[1])
+
+
+@needs_pillow
+def test_pool_encodes_hashes_and_resizes():
+    workers = ImageWorkers(workers=1)
+
+    async def run():
+        photo = jpeg((1600, 1200))
+        return (
+            await workers.encode(LARGE),
+            await workers.hash(SMALL),
+            await workers.resize(photo, 800),
+            await workers.resize(jpeg((100, 80)), 800),
+        )
+
+    try:
+        encoded, digest, resized, small = asyncio.run(run())
+    finally:
+        workers.shutdown()
+    assert encoded == base64.b64encode(LARGE)
+    assert digest == hashlib.sha256(SMALL).hexdigest()
+    with image_workers.Image.open(BytesIO(resized)) as image:
+        assert (image.format, image.size) == ('JPEG', (800, 600))
+    # JPEGs that already fit are passed through untouched
+    assert small == jpeg((100, 80))
@@ -0,0 +1,159 @@
+"""Unit tests for IoTMonitorBot reading ingestion, without the platform"""
+import asyncio
+import json
+
+import pytest
+
+import iot_monitor
+import sensor_frames
+
+
+@pytest.fixture
+def monitor(tmp_path, monkeypatch):
+    monkeypatch.setattr(iot_monitor, 'SENSOR_HISTORY_DIR', str(tmp_path / 'history'))
+    monkeypatch.setattr(iot_monitor, 'ANALYTICS_DB_PATH', str(tmp_path / 'analytics.db'))
+    bot = iot_monitor.IoTMonitorBot()
+    monkeypatch.setattr(bot.registry, 'is_known', lambda device_id: True)
+    forwarded = []
+
+    async def send(readings):
+        forwarded.extend(readings)
+        return [{'ok': True}] * len(readings)
+
+    async def send_one(reading):
+        forwarded.append(reading)
+        return {'ok': True}
+
+    monkeypatch.setattr(bot, 'send_sensor_batch_to_platform', send)
+    monkeypatch.setattr(bot, 'send_sensor_data_to_platform', send_one)
+    bot.forwarded = forwarded
+    yield bot
+    bot.history.close()
+    bot.analytics.close()
+
+
+def test_invalid_readings_never_reach_history_or_rollup(monitor):
+    valid = {'device_id': 'esp-1', 'temperature': 21.5, 'humidity': 40.0, 'sleep_seconds': 60, 'timestamp': 1000}
+    too_hot = {'device_id': 'esp-2', 'temperature': 900.0, 'humidity': 40.0, 'sleep_seconds': 60, 'timestamp': 1000}
+    too_wet = {'device_id': 'esp-3', 'temperature': 20.0, 'humidity': 140.0, 'sleep_seconds': 60, 'timestamp': 1000}
+    asyncio.run(monitor.process_sensor_batch([valid, too_hot, too_wet], source='test'))
+    assert monitor.metrics['invalid'] == 2
+    assert monitor.forwarded == [valid]
+    assert monitor.history.devices() == {'esp-1'}
+    assert 'esp-2' not in monitor.liveness.states
+
+
+async def http_request(monitor, raw: bytes):
+    """Send a raw request to the ingestion HTTP handler, returning (status, body)"""
+    listener = iot_monitor.IngestionListener(monitor)
+    server = await asyncio.start_server(listener.handle_http, '127.0.0.1', 0)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        writer.write(raw)
+        writer.write_eof()
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    await listener.stop()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+def post(body: bytes, *headers: str, path=iot_monitor.INGEST_HTTP_PATH):
+    lines = [f"POST {path} HTTP/1.1", "Host: localhost", *headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body
+
+
+READING = b'{"id": "0420101", "t": 21.7, "h": 43.9, "s": 2000, "ts": 1734680400}'
+
+
+def test_http_headers_are_case_insensitive_and_body_is_read_by_length(monitor):
+    raw = post(READING + b'trailing garbage', f"CONTENT-length:  {len(READING)}", "Content-Type: application/json")
+    assert asyncio.run(http_request(monitor, raw)) == (202, {'accepted': 1})
+    assert monitor.forwarded == [
+        {'device_id': '0420101', 'temperature': 21.7, 'humidity': 43.9, 'sleep_seconds': 2000, 'timestamp': 1734680400}
+    ]
+
+
+@pytest.mark.parametrize('headers, status', [
+    ((), 400),
+    (("Content-Length: 0",), 400),
+    (("Content-Length: abc",), 400),
+    ((f"Content-Length: {iot_monitor.INGEST_MAX_BODY_BYTES + 1}",), 413),
+])
+def test_http_rejects_missing_or_bad_content_length(monitor, headers, status):
+    assert asyncio.run(http_request(monitor, post(READING, *headers)))[0] == status
+    assert monitor.forwarded == []
+
+
+def test_http_unknown_path_and_short_body(monitor):
+    assert asyncio.run(http_request(monitor, post(READING, f"Content-Length: {len(READING)}", path='/nope')))[0] == 404
+    truncated = post(READING[:10], f"Content-Length: {len(READING)}")
+    assert asyncio.run(http_request(monitor, truncated))[0] == 400
+
+
+def test_http_token_header(monitor, monkeypatch):
+    monkeypatch.setattr(iot_monitor, 'INGEST_TOKEN', 's3cret')
+    length = f"Content-Length: {len(READING)}"
+    assert asyncio.run(http_request(monitor, post(READING, length)))[0] == 401
+    assert asyncio.run(http_request(monitor, post(READING, length, "X-Ingest-Token: wrong")))[0] == 401
+    assert asyncio.run(http_request(monitor, post(READING, length, "x-ingest-token:  s3cret ")))[0] == 202
+
+
+def udp_datagram(monitor, data: bytes):
+    async def receive():
+        listener = iot_monitor.IngestionListener(monitor)
+        iot_monitor.UDPIngestProtocol(listener).datagram_received(data, ('127.0.0.1', 5000))
+        await listener.stop()
+    asyncio.run(receive())
+
+
+def test_udp_token_line_is_checked_and_stripped(monitor, monkeypatch):
+    monkeypatch.setattr(iot_monitor, 'INGEST_TOKEN', 's3cret')
+    udp_datagram(monitor, READING)
+    udp_datagram(monitor, b'wrong\n' + READING)
+    assert monitor.metrics['udp_unauthorized'] == 2
+    frame = sensor_frames.encode_reading({'device_id': '0420102', 'temperature': 20.5, 'humidity': 41.0,
+                                          'sleep_seconds': 600})
+    udp_datagram(monitor, b's3cret\n' + frame)
+    assert [reading['device_id'] for reading in monitor.forwarded] == ['0420102']
+
+
+def test_decode_ingest_payload_formats(monitor):
+    gateway = b'{"gateway": "GW-1", "readings": [{"device_id": "a", "temperature": 20}, {"id": "b"}, 5]}'
+    assert [r['device_id'] for r in monitor.decode_ingest_payload(gateway)] == ['a']
+    assert monitor.decode_ingest_payload(b'[' + READING + b', ' + READING + b']')[1]['timestamp'] == 1734680400
+    assert monitor.decode_ingest_payload(b'{broken') == []
+    assert monitor.decode_ingest_payload(b'  \n') == []
+    frame = sensor_frames.encode_reading({'device_id': 'c', 'temperature': 19.0, 'humidity': None,
+                                          'sleep_seconds': None})
+    text = f"log line #SF{sensor_frames.encode_text_frame(frame)}".encode('ascii')
+    assert monitor.decode_ingest_payload(text)[0]['device_id'] == 'c'
+    assert monitor.normalize_sensor_payload({'id': 'd', 't': 'hot'}) is None
+
+
+def test_unknown_device_triggers_one_registry_refresh(monitor, monkeypatch):
+    answers = [[{'device_id': 'esp-1'}], [{'device_id': 'esp-1'}, {'device_id': 'esp-new'}]]
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        monitor.registry.apply(answers.pop(0))
+        monitor.registry.loaded = True
+        return True
+
+    # Use the real lookup instead of the fixture's accept-all one
+    monkeypatch.delattr(monitor.registry, 'is_known')
+    monkeypatch.setattr(monitor.registry, 'refresh', refresh)
+    monkeypatch.setattr(monitor.registry, 'last_miss_refresh', 0.0)
+    refresh()
+    readings = [{'device_id': 'esp-1'}, {'device_id': 'esp-new'}, {'device_id': 'esp-new'}]
+    assert asyncio.run(monitor.filter_known_devices(readings, source='test')) == readings
+    assert len(calls) == 2
+    # The early refresh is rate limited, so a second unknown device is simply dropped
+    assert asyncio.run(monitor.filter_known_devices([{'device_id': 'esp-other'}], source='test')) == []
+    assert len(calls) == 2
+    assert monitor.metrics['unknown_device'] == 1
@@ -0,0 +1,28 @@
+"""Unit tests for the listener token checks"""
+from listener_auth import is_local_host, strip_datagram_token, token_matches
+
+
+def test_is_local_host():
+    assert is_local_host('127.0.0.1')
+    assert is_local_host('::1')
+    assert is_local_host('localhost')
+    assert not is_local_host('0.0.0.0')
+    assert not is_local_host('192.168.1.10')
+    assert not is_local_host('example.org')
+
+
+def test_datagram_without_token_configured_is_passed_through():
+    assert strip_datagram_token(b'{"a": 1}') == b'{"a": 1}'
+
+
+def test_datagram_token_line():
+    assert strip_datagram_token(b'secret\n{"a": 1}', 'secret') == b'{"a": 1}'
+    assert strip_datagram_token(b'secret\r\nSF\x01\n', 'secret') == b'SF\x01\n'
+    assert strip_datagram_token(b'wrong\n{"a": 1}', 'secret') is None
+    assert strip_datagram_token(b'{"a": 1}', 'secret') is None
+
+
+def test_header_token():
+    assert token_matches(' secret ', 'secret')
+    assert not token_matches('', 'secret')
+    assert not token_matches('sécret', 'secret')
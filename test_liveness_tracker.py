@@ -0,0 +1,89 @@
+"""Unit tests for the liveness deadline heap"""
+from liveness_tracker import DEFAULT_SLEEP_SECONDS, DeviceLivenessTracker
+
+
+class FakeResponse:
+    status_code = 200
+    text = ''
+
+
+class FakeSession:
+    calls = []
+
+    def __init__(self):
+        self.headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def patch(self, url, json, **kwargs):
+        self.calls.append((url, json))
+        return FakeResponse()
+
+
+def tracker(resolve=None):
+    return DeviceLivenessTracker('http://api', lambda: {'Authorization': 'Token x'}, resolve)
+
+
+def test_deadline_follows_sleep_interval():
+    liveness = tracker()
+    assert liveness.deadline_for(1000, 600) == 1000 + 600 * 1.5 + 120
+    assert liveness.deadline_for(1000) == 1000 + DEFAULT_SLEEP_SECONDS * 1.5 + 120
+
+
+def test_overdue_devices_go_offline_once():
+    liveness = tracker()
+    liveness.record_check_in('fast', 60, timestamp=1000)
+    liveness.record_check_in('slow', 3600, timestamp=1000)
+    assert liveness.pending == {'fast': {'online': True, 'last_seen': 1000},
+                                'slow': {'online': True, 'last_seen': 1000}}
+    liveness.pending.clear()
+    assert liveness.pop_overdue(now=1000 + 60 * 1.5 + 119) == []
+    assert liveness.pop_overdue(now=1000 + 60 * 1.5 + 120) == ['fast']
+    assert liveness.pending == {'fast': {'online': False, 'last_seen': 1000}}
+    # Already offline: not reported again
+    assert liveness.pop_overdue(now=100_000) == ['slow']
+    assert liveness.pop_overdue(now=200_000) == []
+
+
+def test_check_in_supersedes_old_deadline():
+    liveness = tracker()
+    liveness.record_check_in('esp', 60, timestamp=1000)
+    liveness.record_check_in('esp', timestamp=1100)
+    # The first deadline is stale; the sleep interval is remembered
+    assert liveness.pop_overdue(now=1000 + 210) == []
+    assert liveness.next_deadline() == 1100 + 210
+    assert liveness.pop_overdue(now=1100 + 210) == ['esp']
+    assert len(liveness.heap) == 0
+
+
+def test_back_online_and_late_readings():
+    liveness = tracker()
+    liveness.record_check_in('esp', 60, timestamp=1000)
+    liveness.pop_overdue(now=5000)
+    liveness.pending.clear()
+    # A backlog reading older than the last one changes nothing
+    liveness.record_check_in('esp', 60, timestamp=900)
+    assert liveness.pending == {}
+    liveness.record_check_in('esp', 60, timestamp=6000)
+    assert liveness.pending == {'esp': {'online': True, 'last_seen': 6000}}
+
+
+def test_flush_keeps_transitions_of_unregistered_devices(monkeypatch):
+    import liveness_tracker
+    FakeSession.calls = []
+    monkeypatch.setattr(liveness_tracker.requests, 'Session', FakeSession)
+    known = {'esp-1': 11}
+    liveness = tracker(resolve=known.get)
+    liveness.record_check_in('esp-1', 60, timestamp=1000)
+    liveness.record_check_in('esp-2', 60, timestamp=1000)
+    assert liveness.flush() == 1
+    assert [url for url, _ in FakeSession.calls] == ['http://api/iot-devices/11/']
+    assert FakeSession.calls[0][1]['device_health']['is_online'] is True
+    assert set(liveness.pending) == {'esp-2'}
+    known['esp-2'] = 12
+    assert liveness.flush() == 1
+    assert liveness.pending == {}
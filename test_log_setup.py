@@ -0,0 +1,73 @@
+"""Unit tests for per-call-site log sampling and the queue handler"""
+import json
+import logging
+import queue
+
+import pytest
+
+import log_setup
+from log_setup import CallSiteSampler, DroppingQueueHandler, JSONFormatter, TextFormatter, load_levels
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(log_setup.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def record(lineno=10, level=logging.INFO, msg='reading %s', args=('esp-1',)):
+    return logging.LogRecord('iot_monitor', level, '/srv/iot_monitor.py', lineno, msg, args, None)
+
+
+def passed(sampler, count, **kwargs):
+    return [r for r in (record(**kwargs) for _ in range(count)) if sampler.filter(r)]
+
+
+def test_each_call_site_gets_its_own_limit(clock):
+    sampler = CallSiteSampler(limit=3, window=10)
+    assert len(passed(sampler, 5, lineno=10)) == 3
+    assert len(passed(sampler, 5, lineno=11)) == 3
+
+
+def test_next_window_reports_suppressed_count(clock):
+    sampler = CallSiteSampler(limit=2, window=10)
+    passed(sampler, 7)
+    clock[0] += 10
+    first, second = passed(sampler, 2)
+    assert first.suppressed == 5
+    assert not hasattr(second, 'suppressed')
+
+
+def test_warnings_and_disabled_sampling_always_pass(clock):
+    sampler = CallSiteSampler(limit=1, window=10)
+    assert len(passed(sampler, 5, level=logging.WARNING)) == 5
+    assert len(passed(CallSiteSampler(limit=0), 5)) == 5
+
+
+def test_formatters_carry_suppressed_count():
+    entry = record()
+    entry.suppressed = 4
+    assert TextFormatter('%(message)s').format(entry) == 'reading esp-1 (+4 similar suppressed)'
+    decoded = json.loads(JSONFormatter().format(entry))
+    assert decoded['msg'] == 'reading esp-1'
+    assert (decoded['level'], decoded['logger'], decoded['site']) == ('INFO', 'iot_monitor', 'iot_monitor:10')
+    assert decoded['suppressed'] == 4
+
+
+def test_full_queue_drops_info_records():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(record())
+    handler.handle(record())
+    assert handler.dropped == 1
+    queued = handler.queue.get_nowait()
+    # The message is resolved before it crosses to the writer thread
+    assert (queued.msg, queued.args) == ('reading esp-1', None)
+
+
+def test_load_levels_from_file(tmp_path):
+    path = tmp_path / 'levels.json'
+    path.write_text('{"test_log_setup.quiet": "warning"}')
+    assert load_levels(str(path)) == 1
+    assert logging.getLogger('test_log_setup.quiet').level == logging.WARNING
+    assert load_levels(str(tmp_path / 'missing.json')) == 0
@@ -0,0 +1,60 @@
+"""Unit tests for the in-process profiler"""
+import asyncio
+import os
+import threading
+
+import pytest
+
+from perf_tools import PerfProfiler, StackSampler
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler_counts_busy_and_idle_threads():
+    stop = threading.Event()
+    busy = threading.Thread(target=spin, args=(stop,), name='busy')
+    idle = threading.Thread(target=stop.wait, name='idle')
+    busy.start()
+    idle.start()
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    try:
+        while sampler.samples < 200:
+            stop.wait(0.01)
+    finally:
+        sampler.stop()
+        stop.set()
+        busy.join()
+        idle.join()
+    assert sampler.idle > 0
+    assert any('spin' in function for function in sampler.total)
+    assert any(stack.startswith('busy;') and 'spin' in stack for stack in sampler.stacks)
+
+
+def test_run_writes_artifacts_and_a_short_summary(tmp_path):
+    profiler = PerfProfiler('test', artifacts_dir=str(tmp_path), admin_ids={42})
+
+    async def profile():
+        profiler.track_tasks()
+        waiter = asyncio.create_task(asyncio.sleep(30), name='long-wait')
+        try:
+            first = asyncio.create_task(profiler.run(1))
+            await asyncio.sleep(0)
+            with pytest.raises(RuntimeError):
+                await profiler.run(1)
+            return await first
+        finally:
+            waiter.cancel()
+
+    summary = asyncio.run(profile())
+    assert summary['service'] == 'test' and summary['samples'] > 0
+    assert 'long-wait' in [task['name'] for task in summary['longest_tasks']]
+    assert sorted(os.listdir(summary['artifacts'])) == [
+        'allocations_diff.txt', 'cpu_collapsed.txt', 'tasks.txt', 'tracemalloc.snapshot'
+    ]
+    text = profiler.format_summary(summary)
+    assert text.startswith('test: ') and len(text) <= 4000
+    assert profiler.is_admin(42) and not profiler.is_admin(7)
@@ -0,0 +1,45 @@
+"""Unit tests for QR sticker tiles and sheet caching"""
+import os
+
+import pytest
+
+import qr_sheets
+from qr_sheets import MAX_ADDRESS_CHARS, QRSheetGenerator, deep_link, tile_key, tile_spec
+
+
+def test_tile_spec_links_to_bot_start():
+    spec = tile_spec({'id': 17, 'address': 'x' * 100, 'tozaHudud': '2-sonli Toza Hudud'}, 'toza_bot')
+    assert spec['link'] == deep_link('17', 'toza_bot') == 'https://t.me/toza_bot?start=17'
+    assert len(spec['address']) == MAX_ADDRESS_CHARS
+    assert spec['toza_hudud'] == '2-sonli Toza Hudud'
+    assert tile_spec({'id': 18}, 'toza_bot')['toza_hudud'] == "Noma'lum"
+
+
+def test_tile_key_follows_drawn_content():
+    spec = tile_spec({'id': 17, 'address': 'Navoiy 12'}, 'toza_bot')
+    assert tile_key(spec) == tile_key(dict(spec))
+    assert tile_key(spec) != tile_key({**spec, 'address': 'Navoiy 14'})
+    assert tile_key(spec) != tile_key(tile_spec({'id': 17, 'address': 'Navoiy 12'}, 'other_bot'))
+
+
+@pytest.mark.skipif(qr_sheets.qrcode is None, reason="needs qrcode and Pillow")
+def test_unchanged_tiles_and_pages_are_reused(tmp_path):
+    bins = [{'id': i, 'address': f"Navoiy {i}", 'toza_hudud': '1-sonli Toza Hudud'} for i in range(14)]
+    generator = QRSheetGenerator('toza_bot', output_dir=str(tmp_path), workers=1)
+    pdf_paths, rendered = generator.generate(bins)
+    assert rendered == 14
+    assert [os.path.basename(path) for path in pdf_paths] == ['1_sonli_Toza_Hudud.pdf']
+    first_page = tmp_path / '1_sonli_Toza_Hudud_001.png'
+    second_page = tmp_path / '1_sonli_Toza_Hudud_002.png'
+    first_written = first_page.stat().st_mtime_ns
+
+    bins[13]['address'] = 'Navoiy 99'
+    _, rendered = generator.generate(bins)
+    assert rendered == 1
+    # Only the page holding the changed tile is drawn again
+    assert first_page.stat().st_mtime_ns == first_written
+    assert second_page.exists()
+
+    _, rendered = generator.generate(bins[:12])
+    assert rendered == 0
+    assert not second_page.exists()
@@ -0,0 +1,51 @@
+"""Unit tests for AIAnalysis.combine"""
+from records import AIAnalysis
+
+
+def analysis(is_bin, is_full, fill_level, confidence, notes='', objects=()):
+    return AIAnalysis(is_bin, is_full, fill_level, confidence, notes, list(objects), notes + ' tip')
+
+
+def test_combine_single_photo():
+    only = analysis(True, True, 80, 90, 'full bin', ['bin'])
+    combined, best = AIAnalysis.combine([only])
+    assert best == 0
+    assert combined == only
+
+
+def test_combine_weights_by_confidence():
+    photos = [
+        analysis(True, False, 20, 25, 'blurry', ['bin']),
+        analysis(False, False, 0, 99, 'not a bin', ['car']),
+        analysis(True, True, 100, 75, 'overflowing', ['bin', 'bags']),
+    ]
+    combined, best = AIAnalysis.combine(photos)
+    assert best == 2
+    assert combined.is_waste_bin
+    assert combined.is_full
+    assert combined.fill_level == 80
+    assert combined.confidence == 75
+    assert combined.notes == 'overflowing'
+    assert combined.suggestions == 'overflowing tip'
+    # Objects from photos that do not show a bin are left out
+    assert combined.detected_objects == ['bin', 'bags']
+
+
+def test_combine_fullness_is_a_weighted_majority():
+    photos = [analysis(True, True, 90, 30), analysis(True, False, 40, 70)]
+    combined, best = AIAnalysis.combine(photos)
+    assert best == 1
+    assert not combined.is_full
+    assert combined.fill_level == 55
+
+
+def test_combine_zero_confidence_counts_as_one():
+    combined, _ = AIAnalysis.combine([analysis(True, True, 60, 0), analysis(True, False, 20, 0)])
+    assert combined.fill_level == 40
+
+
+def test_combine_without_any_bin_returns_most_confident():
+    photos = [analysis(False, False, 0, 40, 'tree'), analysis(False, False, 0, 60, 'wall')]
+    combined, best = AIAnalysis.combine(photos)
+    assert best == 1
+    assert combined is photos[1]
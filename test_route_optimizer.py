@@ -0,0 +1,83 @@
+"""Unit tests for the collection route optimizer"""
+import itertools
+import time
+
+import numpy as np
+
+import route_optimizer
+from records import BinDetails, Truck
+from route_optimizer import (
+    build_distance_matrix, construct_routes, optimize_district, plan_routes, route_length, two_opt, or_opt
+)
+
+CENTER = (40.3864, 71.7864)
+
+
+def random_problem(seed, bins, trucks, district='1-sonli Toza Hudud'):
+    rng = np.random.default_rng(seed)
+    return (
+        [Truck(f"truck-{i}", toza_hudud=district, location=tuple(CENTER + rng.normal(0, 0.02, 2)), fuel_level=80)
+         for i in range(trucks)],
+        [BinDetails(f"bin-{i}", is_full=True, toza_hudud=district, location=tuple(CENTER + rng.normal(0, 0.02, 2)))
+         for i in range(bins)],
+    )
+
+
+def test_every_bin_is_visited_once_within_capacity():
+    trucks, bins = random_problem(1, 60, 3)
+    routes, unassigned = optimize_district(trucks, bins, capacity=25, improvement_seconds=1.0)
+    visited = [bin_id for route in routes.values() for bin_id in route['bins']]
+    assert sorted(visited) == sorted(b.id for b in bins)
+    assert unassigned == []
+    assert all(len(route['bins']) <= 25 for route in routes.values())
+
+
+def test_overflow_is_unassigned():
+    trucks, bins = random_problem(2, 30, 2)
+    routes, unassigned = optimize_district(trucks, bins, capacity=10, improvement_seconds=0.5)
+    assert sum(len(route['bins']) for route in routes.values()) == 20
+    assert len(unassigned) == 10
+
+
+def test_improvement_never_lengthens_and_finds_the_optimum_on_small_routes():
+    trucks, bins = random_problem(3, 7, 1)
+    dist = build_distance_matrix(np.array([t.location for t in trucks]), np.array([b.location for b in bins]))
+    sink = dist.shape[0] - 1
+    (route,), _ = construct_routes(dist, 1, len(bins), capacity=10)
+    improved = two_opt(or_opt(two_opt(route, dist, sink, float('inf')), dist, sink, float('inf')), dist, sink, float('inf'))
+    assert route_length(improved, dist) <= route_length(route, dist) + 1e-6
+    best = min(route_length(np.array((0,) + order), dist) for order in itertools.permutations(range(1, 8)))
+    # 2-opt plus Or-opt is a heuristic; on 7 stops it stays within a few percent of the optimum
+    assert route_length(improved, dist) <= best * 1.05
+
+
+def test_every_route_gets_its_own_time_slice(monkeypatch):
+    slices = []
+
+    def slow_two_opt(route, dist, sink, deadline):
+        # Use up the whole slice, as a large route would
+        now = time.perf_counter()
+        slices.append(deadline - now)
+        time.sleep(max(0.0, deadline - now))
+        return route
+
+    monkeypatch.setattr(route_optimizer, 'two_opt', slow_two_opt)
+    monkeypatch.setattr(route_optimizer, 'or_opt', lambda route, dist, sink, deadline: route)
+    trucks, bins = random_problem(4, 40, 4)
+    optimize_district(trucks, bins, capacity=40, improvement_seconds=0.2)
+    # Two 2-opt passes per route; the first pass of the last route still has time left
+    assert len(slices) == 8
+    assert min(slices[0::2]) > 0.01
+
+
+def test_only_idle_fuelled_trucks_in_the_same_district_get_routes():
+    bins = [BinDetails('b1', is_full=True, toza_hudud='A', location=CENTER),
+            BinDetails('b2', is_full=True, toza_hudud='B', location=CENTER),
+            BinDetails('b3', is_full=False, toza_hudud='A', location=CENTER)]
+    trucks = [Truck('idle', toza_hudud='A', location=CENTER, fuel_level=50),
+              Truck('busy', toza_hudud='A', location=CENTER, status='BUSY'),
+              Truck('offline', toza_hudud='B', location=CENTER, status='OFFLINE'),
+              Truck('empty', toza_hudud='B', location=CENTER, fuel_level=5)]
+    plan = plan_routes(trucks, bins)
+    assert plan['routes'] == {'idle': {'bins': ['b1'], 'distance_km': 0.0}}
+    assert plan['unassigned'] == ['b2']
@@ -0,0 +1,76 @@
+"""Unit tests for the v1/v2 sensor frame codec"""
+import struct
+
+import pytest
+
+from sensor_frames import (
+    V2_MAX_SPAN_SECONDS, V2_RECORD, decode_frame, decode_text_frames, encode_batch, encode_reading, encode_text_frame, is_frame
+)
+
+
+def test_v1_round_trip():
+    reading = {'device_id': 'esp-42', 'temperature': -3.5, 'humidity': 61.2, 'sleep_seconds': 600}
+    assert decode_frame(encode_reading(reading)) == [reading]
+
+
+def test_v1_missing_fields():
+    frame = encode_reading({'device_id': 'esp-42', 'temperature': 21.0})
+    assert decode_frame(frame) == [
+        {'device_id': 'esp-42', 'temperature': 21.0, 'humidity': None, 'sleep_seconds': None}
+    ]
+
+
+def test_v2_round_trip_with_timestamps():
+    readings = [
+        {'device_id': 'esp-1', 'temperature': 20.5, 'humidity': 40.0, 'sleep_seconds': 300, 'timestamp': 1_700_000_060},
+        {'device_id': 'esp-2', 'temperature': None, 'humidity': 55.5, 'sleep_seconds': None, 'timestamp': 1_700_000_000},
+    ]
+    assert decode_frame(encode_batch(readings)) == readings
+
+
+def test_v2_reading_without_timestamp_stays_without_one():
+    readings = [
+        {'device_id': 'esp-1', 'temperature': 20.5, 'humidity': 40.0, 'sleep_seconds': 300, 'timestamp': 1_700_000_000},
+        {'device_id': 'esp-2', 'temperature': 21.0, 'humidity': 41.0, 'sleep_seconds': 300},
+    ]
+    decoded = decode_frame(encode_batch(readings))
+    assert decoded[0]['timestamp'] == 1_700_000_000
+    assert decoded[1]['timestamp'] is None
+
+
+def test_v2_batch_span_is_limited():
+    first = {'device_id': 'esp-1', 'temperature': 20.0, 'timestamp': 1_700_000_000}
+    last = dict(first, timestamp=1_700_000_000 + V2_MAX_SPAN_SECONDS)
+    assert decode_frame(encode_batch([first, last]))[1]['timestamp'] == last['timestamp']
+    with pytest.raises(ValueError):
+        encode_batch([first, dict(last, timestamp=last['timestamp'] + 1)])
+    with pytest.raises(ValueError):
+        encode_batch([first], base_timestamp=first['timestamp'] + 1)
+
+
+def test_v2_truncated_frame_keeps_complete_records():
+    readings = [
+        {'device_id': f'esp-{i}', 'temperature': 20.0 + i, 'humidity': 50.0, 'sleep_seconds': 60, 'timestamp': 1000 + i}
+        for i in range(3)
+    ]
+    frame = encode_batch(readings)
+    assert decode_frame(frame[:-V2_RECORD.size // 2]) == readings[:2]
+
+
+def test_readings_without_values_are_dropped():
+    assert decode_frame(encode_reading({'device_id': 'esp-1', 'sleep_seconds': 60})) == []
+
+
+def test_is_frame_rejects_unknown_versions():
+    assert is_frame(encode_reading({'device_id': 'x', 'temperature': 1.0}))
+    assert not is_frame(b'SF' + struct.pack('B', 9) + b'rest')
+    assert not is_frame(b'{"device_id": "x"}')
+    assert decode_frame(b'SF') == []
+
+
+def test_text_frames():
+    first = {'device_id': 'esp-1', 'temperature': 19.9, 'humidity': 45.0, 'sleep_seconds': 900}
+    second = {'device_id': 'esp-2', 'temperature': 25.0, 'humidity': 30.0, 'sleep_seconds': 900}
+    text = f"{encode_text_frame(encode_reading(first))}\nnoise\n{encode_text_frame(encode_reading(second))}"
+    assert decode_text_frames(text) == [first, second]
+    assert decode_text_frames('#SF not-base64!!') == []
@@ -0,0 +1,76 @@
+"""Unit tests for the bounded per-user session store"""
+import pytest
+
+import session_store
+from session_store import SessionStore
+
+NOW = 1_760_000_000.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [NOW]
+    monkeypatch.setattr(session_store.time, 'time', lambda: now[0])
+    return now
+
+
+def test_values_expire_ttl_after_the_last_write(clock):
+    store = SessionStore(ttl_seconds=60)
+    store.set(1, 'state', 'awaiting_photo')
+    clock[0] += 50
+    store.set(1, 'bin', 'b1')
+    clock[0] += 50
+    assert store.get(1, 'state') == 'awaiting_photo'
+    clock[0] += 10
+    assert store.get(1, 'state', 'gone') == 'gone'
+    assert len(store) == 0
+
+
+def test_least_recently_used_session_is_evicted(clock):
+    store = SessionStore(max_entries=2)
+    store.set(1, 'k', 'one')
+    store.set(2, 'k', 'two')
+    # Reading user 1 makes user 2 the oldest
+    assert store.get(1, 'k') == 'one'
+    store.set(3, 'k', 'three')
+    assert list(store.cache) == ['1', '3']
+    assert store.get(2, 'k') is None
+
+
+def test_evicted_sessions_are_loaded_back_from_sqlite(clock, tmp_path):
+    store = SessionStore(max_entries=1, ttl_seconds=60, db_path=str(tmp_path / 'sessions.sqlite3'))
+    store.set(1, 'k', 'one')
+    store.set(2, 'k', 'two')
+    assert list(store.cache) == ['2']
+    assert store.get(1, 'k') == 'one'
+    assert list(store.cache) == ['1']
+    # Expiry holds for sessions read back from the database too
+    clock[0] += 61
+    assert store.get(2, 'k') is None
+    assert store.load_from_db('2') is None
+    store.close()
+
+
+def test_sessions_survive_a_restart(clock, tmp_path):
+    path = str(tmp_path / 'sessions.sqlite3')
+    store = SessionStore(db_path=path)
+    store.set(1, 'lang', 'uz')
+    store.close()
+    restarted = SessionStore(db_path=path)
+    assert restarted.get('1', 'lang') == 'uz'
+    restarted.delete(1)
+    restarted.close()
+    again = SessionStore(db_path=path)
+    assert again.get(1, 'lang') is None
+    again.close()
+
+
+def test_expired_rows_are_purged(clock, tmp_path, monkeypatch):
+    monkeypatch.setattr(session_store, 'PURGE_EVERY_WRITES', 3)
+    store = SessionStore(ttl_seconds=60, db_path=str(tmp_path / 'sessions.sqlite3'))
+    store.set(1, 'k', 'old')
+    clock[0] += 61
+    store.set(2, 'k', 'new')
+    store.set(3, 'k', 'new')
+    assert [row[0] for row in store.get_db().execute("SELECT user_id FROM sessions ORDER BY user_id")] == ['2', '3']
+    store.close()
@@ -0,0 +1,127 @@
+"""Unit tests for the incremental room -> boiler -> facility status roll-up"""
+import random
+
+import status_rollup
+from status_rollup import StatusRollup
+
+NOW = 1_760_000_000.0
+
+
+def facilities():
+    return [{
+        'id': 1, 'overall_status': 'OPTIMAL',
+        'boilers': [
+            {'id': 10, 'status': 'OPTIMAL', 'connected_rooms': [
+                {'id': 100, 'status': 'OPTIMAL'}, {'id': 101, 'status': 'OPTIMAL'},
+            ]},
+            # Room 101 is shared and stays under boiler 10
+            {'id': 11, 'status': 'OPTIMAL', 'connected_rooms': [
+                {'id': 101, 'status': 'OPTIMAL'}, {'id': 102, 'status': 'OPTIMAL'},
+            ]},
+        ],
+    }]
+
+
+def reading(humidity=50, temperature=21, timestamp=NOW):
+    return {'humidity': humidity, 'temperature': temperature, 'timestamp': timestamp}
+
+
+def rollup():
+    graph = StatusRollup('http://api', lambda: {'Authorization': 'Token x'})
+    graph.load(facilities())
+    return graph
+
+
+def assert_counts_consistent(graph):
+    """Counts kept incrementally must match a recount from scratch"""
+    for node in graph.nodes.values():
+        counts = [0, 0, 0]
+        for child in graph.nodes.values():
+            if child.parent is node:
+                counts[child.rolled] += 1
+        assert node.child_counts == counts
+        assert node.rolled == max([node.own] + [s for s in (1, 2) if counts[s]])
+
+
+def test_shared_room_is_counted_once():
+    graph = rollup()
+    assert graph.nodes[('room', '101')].parent.id == '10'
+    assert graph.nodes[('boiler', '10')].child_counts == [2, 0, 0]
+    assert graph.nodes[('boiler', '11')].child_counts == [1, 0, 0]
+    assert_counts_consistent(graph)
+
+
+def test_critical_room_rolls_up_and_recovers():
+    graph = rollup()
+    assert graph.apply_reading({'room': 100}, reading(humidity=20)) == 3
+    assert [graph.status(kind, node_id) for kind, node_id in (('room', 100), ('boiler', 10), ('facility', 1))] == \
+        ['CRITICAL'] * 3
+    # A warning in a second room under the same boiler changes nothing above it
+    assert graph.apply_reading({'room': 101}, reading(humidity=63, timestamp=NOW + 1)) == 1
+    assert graph.status('boiler', 10) == 'CRITICAL'
+    assert graph.apply_reading({'room': 100}, reading(timestamp=NOW + 2)) == 3
+    assert graph.status('facility', 1) == 'WARNING'
+    assert_counts_consistent(graph)
+
+
+def test_random_readings_keep_counts_consistent():
+    graph = rollup()
+    rng = random.Random(38)
+    for step in range(500):
+        device = rng.choice([{'room': 100}, {'room': 101}, {'room': 102}, {'boiler': 10}, {'boiler': 11}])
+        graph.apply_reading(device, reading(rng.uniform(10, 90), rng.uniform(10, 32), NOW + step))
+    assert_counts_consistent(graph)
+
+
+def test_late_reading_is_ignored():
+    graph = rollup()
+    graph.apply_reading({'room': 100}, reading(timestamp=NOW))
+    assert graph.apply_reading({'room': 100}, reading(humidity=5, timestamp=NOW - 60)) == 0
+    assert graph.status('room', 100) == 'OPTIMAL'
+
+
+def test_reload_keeps_readings_and_counts():
+    graph = rollup()
+    graph.apply_reading({'boiler': 11}, reading(humidity=10))
+    graph.load(facilities())
+    assert graph.status('boiler', 11) == 'CRITICAL'
+    assert graph.status('facility', 1) == 'CRITICAL'
+    assert_counts_consistent(graph)
+
+
+class FakeResponse:
+    status_code = 200
+    text = ''
+
+
+class FakeSession:
+    calls = []
+
+    def __init__(self):
+        self.headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def patch(self, url, json, **kwargs):
+        self.calls.append((url, json))
+        return FakeResponse()
+
+
+def test_flush_sends_final_statuses_only(monkeypatch):
+    FakeSession.calls = []
+    monkeypatch.setattr(status_rollup.requests, 'Session', FakeSession)
+    graph = rollup()
+    graph.apply_reading({'room': 102}, reading(humidity=20))
+    graph.apply_reading({'room': 100}, reading(humidity=20))
+    graph.apply_reading({'room': 100}, reading(timestamp=NOW + 1))
+    assert graph.flush() == 3
+    assert sorted(FakeSession.calls) == [
+        ('http://api/boilers/11/', {'status': 'CRITICAL'}),
+        ('http://api/facilities/1/', {'overall_status': 'CRITICAL'}),
+        ('http://api/rooms/102/', {'status': 'CRITICAL'}),
+    ]
+    assert graph.flush() == 0
@@ -0,0 +1,76 @@
+"""Unit tests for per-update tracing and the trace file exporter"""
+import asyncio
+import json
+
+import pytest
+
+import tracing
+from tracing import NOOP_SPAN, Tracer, current_span, trace_headers
+
+
+def test_spans_follow_awaits_and_threads():
+    tracer = Tracer('test', export='none')
+
+    def in_thread():
+        with tracer.span('thread_stage'):
+            return trace_headers()['traceparent']
+
+    async def handle():
+        with tracer.trace('update', update_id=1) as root:
+            with tracer.span('outer') as outer:
+                await asyncio.sleep(0)
+                headers = await asyncio.to_thread(in_thread)
+        return root, outer, headers
+
+    root, outer, traceparent = asyncio.run(handle())
+    names = {child.name: child for child in root.children}
+    assert sorted(names) == ['outer', 'thread_stage']
+    assert names['outer'] is outer and outer.parent_id == root.span_id
+    assert names['thread_stage'].parent_id == outer.span_id
+    assert traceparent == f"00-{root.trace_id}-{names['thread_stage'].span_id}-01"
+    assert tracer.recent[-1]['stages'].keys() == {'outer', 'thread_stage'}
+
+
+def test_outside_a_trace_nothing_is_recorded():
+    tracer = Tracer('test', export='none')
+    with tracer.span('stage') as span:
+        span.set(ignored=True)
+    assert span is NOOP_SPAN and current_span() is NOOP_SPAN
+    assert trace_headers() == {}
+    assert not tracer.recent
+
+
+def test_errors_are_recorded_and_reraised():
+    tracer = Tracer('test', export='none')
+    with pytest.raises(KeyError):
+        with tracer.trace('update') as root:
+            with tracer.span('stage'):
+                raise KeyError('bin')
+    assert root.children[0].error == "KeyError('bin')"
+    assert tracer.recent[-1]['error'] == "KeyError('bin')"
+
+
+def test_spans_finishing_after_their_trace_are_dropped():
+    tracer = Tracer('test', export='none')
+    with tracer.trace('update') as root:
+        stage = tracer.span('background')
+        stage.__enter__()
+    stage.__exit__(None, None, None)
+    assert root.children == []
+
+
+def test_file_export_rotates_at_max_size(tmp_path, monkeypatch):
+    path = tmp_path / 'traces.jsonl'
+    monkeypatch.setattr(tracing, 'TRACE_FILE', str(path))
+    monkeypatch.setattr(tracing, 'TRACE_FILE_MAX_BYTES', 200)
+    tracer = Tracer('iot_monitor', export='none')
+    for update_id in range(3):
+        with tracer.trace('update', update_id=update_id) as root:
+            with tracer.span('forward'):
+                pass
+        tracer.export_file([root])
+    # Every line is well over 200 bytes, so each export starts a new file
+    assert (tmp_path / 'traces.jsonl.1').exists()
+    [entry] = [json.loads(line) for line in path.read_text().splitlines()]
+    assert (entry['service'], entry['attributes']) == ('iot_monitor', {'update_id': 2})
+    assert [span['name'] for span in entry['spans']] == ['forward']
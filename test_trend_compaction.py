@@ -0,0 +1,121 @@
+"""Unit tests for bin trend compaction and LTTB downsampling"""
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+import trend_compaction
+from trend_compaction import RECENT_SECONDS, TrendCompactor, _lttb_python, compact_trend, compact_values, lttb
+
+NOW = 1_760_000_000.0
+
+
+def event(age_seconds, fill_level, is_full=False):
+    timestamp = datetime.fromtimestamp(NOW - age_seconds, tz=timezone.utc).isoformat()
+    return {'timestamp': timestamp, 'fillLevel': fill_level, 'isFull': is_full}
+
+
+def history():
+    rng = random.Random(41)
+    return [event(age, rng.randint(0, 100), rng.random() < 0.1) for age in range(0, 400 * 86400, 1800)]
+
+
+def test_compaction_is_idempotent():
+    once = compact_trend(history(), now=NOW)
+    assert compact_trend(once, now=NOW) == once
+
+
+def test_compaction_keeps_recent_events_and_counts():
+    events = history()
+    compacted = compact_trend(events, now=NOW)
+    recent = [e for e in events if NOW - datetime.fromisoformat(e['timestamp']).timestamp() < RECENT_SECONDS]
+    assert all(e in compacted for e in recent)
+    assert len(compacted) < len(events)
+    assert sum(e.get('count', 1) for e in compacted) == len(events)
+
+
+def test_compaction_keeps_bucket_peak_and_full_flag():
+    age = 10 * 86400
+    bucket_start = (NOW - age) // 3600 * 3600
+    base = NOW - bucket_start
+    events = [event(base - 60, 30, is_full=True), event(base - 120, 90), event(base - 180, 50)]
+    compacted = compact_trend(events, now=NOW)
+    assert len(compacted) == 1
+    assert compacted[0]['fillLevel'] == 90
+    assert compacted[0]['isFull'] is True
+    assert compacted[0]['count'] == 3
+
+
+def test_unparseable_timestamps_are_refused():
+    with pytest.raises(ValueError):
+        compact_trend(history() + [{'timestamp': 'yesterday', 'fillLevel': 10}], now=NOW)
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.text = ''
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """Platform stand-in whose bin trend grows between the list and the re-read"""
+    def __init__(self, bins, appended):
+        self.bins = bins
+        self.appended = appended
+        self.saved = {}
+
+    def get(self, url, **kwargs):
+        if url.endswith('/waste-bins/'):
+            return FakeResponse(self.bins)
+        bin_id = url.rstrip('/').rsplit('/', 1)[1]
+        stored = next(b for b in self.bins if b['id'] == bin_id)
+        return FakeResponse({'trend': stored['trend'] + self.appended})
+
+    def patch(self, url, json, **kwargs):
+        self.saved[url.rstrip('/').rsplit('/', 1)[1]] = json['trend']
+        return FakeResponse({})
+
+
+def test_compact_bins_keeps_events_appended_meanwhile_and_skips_bad_trends():
+    late = event(0, 77)
+    broken = history() + [{'timestamp': None, 'fillLevel': 5}]
+    compactor = TrendCompactor('http://api', {})
+    compactor.session = FakeSession([{'id': 'b1', 'trend': history()}, {'id': 'b2', 'trend': broken}], [late])
+    compacted_bins, _ = compactor.compact_bins(now=NOW)
+    assert compacted_bins == 1
+    assert list(compactor.session.saved) == ['b1']
+    assert compactor.session.saved['b1'] == compact_trend(history(), now=NOW) + [late]
+
+
+@pytest.mark.parametrize('threshold', [3, 10, 57])
+def test_lttb_keeps_endpoints_and_budget(threshold):
+    rng = random.Random(threshold)
+    y = [rng.uniform(0, 100) for _ in range(500)]
+    keep = lttb(range(500), y, threshold)
+    assert isinstance(keep, list)
+    assert len(keep) == threshold
+    assert keep[0] == 0 and keep[-1] == 499
+    assert keep == sorted(set(keep))
+
+
+@pytest.mark.skipif(trend_compaction.np is None, reason='numpy is not installed')
+def test_lttb_python_matches_numpy():
+    rng = random.Random(42)
+    x = sorted(rng.uniform(0, 10_000) for _ in range(1000))
+    y = [rng.uniform(0, 100) for _ in range(1000)]
+    assert _lttb_python(x, y, 100) == lttb(x, y, 100)
+
+
+def test_compact_values():
+    values = list(range(1000))
+    assert compact_values(values[:10]) == values[:10]
+    compacted = compact_values(values, max_points=100, recent_points=20)
+    assert len(compacted) == 100
+    assert compacted[-20:] == values[-20:]
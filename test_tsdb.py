@@ -0,0 +1,74 @@
+"""Unit tests for the Gorilla chunk codec and SensorHistoryStore"""
+import random
+
+from tsdb import ChunkEncoder, SensorHistoryStore, decode_chunk
+
+
+def encode(points):
+    encoder = ChunkEncoder()
+    for point in points:
+        encoder.append(*point)
+    return encoder
+
+
+def test_chunk_round_trip_regular_series():
+    points = [(1_700_000_000 + i * 60, 20.0 + (i % 7) / 10, 55.5 - (i % 3) / 10) for i in range(240)]
+    encoder = encode(points)
+    assert decode_chunk(encoder.payload(), encoder.start, encoder.count) == points
+    # Fixed interval and slow changes compress to a few bytes per point
+    assert len(encoder.payload()) < 4 * len(points)
+
+
+def test_chunk_round_trip_irregular_series():
+    rng = random.Random(7)
+    timestamp = 1_700_000_000
+    points = []
+    for _ in range(500):
+        # Deltas large enough to hit every delta-of-delta bucket, including the 32-bit one
+        timestamp += rng.choice([1, 30, 60, 61, 900, 5000, 100_000, 3_000_000])
+        points.append((timestamp, round(rng.uniform(-40, 60), 1), round(rng.uniform(0, 100), 1)))
+    encoder = encode(points)
+    assert decode_chunk(encoder.payload(), encoder.start, encoder.count) == points
+
+
+def test_chunk_round_trip_missing_values():
+    points = [(100, 21.5, None), (110, None, 40.0), (120, None, None), (130, 21.6, 40.1)]
+    encoder = encode(points)
+    assert encoder.points() == points
+
+
+def test_empty_chunk_decodes_to_nothing():
+    assert decode_chunk(b'', 0, 0) == []
+
+
+def test_store_survives_reopen(tmp_path):
+    store = SensorHistoryStore(str(tmp_path), chunk_points=10)
+    points = [(1000 + i * 10, 20.0 + i / 10, 50.0) for i in range(25)]
+    for point in points:
+        store.append('esp-1', *point)
+    assert store.query('esp-1') == points
+    assert store.query('esp-1', 1050, 1100) == [p for p in points if 1050 <= p[0] <= 1100]
+    store.close()
+
+    reopened = SensorHistoryStore(str(tmp_path), chunk_points=10)
+    try:
+        assert reopened.query('esp-1') == points
+        assert reopened.devices() == {'esp-1'}
+    finally:
+        reopened.close()
+
+
+def test_checkpoint_snapshot_then_write(tmp_path):
+    store = SensorHistoryStore(str(tmp_path))
+    store.append('esp-1', 1000, 20.0, 50.0)
+    snapshot = store.snapshot_open_chunks()
+    # Points appended after the snapshot are not part of the checkpoint
+    store.append('esp-1', 1010, 20.1, 50.0)
+    store.write_checkpoint(snapshot)
+    store.data_file.close()
+
+    reopened = SensorHistoryStore(str(tmp_path))
+    try:
+        assert reopened.query('esp-1') == [(1000, 20.0, 50.0)]
+    finally:
+        reopened.close()
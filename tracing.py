@@ -0,0 +1,244 @@
+"""Lightweight per-update tracing.
+
+A trace is started for every handled update and every pipeline stage runs
+in a span, timed with perf_counter and carrying a few attributes. The
+current span is kept in a context variable, so it follows awaits and
+asyncio.to_thread calls without being passed around. Outside a trace,
+span() does nothing.
+
+Outgoing API requests carry the current trace in a W3C `traceparent`
+header (see trace_headers). Finished traces are logged as a one-line
+stage breakdown and handed to a background exporter thread, which appends
+them to a JSON Lines file or posts them to an OTLP/HTTP JSON collector.
+
+Environment:
+    TRACE_EXPORT          'file' (default), 'otlp' or 'none'
+    TRACE_FILE            JSON Lines file for the file exporter; rotated to
+                          TRACE_FILE.1 once it reaches TRACE_FILE_MAX_BYTES
+    TRACE_OTLP_ENDPOINT   collector traces URL for the otlp exporter
+"""
+import contextvars
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import requests
+
+import records
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORT = os.getenv('TRACE_EXPORT', 'file')
+TRACE_FILE = os.getenv('TRACE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl"))
+# The trace file is rotated at this size, keeping one previous file
+TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', 50 * 1024 * 1024))
+TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', "http://127.0.0.1:4318/v1/traces")
+# Finished traces waiting for the exporter; when full, new traces are not exported
+TRACE_QUEUE_SIZE = 1000
+# The exporter sends what has queued up at least this often
+TRACE_EXPORT_INTERVAL_SECONDS = 5
+# Stage breakdowns of the latest traces kept in memory
+RECENT_TRACES = 200
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+@dataclass(slots=True)
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = None
+    start_time: float = 0.0
+    start: float = 0.0
+    duration_ms: float = None
+    attributes: dict = field(default_factory=dict)
+    error: str = None
+    # Root span of the trace; None on the root itself
+    root: 'Span' = None
+    # Finished spans of the trace, collected on the root span only
+    children: list = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'duration_ms': round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span outside a trace"""
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Starts traces and spans, and exports finished traces from a background thread"""
+    def __init__(self, service: str, export: str = TRACE_EXPORT):
+        self.service = service
+        self.export = export
+        self.queue = queue.Queue(TRACE_QUEUE_SIZE)
+        self.recent = deque(maxlen=RECENT_TRACES)
+        self.thread = None
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Start a new trace whose root span covers the block"""
+        span = Span(name, secrets.token_hex(16), secrets.token_hex(8), None, time.time(), time.perf_counter(),
+                    attributes=attributes, children=[])
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.duration_ms = (time.perf_counter() - span.start) * 1000
+            _current_span.reset(token)
+            self.finish(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time the block as a stage of the current trace; a no-op outside a trace"""
+        parent = _current_span.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+        root = parent.root or parent
+        span = Span(name, parent.trace_id, secrets.token_hex(8), parent.span_id, time.time(), time.perf_counter(),
+                    attributes=attributes, root=root)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.duration_ms = (time.perf_counter() - span.start) * 1000
+            _current_span.reset(token)
+            # Spans of background work outliving the trace are not exported
+            if root.duration_ms is None:
+                root.children.append(span)
+
+    def finish(self, root: Span):
+        stages = {}
+        # Nested stages are listed too, so their time also counts towards their parent's
+        for child in sorted(root.children, key=lambda child: child.start):
+            stages[child.name] = stages.get(child.name, 0.0) + child.duration_ms
+        summary = {
+            'trace_id': root.trace_id,
+            'name': root.name,
+            'duration_ms': round(root.duration_ms, 1),
+            'stages': {name: round(ms, 1) for name, ms in stages.items()},
+            'error': root.error,
+        }
+        self.recent.append(summary)
+        breakdown = ', '.join(f"{name} {ms:.0f}ms" for name, ms in summary['stages'].items())
+        logger.info(f"Trace {root.trace_id[:8]} {root.name} {root.duration_ms:.0f}ms: {breakdown}")
+        if self.export == 'none':
+            return
+        self.start()
+        try:
+            self.queue.put_nowait(root)
+        except queue.Full:
+            pass
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.export_loop, name='trace-exporter', daemon=True)
+            self.thread.start()
+
+    def export_loop(self):
+        while True:
+            roots = [self.queue.get()]
+            deadline = time.monotonic() + TRACE_EXPORT_INTERVAL_SECONDS
+            while len(roots) < TRACE_QUEUE_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    roots.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                if self.export == 'otlp':
+                    self.export_otlp(roots)
+                else:
+                    self.export_file(roots)
+            except Exception as e:
+                logger.error(f"Trace export failed: {e}")
+
+    def export_file(self, roots: list):
+        try:
+            if os.path.getsize(TRACE_FILE) >= TRACE_FILE_MAX_BYTES:
+                os.replace(TRACE_FILE, TRACE_FILE + '.1')
+        except FileNotFoundError:
+            pass
+        with open(TRACE_FILE, 'ab') as f:
+            for root in roots:
+                entry = root.to_dict()
+                entry['service'] = self.service
+                entry['spans'] = [child.to_dict() for child in root.children]
+                f.write(records.dumps(entry) + b'\n')
+
+    def export_otlp(self, roots: list):
+        """Post spans in the OTLP/HTTP JSON encoding"""
+        spans = []
+        for root in roots:
+            for span in [root, *root.children]:
+                start_ns = int(span.start_time * 1e9)
+                otlp_span = {
+                    'traceId': span.trace_id,
+                    'spanId': span.span_id,
+                    'name': span.name,
+                    'kind': 2 if span is root else 1,
+                    'startTimeUnixNano': str(start_ns),
+                    'endTimeUnixNano': str(start_ns + int(span.duration_ms * 1e6)),
+                    'attributes': [
+                        {'key': key, 'value': {'stringValue': str(value)}} for key, value in span.attributes.items()
+                    ],
+                    'status': {'code': 2, 'message': span.error} if span.error else {'code': 1},
+                }
+                if span.parent_id:
+                    otlp_span['parentSpanId'] = span.parent_id
+                spans.append(otlp_span)
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service}}]},
+            'scopeSpans': [{'scope': {'name': 'tracing'}, 'spans': spans}],
+        }]}
+        response = requests.post(TRACE_OTLP_ENDPOINT, data=records.dumps(body),
+                                 headers={'Content-Type': 'application/json'}, timeout=10)
+        if response.status_code >= 300:
+            logger.error(f"Trace collector rejected {len(spans)} spans: {response.status_code}, {response.text[:200]}")
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def trace_headers():
+    """W3C trace context headers for an outgoing request, empty outside a trace"""
+    span = _current_span.get()
+    if span is None:
+        return {}
+    return {'traceparent': f"00-{span.trace_id}-{span.span_id}-01"}
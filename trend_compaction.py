@@ -0,0 +1,295 @@
+"""Trend compaction and LTTB downsampling for bin and sensor history.
+
+Bin trends (one event per fill report) keep full resolution for
+RECENT_SECONDS; older events are folded into coarser buckets per
+COMPACTION_TIERS, one event per bucket holding the bucket's peak fill
+level, so the collection sawtooth stays visible. Room and boiler trends
+are plain value arrays; past MAX_VALUE_TREND_POINTS their older part is
+reduced with LTTB.
+
+Charts ask for a point budget and get a Largest-Triangle-Three-Buckets
+selection of the series, which keeps its visual shape with a bounded
+number of points. numpy is used for it when installed, otherwise a
+pure-Python version selects the same points.
+
+Usage:
+    python trend_compaction.py [--dry-run]
+"""
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from api_login import login_headers
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://deklorantapi.cdcgroup.uz/api"
+
+# Bin trend events newer than this are kept as they are
+RECENT_SECONDS = 7 * 86400
+# (maximum age, bucket size) in seconds, checked in order; None means any age
+COMPACTION_TIERS = (
+    (30 * 86400, 3600),
+    (365 * 86400, 86400),
+    (None, 7 * 86400),
+)
+# Bins whose trend is shorter than this are left alone
+MIN_EVENTS_TO_COMPACT = 200
+# Room and boiler value trends are cut back to this many points
+MAX_VALUE_TREND_POINTS = 288
+# The newest value points always kept at full resolution
+RECENT_VALUE_POINTS = 96
+
+
+def _bucket_edges(n: int, threshold: int):
+    """Bucket i spans [edges[i], edges[i + 1]) over the points between first and last"""
+    edges = [int(i * (n - 2) / (threshold - 2)) + 1 for i in range(threshold - 1)]
+    edges[-1] = n - 1
+    return edges
+
+
+def lttb(x, y, threshold: int):
+    """Indices of the points Largest-Triangle-Three-Buckets keeps out of (x, y), as a list.
+    The first and last points are always kept.
+    """
+    if np is None:
+        return _lttb_python(x, y, threshold)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    edges = _bucket_edges(n, threshold)
+    selected = [0] * threshold
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        cx = x[next_start:next_end].mean()
+        cy = y[next_start:next_end].mean()
+        # Twice the triangle area between the last kept point, each candidate and the next bucket's mean
+        areas = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def _lttb_python(x, y, threshold: int):
+    x = [float(value) for value in x]
+    y = [float(value) for value in y]
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    edges = _bucket_edges(n, threshold)
+    selected = [0] * threshold
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        cx = sum(x[next_start:next_end]) / (next_end - next_start)
+        cy = sum(y[next_start:next_end]) / (next_end - next_start)
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((x[a] - cx) * (y[j] - y[a]) - (x[a] - x[j]) * (cy - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        selected[i + 1] = a
+    return selected
+
+
+def _timestamp(value):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _fill_level(event: dict):
+    value = event.get('fillLevel', event.get('fill_level'))
+    return float(value) if value is not None else 0.0
+
+
+def bucket_size_for(age: float):
+    """Compaction bucket size for an event of the given age, None to keep it as is"""
+    if age < RECENT_SECONDS:
+        return None
+    for max_age, bucket in COMPACTION_TIERS:
+        if max_age is None or age < max_age:
+            return bucket
+    return COMPACTION_TIERS[-1][1]
+
+
+def compact_trend(events: list, now: float = None):
+    """Fold older bin trend events into coarser buckets, keeping each bucket's peak event.
+    Folded events carry a 'count' of the events they replace. Raises ValueError if
+    an event has no parseable timestamp, rather than dropping it.
+    """
+    now = now or time.time()
+    dated = []
+    for event in events:
+        timestamp = _timestamp(event.get('timestamp'))
+        if timestamp is None:
+            raise ValueError(f"Trend event without a parseable timestamp: {event.get('timestamp')!r}")
+        dated.append((timestamp, event))
+    dated.sort(key=lambda item: item[0])
+    compacted = []
+    current_key = None
+    for timestamp, event in dated:
+        bucket = bucket_size_for(now - timestamp)
+        if bucket is None:
+            compacted.append(event)
+            current_key = None
+            continue
+        key = (bucket, int(timestamp // bucket))
+        count = event.get('count', 1)
+        if key != current_key:
+            compacted.append(dict(event, count=count))
+            current_key = key
+            continue
+        folded = compacted[-1]
+        peak = event if _fill_level(event) > _fill_level(folded) else folded
+        compacted[-1] = dict(
+            peak,
+            isFull=bool(folded.get('isFull') or event.get('isFull')),
+            count=folded['count'] + count
+        )
+    return compacted
+
+
+def compact_values(values: list, max_points: int = MAX_VALUE_TREND_POINTS,
+                   recent_points: int = RECENT_VALUE_POINTS):
+    """Cut a plain value trend back to max_points, LTTB-reducing all but the newest points"""
+    if len(values) <= max_points:
+        return list(values)
+    older, recent = values[:-recent_points], values[-recent_points:]
+    keep = lttb(range(len(older)), older, max_points - recent_points)
+    return [older[i] for i in keep] + list(recent)
+
+
+def downsample_series(points: list, budget: int):
+    """[(timestamp, value), ...] reduced to at most `budget` points, None values skipped"""
+    points = [point for point in points if point[1] is not None]
+    if len(points) <= budget:
+        return points
+    keep = lttb([p[0] for p in points], [p[1] for p in points], budget)
+    return [points[i] for i in keep]
+
+
+class TrendCompactor:
+    """Compacts stored trends on the platform"""
+    def __init__(self, api_base_url: str, headers: dict, dry_run: bool = False):
+        self.api_base_url = api_base_url
+        self.headers = headers
+        self.dry_run = dry_run
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+
+    def fetch(self, endpoint: str):
+        response = self.session.get(f"{self.api_base_url}/{endpoint}/", timeout=120)
+        response.raise_for_status()
+        data = response.json()
+        return data.get('results', []) if isinstance(data, dict) else data
+
+    def save_trend(self, endpoint: str, item_id, trend: list):
+        if self.dry_run:
+            return True
+        try:
+            response = self.session.patch(f"{self.api_base_url}/{endpoint}/{item_id}/", json={'trend': trend}, timeout=60)
+            if response.status_code in [200, 204]:
+                return True
+            logger.error(f"Error saving trend of {endpoint} {item_id}: {response.status_code}, {response.text}")
+        except Exception as e:
+            logger.error(f"Exception saving trend of {endpoint} {item_id}: {e}")
+        return False
+
+    def fetch_trend(self, endpoint: str, item_id):
+        response = self.session.get(f"{self.api_base_url}/{endpoint}/{item_id}/", timeout=60)
+        response.raise_for_status()
+        return response.json().get('trend') or []
+
+    def merge_appended(self, endpoint: str, item_id, trend: list, compacted: list):
+        """compacted plus whatever was appended to the stored trend since it was fetched.
+        Returns None if the stored trend changed in any other way.
+        """
+        try:
+            current = self.fetch_trend(endpoint, item_id)
+        except Exception as e:
+            logger.error(f"Exception re-reading trend of {endpoint} {item_id}: {e}")
+            return None
+        if current[:len(trend)] != trend:
+            logger.warning(f"Trend of {endpoint} {item_id} changed while compacting, skipped")
+            return None
+        return compacted + current[len(trend):]
+
+    def compact_bins(self, now: float = None):
+        """Compact every bin trend long enough to need it, returning (bins, events removed)"""
+        compacted_bins = removed = 0
+        for waste_bin in self.fetch('waste-bins'):
+            trend = waste_bin.get('trend') or []
+            if len(trend) < MIN_EVENTS_TO_COMPACT:
+                continue
+            try:
+                compacted = compact_trend(trend, now)
+            except ValueError as e:
+                logger.warning(f"Trend of bin {waste_bin['id']} left as is: {e}")
+                continue
+            if len(compacted) >= len(trend):
+                continue
+            # Events reported while we were compacting must not be lost
+            merged = self.merge_appended('waste-bins', waste_bin['id'], trend, compacted)
+            if merged is not None and self.save_trend('waste-bins', waste_bin['id'], merged):
+                compacted_bins += 1
+                removed += len(trend) - len(compacted)
+        return compacted_bins, removed
+
+    def compact_value_trends(self, endpoint: str):
+        """Compact room or boiler value trends, returning (items, points removed)"""
+        compacted_items = removed = 0
+        for item in self.fetch(endpoint):
+            trend = item.get('trend') or []
+            if len(trend) <= MAX_VALUE_TREND_POINTS:
+                continue
+            compacted = compact_values(trend)
+            merged = self.merge_appended(endpoint, item['id'], trend, compacted)
+            if merged is not None and self.save_trend(endpoint, item['id'], merged):
+                compacted_items += 1
+                removed += len(trend) - len(compacted)
+        return compacted_items, removed
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    dry_run = '--dry-run' in sys.argv[1:]
+    compactor = TrendCompactor(API_BASE_URL, login_headers(API_BASE_URL), dry_run)
+
+    items, removed = compactor.compact_bins()
+    print(f"Bins: {items} trends compacted, {removed} events folded")
+    for endpoint in ('rooms', 'boilers'):
+        items, removed = compactor.compact_value_trends(endpoint)
+        print(f"{endpoint.capitalize()}: {items} trends compacted, {removed} points removed")
+    if dry_run:
+        print("Dry run, nothing was saved")
+
+
+if __name__ == '__main__':
+    main()
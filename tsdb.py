@@ -0,0 +1,389 @@
+"""Embedded time-series store for sensor history.
+
+Readings are compressed per device with the Gorilla scheme:
+delta-of-delta encoded timestamps and XOR encoded temperature/humidity floats,
+packed into fixed-size chunks of CHUNK_POINTS points. Sealed chunks are
+appended to a single data file that is read through mmap; each chunk starts
+with a small header so the index is rebuilt by skipping from header to header
+on open. The still-open chunk of every device is checkpointed in the same
+format to a sidecar file so a restart does not lose it.
+
+Values are stored at VALUE_SCALE precision (sensors report one decimal), which
+makes the encoded floats integral and keeps their XORs short.
+
+A regular series (fixed sleep interval, slowly changing values) costs about
+2-4 bytes per reading, so months of history for thousands of devices fit in a
+few MB.
+"""
+import logging
+import math
+import mmap
+import os
+import struct
+
+logger = logging.getLogger(__name__)
+
+CHUNK_POINTS = 240
+DATA_FILE = 'chunks.dat'
+OPEN_CHUNKS_FILE = 'open_chunks.dat'
+VALUE_SCALE = 10
+
+# <id length:H> <device id> <start ts:I> <end ts:I> <count:H> <payload bytes:I>
+CHUNK_ID_LENGTH = struct.Struct('<H')
+CHUNK_HEADER = struct.Struct('<IIHI')
+
+_DOUBLE = struct.Struct('<d')
+_UINT64 = struct.Struct('<Q')
+
+
+def _float_bits(value):
+    return _UINT64.unpack(_DOUBLE.pack(math.nan if value is None else float(round(value * VALUE_SCALE))))[0]
+
+
+def _bits_float(bits):
+    value = _DOUBLE.unpack(_UINT64.pack(bits))[0]
+    return None if math.isnan(value) else value / VALUE_SCALE
+
+
+class BitWriter:
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def write(self, bits: int, width: int):
+        self.value = (self.value << width) | (bits & ((1 << width) - 1))
+        self.length += width
+
+    def to_bytes(self):
+        padding = -self.length % 8
+        return (self.value << padding).to_bytes((self.length + padding) // 8, 'big')
+
+
+class BitReader:
+    def __init__(self, data: bytes):
+        self.value = int.from_bytes(data, 'big')
+        self.length = len(data) * 8
+        self.position = 0
+
+    def read(self, width: int):
+        self.position += width
+        return (self.value >> (self.length - self.position)) & ((1 << width) - 1)
+
+    def read_bit(self):
+        return self.read(1)
+
+
+# Delta-of-delta buckets: (control bits, control width, value width)
+DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+)
+
+
+class _XorState:
+    __slots__ = ('previous', 'leading', 'trailing')
+
+    def __init__(self, first_bits: int):
+        self.previous = first_bits
+        self.leading = 65
+        self.trailing = 0
+
+
+def _write_xor(writer: BitWriter, state: _XorState, bits: int):
+    xor = bits ^ state.previous
+    state.previous = bits
+    if xor == 0:
+        writer.write(0, 1)
+        return
+    writer.write(1, 1)
+    leading = min(64 - xor.bit_length(), 31)
+    trailing = (xor & -xor).bit_length() - 1
+    if state.leading <= leading and state.trailing <= trailing:
+        # Meaningful bits fit in the previous window
+        writer.write(0, 1)
+        writer.write(xor >> state.trailing, 64 - state.leading - state.trailing)
+    else:
+        meaningful = 64 - leading - trailing
+        writer.write(1, 1)
+        writer.write(leading, 5)
+        # A 64-bit window is stored as 0 in the 6-bit length field
+        writer.write(meaningful & 0x3F, 6)
+        writer.write(xor >> trailing, meaningful)
+        state.leading = leading
+        state.trailing = trailing
+
+
+def _read_xor(reader: BitReader, state: _XorState):
+    if reader.read_bit() == 0:
+        return state.previous
+    if reader.read_bit() == 1:
+        state.leading = reader.read(5)
+        meaningful = reader.read(6) or 64
+        state.trailing = 64 - state.leading - meaningful
+    meaningful = 64 - state.leading - state.trailing
+    state.previous ^= reader.read(meaningful) << state.trailing
+    return state.previous
+
+
+class ChunkEncoder:
+    """Incrementally encodes (timestamp, temperature, humidity) points"""
+    def __init__(self):
+        self.writer = BitWriter()
+        self.count = 0
+        self.start = None
+        self.end = None
+        self.previous_delta = 0
+        self.values = None
+
+    def append(self, timestamp: int, temperature, humidity):
+        t_bits, h_bits = _float_bits(temperature), _float_bits(humidity)
+        if self.count == 0:
+            self.start = timestamp
+            self.writer.write(t_bits, 64)
+            self.writer.write(h_bits, 64)
+            self.values = (_XorState(t_bits), _XorState(h_bits))
+        else:
+            delta = timestamp - self.end
+            dod = delta - self.previous_delta
+            self.previous_delta = delta
+            if dod == 0:
+                self.writer.write(0, 1)
+            else:
+                for control, control_width, width in DOD_BUCKETS:
+                    if -(1 << (width - 1)) <= dod < (1 << (width - 1)):
+                        self.writer.write(control, control_width)
+                        self.writer.write(dod, width)
+                        break
+                else:
+                    self.writer.write(0b1111, 4)
+                    self.writer.write(dod, 32)
+            _write_xor(self.writer, self.values[0], t_bits)
+            _write_xor(self.writer, self.values[1], h_bits)
+        self.end = timestamp
+        self.count += 1
+
+    def payload(self):
+        return self.writer.to_bytes()
+
+    def points(self):
+        return decode_chunk(self.payload(), self.start, self.count)
+
+
+def _signed(value: int, width: int):
+    return value - (1 << width) if value & (1 << (width - 1)) else value
+
+
+def decode_chunk(payload: bytes, start: int, count: int):
+    """Decode a chunk payload into a list of (timestamp, temperature, humidity)"""
+    if count == 0:
+        return []
+    reader = BitReader(payload)
+    t_state = _XorState(reader.read(64))
+    h_state = _XorState(reader.read(64))
+    points = [(start, _bits_float(t_state.previous), _bits_float(h_state.previous))]
+    timestamp, delta = start, 0
+    for _ in range(count - 1):
+        if reader.read_bit() == 0:
+            dod = 0
+        else:
+            for _control, control_width, width in DOD_BUCKETS:
+                if reader.read_bit() == 0:
+                    dod = _signed(reader.read(width), width)
+                    break
+            else:
+                dod = _signed(reader.read(32), 32)
+        delta += dod
+        timestamp += delta
+        points.append((timestamp, _bits_float(_read_xor(reader, t_state)), _bits_float(_read_xor(reader, h_state))))
+    return points
+
+
+def encode_chunk(device_id: str, encoder: ChunkEncoder):
+    """Serialize an encoder as a chunk record (header followed by payload)"""
+    raw_id = device_id.encode('utf-8')
+    payload = encoder.payload()
+    return (
+        CHUNK_ID_LENGTH.pack(len(raw_id)) + raw_id
+        + CHUNK_HEADER.pack(encoder.start, encoder.end, encoder.count, len(payload))
+        + payload
+    )
+
+
+def iter_chunk_headers(data, source: str):
+    """Walk chunk records, yielding (device_id, start, end, count, payload offset, payload length)"""
+    size = len(data)
+    offset = 0
+    while offset + CHUNK_ID_LENGTH.size <= size:
+        (id_length,) = CHUNK_ID_LENGTH.unpack_from(data, offset)
+        header_at = offset + CHUNK_ID_LENGTH.size + id_length
+        if header_at + CHUNK_HEADER.size > size:
+            break
+        device_id = bytes(data[offset + CHUNK_ID_LENGTH.size:header_at]).decode('utf-8')
+        start, end, count, length = CHUNK_HEADER.unpack_from(data, header_at)
+        payload_at = header_at + CHUNK_HEADER.size
+        if payload_at + length > size:
+            logger.warning(f"Truncated chunk at offset {offset} in {source}, ignoring the tail")
+            break
+        yield device_id, start, end, count, payload_at, length
+        offset = payload_at + length
+
+
+class SensorHistoryStore:
+    """Per-device compressed history with range and downsampled queries"""
+    def __init__(self, directory: str, chunk_points: int = CHUNK_POINTS):
+        self.directory = directory
+        self.chunk_points = chunk_points
+        os.makedirs(directory, exist_ok=True)
+        self.data_path = os.path.join(directory, DATA_FILE)
+        self.open_path = os.path.join(directory, OPEN_CHUNKS_FILE)
+        # device_id -> list of (start, end, count, payload offset, payload length)
+        self.index = {}
+        self.open_chunks = {}
+        self.data_file = open(self.data_path, 'ab')
+        self.mapped = None
+        self.mapped_size = 0
+        self.load_index()
+        self.load_open_chunks()
+
+    def load_index(self):
+        """Rebuild the chunk index by walking the chunk headers"""
+        if os.path.getsize(self.data_path) == 0:
+            return
+        for device_id, start, end, count, payload_at, length in iter_chunk_headers(self.view(), self.data_path):
+            self.index.setdefault(device_id, []).append((start, end, count, payload_at, length))
+
+    def load_open_chunks(self):
+        """Re-open the chunks saved by the last checkpoint"""
+        if not os.path.exists(self.open_path):
+            return
+        with open(self.open_path, 'rb') as f:
+            data = f.read()
+        for device_id, start, end, count, payload_at, length in iter_chunk_headers(data, self.open_path):
+            # Points sealed after the checkpoint was written are already in the data file
+            sealed_until = max((chunk[1] for chunk in self.index.get(device_id, [])), default=-1)
+            for timestamp, temperature, humidity in decode_chunk(data[payload_at:payload_at + length], start, count):
+                if timestamp > sealed_until:
+                    self.append(device_id, timestamp, temperature, humidity)
+
+    def view(self):
+        """Memory-mapped view of the data file, remapped after it grows"""
+        size = os.path.getsize(self.data_path)
+        if self.mapped is None or size > self.mapped_size:
+            if self.mapped is not None:
+                self.mapped.close()
+            self.mapped = None
+            if size:
+                fd = os.open(self.data_path, os.O_RDONLY)
+                try:
+                    self.mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                finally:
+                    os.close(fd)
+            self.mapped_size = size
+        return self.mapped if self.mapped is not None else b''
+
+    def append(self, device_id: str, timestamp: int, temperature=None, humidity=None):
+        """Append one reading; out-of-order points start a new chunk"""
+        encoder = self.open_chunks.get(device_id)
+        if encoder is not None and timestamp < encoder.end:
+            self.seal(device_id)
+            encoder = None
+        if encoder is None:
+            encoder = self.open_chunks[device_id] = ChunkEncoder()
+        encoder.append(int(timestamp), temperature, humidity)
+        if encoder.count >= self.chunk_points:
+            self.seal(device_id)
+
+    def append_readings(self, readings: list):
+        """Append readings in the extract_sensor_data dict format"""
+        for reading in readings:
+            if reading.get('timestamp') is None:
+                continue
+            self.append(reading['device_id'], reading['timestamp'], reading.get('temperature'), reading.get('humidity'))
+
+    def seal(self, device_id: str):
+        """Write a device's open chunk to the data file"""
+        encoder = self.open_chunks.pop(device_id, None)
+        if encoder is None or encoder.count == 0:
+            return
+        chunk = encode_chunk(device_id, encoder)
+        payload_at = self.data_file.tell() + CHUNK_ID_LENGTH.size + len(device_id.encode('utf-8')) + CHUNK_HEADER.size
+        self.data_file.write(chunk)
+        self.data_file.flush()
+        self.index.setdefault(device_id, []).append(
+            (encoder.start, encoder.end, encoder.count, payload_at, self.data_file.tell() - payload_at)
+        )
+
+    def snapshot_open_chunks(self):
+        """Encoded open chunks, taken on the thread that appends so no chunk is torn"""
+        return b''.join(encode_chunk(device_id, encoder) for device_id, encoder in list(self.open_chunks.items()))
+
+    def write_checkpoint(self, snapshot: bytes):
+        """Write a snapshot_open_chunks() result; safe to run in a worker thread"""
+        temp_path = self.open_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(snapshot)
+        os.replace(temp_path, self.open_path)
+
+    def checkpoint(self):
+        """Persist open chunks so they survive a restart"""
+        self.write_checkpoint(self.snapshot_open_chunks())
+
+    def close(self):
+        self.checkpoint()
+        self.data_file.close()
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+    def devices(self):
+        return set(self.index) | set(self.open_chunks)
+
+    def query(self, device_id: str, start: int = 0, end: int = 2 ** 32 - 1):
+        """Get (timestamp, temperature, humidity) points in [start, end], oldest first"""
+        points = []
+        chunks = self.index.get(device_id, [])
+        if chunks:
+            view = self.view()
+            for chunk_start, chunk_end, count, offset, length in chunks:
+                if chunk_end < start or chunk_start > end:
+                    continue
+                decoded = decode_chunk(bytes(view[offset:offset + length]), chunk_start, count)
+                points.extend(p for p in decoded if start <= p[0] <= end)
+        encoder = self.open_chunks.get(device_id)
+        if encoder is not None and encoder.end >= start and encoder.start <= end:
+            points.extend(p for p in encoder.points() if start <= p[0] <= end)
+        points.sort(key=lambda p: p[0])
+        return points
+
+    def downsample(self, device_id: str, start: int, end: int, bucket_seconds: int):
+        """Aggregate a range into fixed buckets.
+        Returns a list of dicts with bucket start, count, and min/max/avg per value.
+        """
+        buckets = {}
+        for timestamp, temperature, humidity in self.query(device_id, start, end):
+            bucket = buckets.setdefault(timestamp - timestamp % bucket_seconds, {
+                'count': 0, 'temperature': [], 'humidity': []
+            })
+            bucket['count'] += 1
+            if temperature is not None:
+                bucket['temperature'].append(temperature)
+            if humidity is not None:
+                bucket['humidity'].append(humidity)
+
+        result = []
+        for bucket_start in sorted(buckets):
+            bucket = buckets[bucket_start]
+            row = {'timestamp': bucket_start, 'count': bucket['count']}
+            for name in ('temperature', 'humidity'):
+                values = bucket[name]
+                row[name] = {
+                    'min': min(values),
+                    'max': max(values),
+                    'avg': round(sum(values) / len(values), 2)
+                } if values else None
+            result.append(row)
+        return result
+
+    def size_bytes(self):
+        return os.path.getsize(self.data_path)